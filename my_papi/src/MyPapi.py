@@ -13,21 +13,405 @@ __status__ = "Production"
 # --------------------------------------------------------------------------- #
 
 # Imports for the module
-from ctypes import CDLL, c_int, c_char_p, POINTER
+from ctypes import CDLL, c_int, c_char_p, c_longlong, c_ulonglong, c_void_p, \
+    POINTER, create_string_buffer
 from locale import setlocale, format_string, LC_ALL
 
 
 # Sets the locale for future prints
 import os
-import pandas as pd
+import sys
+import threading
+import warnings
+import numpy as np
+
+# The callbacks of Keras are in MyPapi_keras and pandas is only needed by
+# read_results, so they are imported the first time they are used: importing
+# this module doesn't load TensorFlow
+_CALLBACKS = ("MyCallbacks", "MeasureOnTrainPhase", "MeasureOnEachEpoch",
+              "MeasureOnDeterminedEpoch", "MeasureOnEachBatch",
+              "MeasureOnEachBatchLap", "MeasureEpochAndBatch",
+              "MeasureGroupsRoundRobin", "ProfileOnTrainPhase")
+
+# Variable of the environment with the configuration of the measure of the
+# child processes (see `MyPapi.enable_workers`), the measure of this
+# process if it is one of them, whether it is a fork not counting yet and
+# whether the hooks of the forks are set
+_WORKERS_ENV = "MYPAPI_WORKERS"
+_workers = None
+_worker = None
+_forked = False
+_forks_hooked = False
+
+# Kinds of overhead calibrated, in the order of enum overhead_kind
+_OVERHEADS = ("stop", "read", "lap")
+
+__all__ = ["read_events", "write_events", "get_cpus", "get_topology",
+           "read_results", "ResultsStore", "MyPapi", "CountedThread",
+           "EventCatalog", "MyPapiGroups", "MyProfiler"] + list(_CALLBACKS)
+# --------------------------------------------------------------------------- #
+
+
+def __getattr__(name):
+    """Imports the callbacks of Keras the first time one of them is used
+    (PEP 562), e.g. `from MyPapi import MeasureOnEachBatch`.
+
+    Parameters
+    ----------
+    name : str
+        Name of the attribute not found in the module
+
+    Returns
+    -------
+    class
+        The callback requested
+
+    Raises
+    ------
+    AttributeError
+        If `name` isn't a callback
+    """
+
+    if name in _CALLBACKS:
+        import MyPapi_keras
+        return getattr(MyPapi_keras, name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+# --------------------------------------------------------------------------- #
+
+
+def read_events(events_file):
+    """Returns the events of a file, one per line, as the library reads them:
+    the blank lines, the comments (#) and the repeated events are skipped.
+
+    Parameters
+    ----------
+    events_file : str
+        Path where the file is located
+
+    Returns
+    -------
+    list
+        Names of the events, in the same order as in the file
+    """
+
+    events = []
+    with open(events_file) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#") and line not in events:
+                events.append(line)
+    return events
+# --------------------------------------------------------------------------- #
+
+def write_events(events_file, events):
+    """Writes the events to a file, one per line, so it can be passed to
+    `MyPapi.prepare_measure`.
+
+    Parameters
+    ----------
+    events_file : str
+        Path where the file is written
+    events : list
+        Names of the events
+    """
+
+    with open(events_file, "w") as f:
+        f.write("".join("%s\n" % e for e in events))
+# --------------------------------------------------------------------------- #
+
+def get_cpus():
+    """Returns the cpus where this process can run (its affinity mask), so a
+    process launched with `taskset` measures just its cpus.
+
+    Returns
+    -------
+    list
+        Ids of the cpus, sorted
+    """
+
+    return sorted(os.sched_getaffinity(0))
+# --------------------------------------------------------------------------- #
+
+def get_topology(cpus):
+    """Returns where each cpu is in the topology of the system, read from
+    /sys/devices/system/cpu. If it isn't available, each cpu is its own core
+    of the socket 0.
+
+    Parameters
+    ----------
+    cpus : list
+        Ids of the cpus
+
+    Returns
+    -------
+    dict
+        Socket and core of each cpu. The core is the first cpu (the lowest
+        id) of its SMT siblings, so it's unique in the system
+    """
+
+    import re
+
+    topology = {}
+    for cpu in cpus:
+        path = "/sys/devices/system/cpu/cpu%d/topology/" % cpu
+        try:
+            with open(path + "physical_package_id") as f:
+                socket = int(f.read())
+            with open(path + "thread_siblings_list") as f:
+                # e.g. "0,32" or "0-1"
+                core = int(re.split(r"[,-]", f.read())[0])
+        except (OSError, ValueError):
+            socket, core = 0, cpu
+        topology[cpu] = (socket, core)
+    return topology
+# --------------------------------------------------------------------------- #
+
+def read_results(output_file, rates=True):
+    """Reads a file written by `MyPapi.print_measure` and creates a pandas
+    DataFrame with a row per measure and cpu (or thread) and a column per
+    event.
+
+    The times of each region are converted to the columns "Real time (s)"
+    and "Virtual time (s)" and, if `rates`, each event is also divided by the
+    real time (column "<event>/s").
+
+    Parameters
+    ----------
+    output_file : str
+        Path of the file with the results
+    rates : bool, optional
+        Whether the events per second are added (default is True)
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+
+    import pandas as pd
+
+    df = pd.read_csv(output_file, header=None, sep=":",
+                     names=["CPU", "Value", "Unit", "Event Name"])
+    # Just the events counted have no unit (the times are in ns, etc.)
+    counted = df.loc[df["Unit"].isnull(), "Event Name"].unique()
+
+    # The n-th value of an event of a cpu belongs to the n-th measure
+    df.insert(0, "# Measure", df.groupby(["CPU", "Event Name"]).cumcount())
+    df = df.pivot_table(index=["# Measure", "CPU"], columns=["Event Name"],
+                        values="Value", aggfunc="first", sort=False)
+    df.columns.name = None
+
+    # Files written before the times were recorded don't have them
+    if "REAL_TIME_END" in df.columns:
+        times = ["REAL_TIME_BEGIN", "REAL_TIME_END", "VIRT_TIME_BEGIN",
+                 "VIRT_TIME_END"]
+        df["Real time (s)"] = (df["REAL_TIME_END"] -
+                               df["REAL_TIME_BEGIN"]) / 1e9
+        df["Virtual time (s)"] = (df["VIRT_TIME_END"] -
+                                  df["VIRT_TIME_BEGIN"]) / 1e9
+        df = df.drop(columns=times)
+        if rates:
+            for event in counted:
+                df[event + "/s"] = df[event] / df["Real time (s)"]
+    return df.reset_index()
+# --------------------------------------------------------------------------- #
+
+class ResultsStore(object):
+    """
+    Append-only store of results in memory, kept in columns (NumPy arrays)
+    with a row per value: the region, its label, the worker (the pid of the
+    child process measured, -1 for this process), the cpu (or thread), the
+    event, the value and the real time (ns) when the region began and ended.
+    The columns grow by doubling, so appending is amortised O(1) per value.
+
+    Attributes
+    ----------
+    self.events : list
+        Names of the events, indexed by the column "event"
+    """
+
+    COLUMNS = ("region", "label", "worker", "cpu", "event", "value",
+               "start_ns", "end_ns")
+
+    def __init__(self, capacity=1024):
+        """
+        ResultsStore class constructor.
+
+        Parameters
+        ----------
+        capacity : int, optional
+            Number of rows reserved initially (default is 1024)
+        """
+
+        super(ResultsStore, self).__init__()
+
+        self.events = []
+        self.__event_ids = {}
+        self.__size = 0
+        # One column per row, so each column is contiguous
+        self.__data = np.empty((len(self.COLUMNS), max(capacity, 1)),
+                               dtype=np.int64)
+    # ----------------------------------------------------------------------- #
+
+    def __len__(self):
+        return self.__size
+    # ----------------------------------------------------------------------- #
+
+    def append(self, values, events, cpus, start_ns, end_ns, region=-1,
+               label=-1, worker=-1):
+        """Appends the values of a measure, a row per cpu and event.
+
+        Parameters
+        ----------
+        values : numpy.ndarray
+            Matrix (cpus x events) with the values
+        events : list
+            Names of the events, one per column of `values`
+        cpus : list
+            Cpu (or thread) of each row of `values`
+        start_ns : int
+            Real time (ns) when the region began
+        end_ns : int
+            Real time (ns) when the region ended
+        region : int, optional
+            Id of the region (default is -1)
+        label : int, optional
+            Label of the region, e.g. the batch (default is -1)
+        worker : int, optional
+            Pid of the child process measured, -1 for this process (default
+            is -1)
+        """
 
-# Forces the program to execute on CPU
-os.environ['CUDA_VISIBLE_DEVICES'] = '0'
-# Just disables the warning, doesn't take advantage of AVX/FMA to run faster
-os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+        num_cpus, num_events = values.shape
+        num_values = num_cpus * num_events
+        self.__reserve(num_values)
+
+        ids = [self.__event_ids.get(e) for e in events]
+        if None in ids:
+            for i, event in enumerate(events):
+                if ids[i] is None:
+                    ids[i] = self.__event_ids[event] = len(self.events)
+                    self.events.append(event)
+
+        block = self.__data[:, self.__size:self.__size + num_values]
+        block[0] = region
+        block[1] = label
+        block[2] = worker
+        block[3] = np.repeat(np.asarray(cpus, dtype=np.int64), num_events)
+        block[4] = np.tile(np.asarray(ids, dtype=np.int64), num_cpus)
+        block[5] = values.ravel()
+        block[6] = start_ns
+        block[7] = end_ns
+        self.__size += num_values
+    # ----------------------------------------------------------------------- #
+
+    def columns(self):
+        """Returns the columns stored, without copying them. They are
+        read-only views, valid until the next append.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        dict
+            Array of int64 of each column, by name (see `COLUMNS`)
+        """
+
+        columns = {}
+        for i, name in enumerate(self.COLUMNS):
+            column = self.__data[i, :self.__size]
+            column.flags.writeable = False
+            columns[name] = column
+        return columns
+    # ----------------------------------------------------------------------- #
+
+    def to_dataframe(self):
+        """Creates a pandas DataFrame with a copy of the columns. The column
+        "event" has the names of the events (categorical).
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        pandas.DataFrame
+        """
+
+        import pandas as pd
+
+        columns = {name: column.copy()
+                   for name, column in self.columns().items()}
+        columns["event"] = pd.Categorical.from_codes(columns["event"],
+                                                     self.events)
+        return pd.DataFrame(columns, columns=list(self.COLUMNS))
+    # ----------------------------------------------------------------------- #
+
+    def save(self, output_file):
+        """Saves the columns and the names of the events in a NumPy file
+        (.npz), which is read by `load`.
+
+        Parameters
+        ----------
+        output_file : str
+            Path (and name) of the file
+        """
+
+        np.savez(output_file, events=np.array(self.events, dtype=str),
+                 **self.columns())
+    # ----------------------------------------------------------------------- #
+
+    @classmethod
+    def load(cls, input_file):
+        """Reads a file saved by `save`.
+
+        Parameters
+        ----------
+        input_file : str
+            Path where the file is located
+
+        Returns
+        -------
+        ResultsStore
+        """
+
+        with np.load(input_file) as data:
+            store = cls(len(data["value"]))
+            for i, name in enumerate(cls.COLUMNS):
+                # Files saved before the column was added
+                store.__data[i, :len(data["value"])] = \
+                    data[name] if name in data.files else -1
+            store.__size = len(data["value"])
+            store.events = data["events"].tolist()
+        store.__event_ids = {e: i for i, e in enumerate(store.events)}
+        return store
+    # ----------------------------------------------------------------------- #
+
+    def clear(self):
+        """Removes the rows stored, keeping the memory reserved.
+
+        Parameters
+        ----------
+        None
+        """
+
+        self.__size = 0
+    # ----------------------------------------------------------------------- #
+
+    def __reserve(self, num_values):
+        """Grows the columns, at least doubling them, to fit `num_values`
+        more rows."""
+
+        capacity = self.__data.shape[1]
+        if self.__size + num_values > capacity:
+            data = np.empty((len(self.COLUMNS),
+                             max(2 * capacity, self.__size + num_values)),
+                            dtype=np.int64)
+            data[:, :self.__size] = self.__data[:, :self.__size]
+            self.__data = data
+    # ----------------------------------------------------------------------- #
 
-# Last import or warnning will appear on screen (libcudart not found)
-from tensorflow import keras
 # --------------------------------------------------------------------------- #
 
 class MyPapi(object):
@@ -39,12 +423,48 @@ class MyPapi(object):
     ----------
     self.p_lib : ctypes.CDLL
         Library of my_papi
+    self.lib_path : str
+        Path to the shared library libmy_papi.so
+    self.session : int
+        Handle of the session of the library used by this object
     self.cpus : list
         List of int where the system will measure the events
     self.events_file : str
         Path where the file with the events is located
     self.output_file : str
         Path where the file with the results is located
+    self.values : numpy.ndarray
+        Matrix (cpus x events) backed by the memory of the library where the
+        results of the last measure are stored
+    self.events : numpy.ndarray
+        Names of the events measured, in the same order as the columns of
+        `self.values`
+    self.cpus_measured : numpy.ndarray
+        Cpus measured by the library, in the same order as the rows of
+        `self.values`. If `self.threads`, the ids of the threads (0 if the
+        row is free)
+    self.threads : bool
+        Whether the rows count the threads of this process instead of cpus
+    self.multiplex : bool
+        Whether the events are multiplexed in the hardware counters
+    self.mpx_values : numpy.ndarray
+        Array (cpus x events x 3) backed by the memory of the library with
+        the raw count and the time enabled and running (ns) of each event in
+        the last measure, if the events are multiplexed
+    self.times : numpy.ndarray
+        Real and virtual time (ns) when the last region began and ended,
+        backed by the memory of the library
+    self.overhead : dict
+        Matrix (cpus x events) with the mean of an empty region, read and
+        lap ("stop", "read" and "lap"), subtracted from the values of each
+        one, or `None` if it isn't calibrated
+    self.overhead_var : dict
+        Matrix (cpus x events) with the variance of each kind of overhead
+    self.noise_floor : dict
+        Total of each event (all cpus) below which a stop, read or lap can't
+        be told apart from its overhead
+    self.results : ResultsStore
+        Results kept in memory by `store_measure`
     """
 
     def __init__(self, lib_path):
@@ -61,16 +481,32 @@ class MyPapi(object):
 
         # Loads the library path
         self.__set_my_lib(lib_path)
+        self.lib_path = str(lib_path)
+
+        # Each object has its own session (event sets and results)
+        self.session = self.p_lib.my_session_create()
+        self.threads = False
+        self.overhead = self.overhead_var = self.noise_floor = None
+        self.__output_file = self.__output_bytes = None
+        # Regions by name, their ids are kept by the next prepares
+        self.__regions = {}
+        self.results = ResultsStore()
+
+        # A child of a process that counts its children starts counting
+        # itself with its first measure (see `enable_workers`)
+        if _worker is None and (_forked or _WORKERS_ENV in os.environ):
+            _start_worker()
     # ----------------------------------------------------------------------- #
 
-    def prepare_measure(self, events_file, cpus=None):
+    def prepare_measure(self, events_file, cpus=None, parallel=False,
+                        multiplex=False, catalog=None, calibrate=0):
         """It performs the necessary adjustments before start measuring.
 
         A file path is passed as a parameter where the events to be measured
         are distributed one per line.
 
         If the argument `cpus` isn't passed in, then the default CPUs to be
-        measured will be all the logical cores of the system.
+        measured will be the ones where this process can run (affinity).
 
         Parameters
         ----------
@@ -78,25 +514,219 @@ class MyPapi(object):
             Path where the file is located
         cpus : list, optional
             List of integers which corresponds to the cpus where we have to
-            measure the events (default is all)
+            measure the events (default is `get_cpus()`)
+        parallel : bool, optional
+            If `True`, the event sets of all the cpus are started and stopped
+            at the same time by one thread per cpu instead of one after
+            another (default is False)
+        multiplex : bool, optional
+            If `True`, the events are multiplexed in the hardware counters, so
+            there can be more events than counters. The values are
+            estimates scaled with the time enabled and running of each event,
+            which are also recorded with the raw counts (default is False)
+        catalog : EventCatalog, optional
+            If passed, the events are validated with the catalog of this host
+            before preparing anything (default is None)
+        calibrate : int, optional
+            If greater than 0, number of empty regions measured by
+            `calibrate` to subtract their overhead (default is 0)
+
+        Raises
+        ------
+        ValueError
+            If the catalog says that some events are unavailable or that they
+            don't fit in the counters without multiplexing
         """
 
+        if catalog is not None:
+            catalog.validate(read_events(events_file), multiplex)
+
         if cpus is None:
-            import multiprocessing
-            cpus = list(range(0, multiprocessing.cpu_count()))
+            cpus = get_cpus()
 
         # Saving the passed arguments
         self.events_file = events_file
         self.cpus = cpus
+        self.multiplex = multiplex
+        self.threads = False
 
         # Now, we have to cast the data to pass them to the C library
         # 1. Encode the string
         # 2. Create a c_int type with the length of the cpu list
         # 3. Cast the cpu list to: int*
         len_cpus = len(cpus)
-        self.p_lib.my_prepare_measure(events_file.encode('utf-8'),
+        self.p_lib.my_session_set_multiplex(self.session, c_int(multiplex))
+        self.p_lib.my_session_prepare(self.session,
+                                      events_file.encode('utf-8'),
                                       c_int(len_cpus),
                                       (c_int * len_cpus)(*cpus))
+
+        # Maps the results of the library, they are the same until re-prepare
+        self.__map_values()
+
+        self.p_lib.my_session_set_parallel(self.session, c_int(parallel))
+
+        if calibrate > 0:
+            self.calibrate(calibrate)
+    # ----------------------------------------------------------------------- #
+
+    def calibrate(self, num_regions=100):
+        """Measures empty regions, reads and laps to know the overhead of the
+        measure itself (the calls to the library and to PAPI) on each cpu and
+        event. A stop pays for a start and a stop, a read for a start and a
+        read and a lap just for a read, so each one is calibrated apart. From
+        now on, their means are subtracted from the values of each stop, read
+        and lap (clamped at 0), and a warning is shown when the total of one
+        of them is within its noise floor (3 standard deviations of its
+        overhead). The next prepare discards them.
+
+        Parameters
+        ----------
+        num_regions : int, optional
+            Number of empty regions, reads and laps measured (default is 100)
+        """
+
+        if self.threads:
+            raise RuntimeError("The overhead of the threads can't be "
+                               "calibrated")
+
+        # The previous calibration would be subtracted from the new one
+        self.overhead = self.overhead_var = self.noise_floor = None
+        for kind in range(len(_OVERHEADS)):
+            self.p_lib.my_session_set_overhead(self.session, kind, None, None)
+
+        samples = {kind: np.empty((num_regions,) + self.values.shape)
+                   for kind in _OVERHEADS}
+        for i in range(num_regions):
+            self.p_lib.my_session_start(self.session)
+            self.p_lib.my_session_stop(self.session)
+            samples["stop"][i] = self.values
+        for i in range(num_regions):
+            self.p_lib.my_session_start(self.session)
+            self.p_lib.my_session_read(self.session)
+            samples["read"][i] = self.values
+            self.p_lib.my_session_stop(self.session)
+        # The first lap also pays for the start
+        self.p_lib.my_session_start(self.session)
+        self.p_lib.my_session_lap(self.session)
+        for i in range(num_regions):
+            self.p_lib.my_session_lap(self.session)
+            samples["lap"][i] = self.values
+        self.p_lib.my_session_stop(self.session)
+
+        self.overhead, self.overhead_var, self.noise_floor = {}, {}, {}
+        for kind, name in enumerate(_OVERHEADS):
+            self.overhead[name] = samples[name].mean(axis=0)
+            self.overhead_var[name] = samples[name].var(axis=0)
+            # The cpus are added up, so are the variances
+            self.noise_floor[name] = \
+                3 * np.sqrt(self.overhead_var[name].sum(axis=0))
+
+            overhead = np.rint(self.overhead[name]).astype(np.int64)
+            noise_floor = np.rint(self.noise_floor[name]).astype(np.int64)
+            self.p_lib.my_session_set_overhead(
+                self.session, kind,
+                overhead.ctypes.data_as(POINTER(c_longlong)),
+                noise_floor.ctypes.data_as(POINTER(c_longlong)))
+    # ----------------------------------------------------------------------- #
+
+    def prepare_threads_measure(self, events_file, max_threads=64,
+                                multiplex=False):
+        """It performs the necessary adjustments to count only the threads
+        of this process, instead of everything that runs on some cpus.
+
+        Each row of the results is a thread, identified by its id. The first
+        one is the thread that calls this method and it is counted between
+        `start_measure` and `stop_measure`. The rest of the threads are
+        counted from the moment they register until they unregister, so they
+        should be created and joined inside the measured region. The threads
+        created with `CountedThread` do it by themselves, the rest must call
+        `register_thread` and `unregister_thread`. Nothing of the `threading`
+        module is changed.
+
+        Parameters
+        ----------
+        events_file : str
+            Path where the file is located
+        max_threads : int, optional
+            Number of rows for the threads, including the calling one. The
+            threads which don't fit aren't counted (default is 64)
+        multiplex : bool, optional
+            If `True`, the events are multiplexed in the hardware counters
+            (default is False)
+        """
+
+        self.events_file = events_file
+        self.cpus = None
+        self.multiplex = multiplex
+
+        self.p_lib.my_session_set_multiplex(self.session, c_int(multiplex))
+        self.p_lib.my_session_prepare_threads(self.session,
+                                              events_file.encode('utf-8'),
+                                              c_int(max_threads))
+        self.__map_values()
+        self.threads = True
+    # ----------------------------------------------------------------------- #
+
+    def prepare_attach_measure(self, events_file, pid, multiplex=False):
+        """It performs the necessary adjustments to count another process
+        (e.g. a training job already running) without modifying it.
+
+        Each row of the results is a thread of the process running now,
+        identified by its id. The threads it creates later are counted in
+        the row of the thread that creates them, so the sum of the rows is
+        the total of the process.
+
+        Parameters
+        ----------
+        events_file : str
+            Path where the file is located
+        pid : int
+            Id of the process to be measured
+        multiplex : bool, optional
+            If `True`, the events are multiplexed in the hardware counters
+            (default is False)
+        """
+
+        self.events_file = events_file
+        self.cpus = None
+        self.multiplex = multiplex
+        self.threads = False
+
+        self.p_lib.my_session_set_multiplex(self.session, c_int(multiplex))
+        self.p_lib.my_session_prepare_attach(self.session,
+                                             events_file.encode('utf-8'),
+                                             c_int(pid))
+        self.__map_values()
+    # ----------------------------------------------------------------------- #
+
+    def register_thread(self):
+        """Starts counting the calling thread in its own row of the results.
+        The measure must be prepared with `prepare_threads_measure`.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        int
+            Row of the thread or -1 if there is no row left
+        """
+
+        return self.p_lib.my_session_register_thread(self.session)
+    # ----------------------------------------------------------------------- #
+
+    def unregister_thread(self):
+        """Stops counting the calling thread. Its values are kept until the
+        next `start_measure`.
+
+        Parameters
+        ----------
+        None
+        """
+
+        self.p_lib.my_session_unregister_thread(self.session)
     # ----------------------------------------------------------------------- #
 
     def start_measure(self):
@@ -107,7 +737,7 @@ class MyPapi(object):
         None
         """
 
-        self.p_lib.my_start_measure()
+        self.p_lib.my_session_start(self.session)
     # ----------------------------------------------------------------------- #
 
     def stop_measure(self):
@@ -118,7 +748,415 @@ class MyPapi(object):
         None
         """
 
-        self.p_lib.my_stop_measure()
+        if self.p_lib.my_session_stop(self.session) > 0:
+            self.__warn_noisy()
+    # ----------------------------------------------------------------------- #
+
+    def next_region(self, label=-1, output_file=None):
+        """Stops the current region, prints it as `print_measure` and starts
+        the next one, with a single call to the library. The first call just
+        starts the first region and the last one is closed with `end_region`,
+        also a single call.
+
+        The label of each region is printed with its values (REGION_LABEL),
+        e.g. the number of the batch.
+
+        Parameters
+        ----------
+        label : int, optional
+            Label of the region that starts, -1 for none (default is -1)
+        output_file : str, optional
+            Path (and name) of the file where the region that ends will be
+            printed (default is the screen)
+        """
+
+        if self.p_lib.my_session_next_region(
+                self.session, self.__encode_output(output_file), label) > 0:
+            self.__warn_noisy()
+    # ----------------------------------------------------------------------- #
+
+    def end_region(self, output_file=None):
+        """Stops the current region and prints it as `print_measure`, with a
+        single call to the library, e.g. to close the last region of
+        `next_region` or a region that doesn't go on with the next one.
+
+        Parameters
+        ----------
+        output_file : str, optional
+            Path (and name) of the file where the region will be printed
+            (default is the screen)
+        """
+
+        if self.p_lib.my_session_stop_print(
+                self.session, self.__encode_output(output_file)) > 0:
+            self.__warn_noisy()
+    # ----------------------------------------------------------------------- #
+
+    def get_skew(self):
+        """Returns the time between the first and the last cpu started and
+        stopped in the last measure.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        tuple
+            Skew (in nanoseconds) of the start and of the stop
+        """
+
+        return (self.p_lib.my_session_get_start_skew(self.session),
+                self.p_lib.my_session_get_stop_skew(self.session))
+    # ----------------------------------------------------------------------- #
+
+    def get_elapsed(self):
+        """Returns the real and virtual time of the last region: from the
+        start (or the previous lap) to the stop, read or lap.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        tuple
+            Real and virtual time (in nanoseconds)
+        """
+
+        real_begin, real_end, virt_begin, virt_end = self.times
+        return real_end - real_begin, virt_end - virt_begin
+    # ----------------------------------------------------------------------- #
+
+    def set_aggregation(self, level=None):
+        """Adds up the cpus in the files written by `print_measure`, so
+        there is a row per core (summing its SMT siblings), per socket or
+        just one for all the cpus. The id of each row is the first cpu of
+        the core, the socket or -1 for all.
+
+        It must be called after preparing the measure and it is reset by the
+        next prepare. The records already printed keep one row per cpu.
+
+        Parameters
+        ----------
+        level : str, optional
+            "core", "socket" or "all". If `None` is passed, each cpu has its
+            own row (default is None)
+        """
+
+        if level is None:
+            self.p_lib.my_session_set_groups(self.session, None)
+            return
+        groups = self.__get_groups(level)
+        self.p_lib.my_session_set_groups(
+            self.session, (c_int * len(groups))(*groups))
+    # ----------------------------------------------------------------------- #
+
+    def aggregate(self, values=None, level="core"):
+        """Adds up the cpus of a matrix of values by core, socket or all.
+
+        Parameters
+        ----------
+        values : numpy.ndarray, optional
+            Matrix (cpus x events) as `self.values` (default is the results
+            of the last measure)
+        level : str, optional
+            "core", "socket" or "all" (default is "core")
+
+        Returns
+        -------
+        values : numpy.ndarray
+            Matrix (groups x events) with the sum of the cpus of each group
+        groups : numpy.ndarray
+            Id of each group, one per row of `values`, as in
+            `set_aggregation`
+        """
+
+        if values is None:
+            values = self.values
+        groups, rows = np.unique(self.__get_groups(level),
+                                 return_inverse=True)
+        totals = np.zeros((len(groups), values.shape[1]), dtype=values.dtype)
+        np.add.at(totals, rows, values)
+        return totals, groups
+    # ----------------------------------------------------------------------- #
+
+    def get_rates(self):
+        """Returns the events of the last region per second of real time.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        numpy.ndarray
+            Matrix (cpus x events) with the events per second of each cpu
+        """
+
+        real, _ = self.get_elapsed()
+        return self.values / (real / 1e9) if real > 0 else \
+            np.zeros(self.values.shape)
+    # ----------------------------------------------------------------------- #
+
+    def read_measure(self):
+        """Reads the counters without stopping them and returns the totals
+        since `start_measure`.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        numpy.ndarray
+            Matrix (cpus x events) with the totals of each cpu
+        """
+
+        if self.p_lib.my_session_read(self.session) > 0:
+            self.__warn_noisy()
+        return self.values.copy()
+    # ----------------------------------------------------------------------- #
+
+    def lap(self):
+        """Reads the counters, which keep counting, and returns the deltas
+        since the previous lap (or since `start_measure` in the first one).
+
+        The counters have to be started once with `start_measure`. Since they
+        are never stopped, consecutive laps have no gap between them. The
+        deltas are also stored as the results of the measure, so
+        `print_measure` can be used after each lap.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        numpy.ndarray
+            Matrix (cpus x events) with the deltas of each cpu
+        """
+
+        if self.p_lib.my_session_lap(self.session) > 0:
+            self.__warn_noisy()
+        return self.values.copy()
+    # ----------------------------------------------------------------------- #
+
+    def reset_measure(self):
+        """Sets the counters to zero without stopping them. The next lap
+        counts from this point.
+
+        Parameters
+        ----------
+        None
+        """
+
+        self.p_lib.my_session_reset(self.session)
+    # ----------------------------------------------------------------------- #
+
+    def region(self, name):
+        """Returns a context manager that measures a region of code, which
+        can be nested in other regions:
+
+            with mp.region("train"):
+                with mp.region("forward"):
+                    ...
+
+        The first region starts the measure if it isn't. The counters are
+        only read (never stopped) when entering and exiting the regions, so
+        they all come from the same stream. The values are added up per name
+        in the library and read with `read_regions`. The regions must be
+        entered and exited in the same thread.
+
+        Parameters
+        ----------
+        name : str
+            Name of the region
+
+        Returns
+        -------
+        _Region
+            Context manager of the region, the same for the same name
+        """
+
+        region = self.__regions.get(name)
+        if region is None:
+            region = self.__regions[name] = _Region(self, len(self.__regions))
+        return region
+    # ----------------------------------------------------------------------- #
+
+    def measure(self, func=None, name=None):
+        """Decorator that measures each call to a function as a region (see
+        `region`), used as `@mp.measure` or `@mp.measure(name="step")`.
+
+        Parameters
+        ----------
+        func : function, optional
+            Function decorated
+        name : str, optional
+            Name of the region (default is the qualified name of `func`)
+
+        Returns
+        -------
+        function
+            The function decorated, or the decorator if `func` isn't passed
+        """
+
+        import functools
+
+        if func is None:
+            return functools.partial(self.measure, name=name)
+        region = self.region(func.__qualname__ if name is None else name)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with region:
+                return func(*args, **kwargs)
+        return wrapper
+    # ----------------------------------------------------------------------- #
+
+    def read_regions(self):
+        """Returns the totals of the regions exited since the prepare (or
+        `reset_regions`). The inclusive values count the whole region and
+        the exclusive ones subtract the regions nested in it.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        dict
+            For each name of region: "count" (number of exits),
+            "real_inclusive" and "real_exclusive" (real time in ns) and
+            "inclusive" and "exclusive" (matrices cpus x events)
+        """
+
+        num_ids = self.p_lib.my_session_get_num_regions(self.session)
+        if num_ids == 0:
+            return {}
+        num_cpus, num_events = self.values.shape
+        size = num_cpus * num_events
+        totals = np.ctypeslib.as_array(
+            self.p_lib.my_session_get_regions(self.session),
+            shape=(num_ids, 3 + 2 * size)).copy()
+
+        regions = {}
+        for name, region in self.__regions.items():
+            if region.id < num_ids and totals[region.id, 0] > 0:
+                count, real_inclusive, real_exclusive = totals[region.id, :3]
+                regions[name] = {
+                    "count": int(count),
+                    "real_inclusive": int(real_inclusive),
+                    "real_exclusive": int(real_exclusive),
+                    "inclusive": totals[region.id, 3:3 + size].reshape(
+                        num_cpus, num_events),
+                    "exclusive": totals[region.id, 3 + size:].reshape(
+                        num_cpus, num_events)}
+        return regions
+    # ----------------------------------------------------------------------- #
+
+    def reset_regions(self):
+        """Sets the totals of the regions to zero.
+
+        Parameters
+        ----------
+        None
+        """
+
+        self.p_lib.my_session_clear_regions(self.session)
+    # ----------------------------------------------------------------------- #
+
+    def publish_measure(self, live_file=None):
+        """Publishes the values of each stop, read, lap and sample in a file
+        mapped in memory, so they can be watched from another process (see
+        live.py) without slowing down this one.
+
+        It must be called after preparing the measure and it stops with the
+        next prepare.
+
+        Parameters
+        ----------
+        live_file : str, optional
+            Path of the file. If `None` is passed, the values aren't
+            published anymore (default is None)
+        """
+
+        if live_file is not None:
+            live_file = live_file.encode('utf-8')
+        self.p_lib.my_session_publish(self.session, live_file)
+    # ----------------------------------------------------------------------- #
+
+    def start_sampler(self, interval_us=1000, max_samples=4096):
+        """Starts a thread of the library that reads the counters of all the
+        cpus periodically, without any cost for Python.
+
+        The measure must be started with `start_measure`. The samples are
+        kept in a ring buffer of `max_samples` until `fetch_samples` is
+        called; if it gets full, the new samples are discarded.
+
+        The sampler and the rest of the calls of this object (`read_measure`,
+        `lap`, `reset_measure` and the regions) read the counters one at a
+        time, so they can be used meanwhile. `stop_measure` stops
+        the sampler before stopping the counters.
+
+        Parameters
+        ----------
+        interval_us : float, optional
+            Time between two samples in microseconds (default is 1000)
+        max_samples : int, optional
+            Number of samples that fit in the ring buffer (default is 4096)
+        """
+
+        self.p_lib.my_session_start_sampler(self.session,
+                                            c_longlong(int(interval_us * 1000)),
+                                            c_int(max_samples))
+    # ----------------------------------------------------------------------- #
+
+    def stop_sampler(self):
+        """Stops the sampler thread. The samples not fetched yet are kept.
+
+        Parameters
+        ----------
+        None
+        """
+
+        self.p_lib.my_session_stop_sampler(self.session)
+    # ----------------------------------------------------------------------- #
+
+    def fetch_samples(self):
+        """Moves the samples taken by the sampler to a numpy array.
+
+        The values of each sample are the totals since `start_measure`, so
+        the deltas between samples can be obtained with `numpy.diff`.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        timestamps : numpy.ndarray
+            Time (ns) when each sample was taken
+        values : numpy.ndarray
+            Array (samples x cpus x events) of int64 with the values
+        dropped : int
+            Number of samples discarded since the sampler was started because
+            the ring buffer was full
+        """
+
+        num_cpus, num_events = self.values.shape
+        num_samples = self.p_lib.my_session_get_num_samples(self.session)
+        samples = np.empty((num_samples, 1 + num_cpus * num_events),
+                           dtype=np.int64)
+        num_samples = self.p_lib.my_session_fetch_samples(
+            self.session, samples.ctypes.data_as(POINTER(c_longlong)),
+            c_int(num_samples))
+        samples = samples[:num_samples]
+        dropped = self.p_lib.my_session_get_dropped_samples(self.session)
+        return (samples[:, 0],
+                samples[:, 1:].reshape(num_samples, num_cpus, num_events),
+                dropped)
     # ----------------------------------------------------------------------- #
 
     def print_measure(self, output_file=None):
@@ -137,19 +1175,269 @@ class MyPapi(object):
         if output_file is not None:
             output_file = output_file.encode('utf-8')
 
-        self.p_lib.my_print_measure(output_file)
+        self.p_lib.my_session_print(self.session, output_file)
+    # ----------------------------------------------------------------------- #
+
+    def enable_workers(self, workers_dir):
+        """Counts the child processes created from now on, e.g. the workers
+        of Keras with `use_multiprocessing=True`, with the events of this
+        measure. Each child counts all its threads from its beginning and,
+        when it exits, leaves its totals in `workers_dir`, which are merged
+        with `collect_workers`.
+
+        The processes forked by `multiprocessing` are counted as soon as
+        they start, before running their target. The rest of the children
+        (spawned or forked by other means) are counted from their first
+        measure, i.e. when they create an object of this class. The library
+        inherited by a fork forgets the sessions of this process without
+        touching its counters, so the objects of this class inherited can't
+        be used in the child.
+
+        Parameters
+        ----------
+        workers_dir : str
+            Folder where the children leave their totals
+        """
+
+        global _workers
+        import json
+
+        os.makedirs(workers_dir, exist_ok=True)
+        _workers = {"lib_path": self.lib_path,
+                    "events_file": str(self.events_file),
+                    "multiplex": self.multiplex,
+                    "workers_dir": str(workers_dir),
+                    "pid": os.getpid()}
+        # Inherited by the processes spawned
+        os.environ[_WORKERS_ENV] = json.dumps(_workers)
+        _hook_forks()
+    # ----------------------------------------------------------------------- #
+
+    def disable_workers(self):
+        """The child processes created from now on aren't counted.
+
+        Parameters
+        ----------
+        None
+        """
+
+        global _workers
+
+        _workers = None
+        os.environ.pop(_WORKERS_ENV, None)
+    # ----------------------------------------------------------------------- #
+
+    def collect_workers(self, workers_dir, region=-1, label=-1):
+        """Moves the totals left by the children that exited (see
+        `enable_workers`) to `self.results`, with their pid in the column
+        "worker", so the cost of the input pipeline can be compared with
+        the one of this process.
+
+        Parameters
+        ----------
+        workers_dir : str
+            Folder where the children leave their totals
+        region : int, optional
+            Id of the region of the rows (default is -1)
+        label : int, optional
+            Label of the rows (default is -1)
+
+        Returns
+        -------
+        int
+            Number of children collected
+        """
+
+        names = sorted(f for f in os.listdir(workers_dir)
+                       if f.startswith("worker_") and f.endswith(".npz"))
+        for name in names:
+            path = os.path.join(workers_dir, name)
+            with np.load(path) as data:
+                self.results.append(data["values"], data["events"].tolist(),
+                                    data["cpus"], data["times"][0],
+                                    data["times"][1], region, label,
+                                    int(data["pid"]))
+            os.remove(path)
+        return len(names)
+    # ----------------------------------------------------------------------- #
+
+    def store_measure(self, region=-1, label=-1):
+        """Appends the results of the last measure (stop, read or lap) to
+        `self.results`, in memory, instead of printing them.
+
+        Parameters
+        ----------
+        region : int, optional
+            Id of the region measured (default is -1)
+        label : int, optional
+            Label of the region, e.g. the batch (default is -1)
+        """
+
+        self.results.append(self.values, self.events, self.cpus_measured,
+                            self.times[0], self.times[1], region, label)
+    # ----------------------------------------------------------------------- #
+
+    def flush_measure(self):
+        """Writes the results buffered by `print_measure` to their files.
+
+        The results printed to a file are kept in memory and written in bulk
+        when the buffer is full or the measure is finalized. Call this method
+        when the file must be read before that.
+
+        Parameters
+        ----------
+        None
+        """
+
+        self.p_lib.my_session_flush(self.session)
+    # ----------------------------------------------------------------------- #
+
+    def read_values(self):
+        """Returns the results of the last measure without copying them.
+
+        The matrix of values is a view of the memory of the library, so it is
+        updated in place by the next `stop_measure`. Use `values.copy()` to
+        keep the results of a measure.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        values : numpy.ndarray
+            Matrix (cpus x events) of int64 with the value of each event
+        events : numpy.ndarray
+            Names of the events, one per column of `values`
+        cpus : numpy.ndarray
+            Cpus measured, one per row of `values`
+        """
+
+        return self.values, self.events, self.cpus_measured
+    # ----------------------------------------------------------------------- #
+
+    def read_multiplex(self):
+        """Returns the raw values of the last measure and the times used to
+        scale them when the events are multiplexed, without copying them.
+
+        Each value of `self.values` is the estimate `raw * enabled / running`
+        of its event, or 0 if it was never in a counter.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        raw : numpy.ndarray
+            Matrix (cpus x events) with the values really counted
+        enabled : numpy.ndarray
+            Matrix (cpus x events) with the time (ns) each event was enabled
+        running : numpy.ndarray
+            Matrix (cpus x events) with the time (ns) each event was in a
+            counter
+
+        Raises
+        ------
+        RuntimeError
+            If the events aren't multiplexed
+        """
+
+        if not self.multiplex:
+            raise RuntimeError("The measure isn't multiplexed")
+
+        return (self.mpx_values[:, :, 0], self.mpx_values[:, :, 1],
+                self.mpx_values[:, :, 2])
     # ----------------------------------------------------------------------- #
 
     def finalize_measure(self):
-        """Calls the C function with the same name which will stop the my_papi
-        library and free the memory used.
+        """Destroys the session of this object, writing its buffered results.
+        The my_papi library is stopped when the last session is destroyed.
 
         Parameters
         ----------
         None
         """
 
-        self.p_lib.my_finalize_measure()
+        if self.session is not None:
+            self.threads = False
+            self.p_lib.my_session_destroy(self.session)
+            self.session = None
+    # ----------------------------------------------------------------------- #
+
+    def __encode_output(self, output_file):
+        """
+        Returns the path of the output file encoded for the library. It's
+        encoded again only when it changes, so the regions don't pay for it.
+        """
+
+        if output_file != self.__output_file:
+            self.__output_file = output_file
+            self.__output_bytes = None if output_file is None else \
+                output_file.encode('utf-8')
+        return self.__output_bytes
+    # ----------------------------------------------------------------------- #
+
+    def __warn_noisy(self):
+        """
+        Warns about the events of the last stop, read or lap within the noise
+        floor of the measure (marked by the library).
+        """
+
+        warnings.warn("[MyPapi] Warning: the region is within the noise "
+                      "floor of the measure for %s"
+                      % ", ".join(self.events[self.__noisy != 0]),
+                      stacklevel=3)
+    # ----------------------------------------------------------------------- #
+
+    def __get_groups(self, level):
+        """Returns the group (core, socket or all) of each cpu measured."""
+
+        if self.threads:
+            raise RuntimeError("The rows of the threads can't be aggregated")
+        if level == "all":
+            return [-1] * len(self.cpus_measured)
+        if level not in ("core", "socket"):
+            raise ValueError("Wrong level of aggregation '%s'" % level)
+        topology = get_topology(self.cpus_measured)
+        index = 1 if level == "core" else 0
+        return [topology[cpu][index] for cpu in self.cpus_measured]
+    # ----------------------------------------------------------------------- #
+
+    def __map_values(self):
+        """
+        Creates the numpy arrays backed by the results, cpus and events of the
+        library. It must be called after each `prepare_measure`.
+
+        Parameters
+        ----------
+        None
+        """
+
+        num_cpus = self.p_lib.my_session_get_num_cpus(self.session)
+        num_events = self.p_lib.my_session_get_num_events(self.session)
+
+        # The rows aren't padded, there is one value per event
+        self.values = np.ctypeslib.as_array(
+            self.p_lib.my_session_get_values(self.session),
+            shape=(num_cpus, num_events))
+        self.cpus_measured = np.ctypeslib.as_array(
+            self.p_lib.my_session_get_cpus(self.session),
+            shape=(num_cpus,))
+        self.events = np.array(
+            [self.p_lib.my_session_get_event_name(self.session, i).decode('utf-8')
+             for i in range(num_events)])
+        if self.multiplex:
+            self.mpx_values = np.ctypeslib.as_array(
+                self.p_lib.my_session_get_multiplex_values(self.session),
+                shape=(num_cpus, num_events, 3))
+        self.times = np.ctypeslib.as_array(
+            self.p_lib.my_session_get_times(self.session), shape=(4,))
+        self.__noisy = np.ctypeslib.as_array(
+            self.p_lib.my_session_get_noisy(self.session),
+            shape=(num_events,))
+        # The overhead is discarded by the library on each prepare
+        self.overhead = self.overhead_var = self.noise_floor = None
     # ----------------------------------------------------------------------- #
 
     def __set_my_lib(self, lib_path):
@@ -163,502 +1451,1333 @@ class MyPapi(object):
             Path to the library
         """
 
-        # _library_file = lib_path
-        self.p_lib = CDLL(lib_path)
+        # _library_file = lib_path
+        self.p_lib = CDLL(lib_path)
+
+        # ------------------------------------------------------------------- #
+        # my_session_t *my_session_create()
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_session_create.argtypes = None
+        self.p_lib.my_session_create.restype = c_void_p
+
+        # ------------------------------------------------------------------- #
+        # int my_session_prepare(my_session_t *session, char *input_file_name,
+        #                        int num_cpus, int *cpus)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_session_prepare.argtypes = [
+            c_void_p, c_char_p, c_int, POINTER(c_int)]
+        self.p_lib.my_session_prepare.restype = c_int
+
+        # ------------------------------------------------------------------- #
+        # int my_session_prepare_threads(my_session_t *session,
+        #                                char *input_file_name,
+        #                                int max_threads)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_session_prepare_threads.argtypes = [
+            c_void_p, c_char_p, c_int]
+        self.p_lib.my_session_prepare_threads.restype = c_int
+
+        # ------------------------------------------------------------------- #
+        # int my_session_prepare_attach(my_session_t *session,
+        #                               char *input_file_name, int pid)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_session_prepare_attach.argtypes = [
+            c_void_p, c_char_p, c_int]
+        self.p_lib.my_session_prepare_attach.restype = c_int
+
+        # ------------------------------------------------------------------- #
+        # int my_session_register_thread(my_session_t *session)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_session_register_thread.argtypes = [c_void_p]
+        self.p_lib.my_session_register_thread.restype = c_int
+
+        # ------------------------------------------------------------------- #
+        # int my_session_unregister_thread(my_session_t *session)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_session_unregister_thread.argtypes = [c_void_p]
+        self.p_lib.my_session_unregister_thread.restype = c_int
+
+        # ------------------------------------------------------------------- #
+        # int my_session_start(my_session_t *session)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_session_start.argtypes = [c_void_p]
+        self.p_lib.my_session_start.restype = c_int
+
+        # ------------------------------------------------------------------- #
+        # int my_session_stop(my_session_t *session)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_session_stop.argtypes = [c_void_p]
+        self.p_lib.my_session_stop.restype = c_int
+
+        # ------------------------------------------------------------------- #
+        # int my_session_next_region(my_session_t *session,
+        #                            char *output_file_name, long long label)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_session_next_region.argtypes = [c_void_p, c_char_p,
+                                                      c_longlong]
+        self.p_lib.my_session_next_region.restype = c_int
+
+        # ------------------------------------------------------------------- #
+        # int my_session_stop_print(my_session_t *session,
+        #                           char *output_file_name)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_session_stop_print.argtypes = [c_void_p, c_char_p]
+        self.p_lib.my_session_stop_print.restype = c_int
+
+        # ------------------------------------------------------------------- #
+        # int my_session_read(my_session_t *session)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_session_read.argtypes = [c_void_p]
+        self.p_lib.my_session_read.restype = c_int
+
+        # ------------------------------------------------------------------- #
+        # int my_session_lap(my_session_t *session)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_session_lap.argtypes = [c_void_p]
+        self.p_lib.my_session_lap.restype = c_int
+
+        # ------------------------------------------------------------------- #
+        # int my_session_reset(my_session_t *session)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_session_reset.argtypes = [c_void_p]
+        self.p_lib.my_session_reset.restype = c_int
+
+        # ------------------------------------------------------------------- #
+        # int my_session_enter_region(my_session_t *session, int region)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_session_enter_region.argtypes = [c_void_p, c_int]
+        self.p_lib.my_session_enter_region.restype = c_int
+
+        # ------------------------------------------------------------------- #
+        # int my_session_exit_region(my_session_t *session)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_session_exit_region.argtypes = [c_void_p]
+        self.p_lib.my_session_exit_region.restype = c_int
+
+        # ------------------------------------------------------------------- #
+        # long long *my_session_get_regions(my_session_t *session)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_session_get_regions.argtypes = [c_void_p]
+        self.p_lib.my_session_get_regions.restype = POINTER(c_longlong)
+
+        # ------------------------------------------------------------------- #
+        # int my_session_get_num_regions(my_session_t *session)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_session_get_num_regions.argtypes = [c_void_p]
+        self.p_lib.my_session_get_num_regions.restype = c_int
+
+        # ------------------------------------------------------------------- #
+        # int my_session_clear_regions(my_session_t *session)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_session_clear_regions.argtypes = [c_void_p]
+        self.p_lib.my_session_clear_regions.restype = c_int
+
+        # ------------------------------------------------------------------- #
+        # int my_session_set_parallel(my_session_t *session, int enable)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_session_set_parallel.argtypes = [c_void_p, c_int]
+        self.p_lib.my_session_set_parallel.restype = c_int
+
+        # ------------------------------------------------------------------- #
+        # int my_session_publish(my_session_t *session, char *live_file_name)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_session_publish.argtypes = [c_void_p, c_char_p]
+        self.p_lib.my_session_publish.restype = c_int
+
+        # ------------------------------------------------------------------- #
+        # int my_session_set_overhead(my_session_t *session, int kind,
+        #                             long long *overhead,
+        #                             long long *noise_floor)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_session_set_overhead.argtypes = [
+            c_void_p, c_int, POINTER(c_longlong), POINTER(c_longlong)]
+        self.p_lib.my_session_set_overhead.restype = c_int
+
+        # ------------------------------------------------------------------- #
+        # int *my_session_get_noisy(my_session_t *session)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_session_get_noisy.argtypes = [c_void_p]
+        self.p_lib.my_session_get_noisy.restype = POINTER(c_int)
+
+        # ------------------------------------------------------------------- #
+        # int my_session_set_groups(my_session_t *session, int *groups)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_session_set_groups.argtypes = [c_void_p, POINTER(c_int)]
+        self.p_lib.my_session_set_groups.restype = c_int
+
+        # ------------------------------------------------------------------- #
+        # int my_session_set_multiplex(my_session_t *session, int enable)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_session_set_multiplex.argtypes = [c_void_p, c_int]
+        self.p_lib.my_session_set_multiplex.restype = c_int
+
+        # ------------------------------------------------------------------- #
+        # long long *my_session_get_multiplex_values(my_session_t *session)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_session_get_multiplex_values.argtypes = [c_void_p]
+        self.p_lib.my_session_get_multiplex_values.restype = POINTER(
+            c_longlong)
+
+        # ------------------------------------------------------------------- #
+        # long long *my_session_get_times(my_session_t *session)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_session_get_times.argtypes = [c_void_p]
+        self.p_lib.my_session_get_times.restype = POINTER(c_longlong)
+
+        # ------------------------------------------------------------------- #
+        # long long my_session_get_start_skew(my_session_t *session)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_session_get_start_skew.argtypes = [c_void_p]
+        self.p_lib.my_session_get_start_skew.restype = c_longlong
+
+        # ------------------------------------------------------------------- #
+        # long long my_session_get_stop_skew(my_session_t *session)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_session_get_stop_skew.argtypes = [c_void_p]
+        self.p_lib.my_session_get_stop_skew.restype = c_longlong
+
+        # ------------------------------------------------------------------- #
+        # int my_session_start_sampler(my_session_t *session,
+        #                              long long interval_ns, int max_samples)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_session_start_sampler.argtypes = [
+            c_void_p, c_longlong, c_int]
+        self.p_lib.my_session_start_sampler.restype = c_int
+
+        # ------------------------------------------------------------------- #
+        # int my_session_stop_sampler(my_session_t *session)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_session_stop_sampler.argtypes = [c_void_p]
+        self.p_lib.my_session_stop_sampler.restype = c_int
+
+        # ------------------------------------------------------------------- #
+        # int my_session_get_num_samples(my_session_t *session)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_session_get_num_samples.argtypes = [c_void_p]
+        self.p_lib.my_session_get_num_samples.restype = c_int
+
+        # ------------------------------------------------------------------- #
+        # long long my_session_get_dropped_samples(my_session_t *session)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_session_get_dropped_samples.argtypes = [c_void_p]
+        self.p_lib.my_session_get_dropped_samples.restype = c_longlong
+
+        # ------------------------------------------------------------------- #
+        # int my_session_fetch_samples(my_session_t *session,
+        #                              long long *samples, int max_samples)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_session_fetch_samples.argtypes = [
+            c_void_p, POINTER(c_longlong), c_int]
+        self.p_lib.my_session_fetch_samples.restype = c_int
+
+        # ------------------------------------------------------------------- #
+        # int my_session_print(my_session_t *session, char *output_file_name)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_session_print.argtypes = [c_void_p, c_char_p]
+        self.p_lib.my_session_print.restype = c_int
+
+        # ------------------------------------------------------------------- #
+        # int my_session_flush(my_session_t *session)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_session_flush.argtypes = [c_void_p]
+        self.p_lib.my_session_flush.restype = c_int
+
+        # ------------------------------------------------------------------- #
+        # int my_session_destroy(my_session_t *session)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_session_destroy.argtypes = [c_void_p]
+        self.p_lib.my_session_destroy.restype = c_int
 
         # ------------------------------------------------------------------- #
-        # int my_prepare_measure(char *input_file_name, int num_cpus,
-        #                       int *cpus)
+        # long long *my_session_get_values(my_session_t *session)
         # ------------------------------------------------------------------- #
-        self.p_lib.my_prepare_measure.argtypes = [
-            c_char_p, c_int, POINTER(c_int)]
-        self.p_lib.my_prepare_measure.restype = c_int
+        self.p_lib.my_session_get_values.argtypes = [c_void_p]
+        self.p_lib.my_session_get_values.restype = POINTER(c_longlong)
 
         # ------------------------------------------------------------------- #
-        # int my_start_measure()
+        # int my_session_get_num_cpus(my_session_t *session)
         # ------------------------------------------------------------------- #
-        self.p_lib.my_start_measure.argtypes = None
-        self.p_lib.my_start_measure.restype = c_int
+        self.p_lib.my_session_get_num_cpus.argtypes = [c_void_p]
+        self.p_lib.my_session_get_num_cpus.restype = c_int
 
         # ------------------------------------------------------------------- #
-        # int my_stop_measure()
+        # int *my_session_get_cpus(my_session_t *session)
         # ------------------------------------------------------------------- #
-        self.p_lib.my_stop_measure.argtypes = None
-        self.p_lib.my_stop_measure.restype = c_int
+        self.p_lib.my_session_get_cpus.argtypes = [c_void_p]
+        self.p_lib.my_session_get_cpus.restype = POINTER(c_int)
 
         # ------------------------------------------------------------------- #
-        # int my_print_measure(char *output_file_name)
+        # int my_session_get_num_events(my_session_t *session)
         # ------------------------------------------------------------------- #
-        self.p_lib.my_print_measure.argtypes = [c_char_p]
-        self.p_lib.my_print_measure.restype = c_int
+        self.p_lib.my_session_get_num_events.argtypes = [c_void_p]
+        self.p_lib.my_session_get_num_events.restype = c_int
 
         # ------------------------------------------------------------------- #
-        # int my_finalize_measure()
+        # const char *my_session_get_event_name(my_session_t *session,
+        #                                       int index)
         # ------------------------------------------------------------------- #
-        self.p_lib.my_finalize_measure.argtypes = None
-        self.p_lib.my_finalize_measure.restype = c_int
+        self.p_lib.my_session_get_event_name.argtypes = [c_void_p, c_int]
+        self.p_lib.my_session_get_event_name.restype = c_char_p
     # ----------------------------------------------------------------------- #
 
 # --------------------------------------------------------------------------- #
 
-class MyCallbacks(keras.callbacks.Callback):
+class CountedThread(threading.Thread):
     """
-    Abstact class which have custom callbacks to use with my_papi library.
+    Thread counted in its own row of a measure prepared with
+    `MyPapi.prepare_threads_measure`. It registers before running its target
+    and unregisters explicitly when it finishes, both in the thread itself.
+    Subclasses that override `run` must call `CountedThread.run` or register
+    by themselves.
 
     Attributes
     ----------
-    self.mp : my_papi
-        Oject of the class my_papi
-    self.output_file : str
-        Path (and name) of the file where the results will be printed. If it's
-        `None`, then the results will be printed on screen
+    self.mp : MyPapi
+        Object of the measure that counts the thread
+    """
+
+    def __init__(self, mp, *args, **kwargs):
+        """
+        Class Constructor to initialize the object.
+
+        Parameters
+        ----------
+        mp : MyPapi
+            Object of the measure that counts the thread
+        *args, **kwargs
+            Arguments of `threading.Thread`
+        """
+
+        super(CountedThread, self).__init__(*args, **kwargs)
+        self.mp = mp
+
+    def run(self):
+        """Runs the target of the thread between its register and its
+        unregister."""
+
+        registered = (self.mp.session is not None
+                      and self.mp.register_thread() >= 0)
+        try:
+            super(CountedThread, self).run()
+        finally:
+            if registered and self.mp.session is not None:
+                self.mp.unregister_thread()
+# --------------------------------------------------------------------------- #
+
+class _Region(object):
+    """
+    Context manager returned by `MyPapi.region`. The functions of the library
+    are looked up once, so entering and exiting it is just a call each.
+    """
+
+    def __init__(self, mp, region):
+        self.mp = mp
+        self.id = region
+        self.__enter = mp.p_lib.my_session_enter_region
+        self.__exit = mp.p_lib.my_session_exit_region
+
+    def __enter__(self):
+        self.__enter(self.mp.session, self.id)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.__exit(self.mp.session)
+        return False
+# --------------------------------------------------------------------------- #
+
+class EventCatalog(object):
+    """
+    Catalog of the events of this host, stored in a cache on disk per cpu
+    model and kernel, so the PMU is probed once instead of on every run.
+
+    The presets and native events (with their unit masks) are enumerated when
+    the cache is built. The rest of the names (e.g. aliases) and the groups of
+    events are probed the first time they are checked and the result is
+    added to the cache.
+
+    Attributes
+    ----------
+    self.p_lib : ctypes.CDLL
+        Library of my_papi
+    self.key : str
+        Cpu model and kernel of this host
+    self.path : str
+        Path of the cache file
+    self.num_counters : int
+        Number of hardware counters of the cpu
+    self.events : set
+        Names of the presets and native events enumerated
+    self.checked : dict
+        Whether each event probed can be counted
+    self.groups : dict
+        Whether each group of events probed fits in the counters, by the
+        names of the group sorted and joined with commas
+    self.plans : dict
+        Groups planned for each list of events, by the names joined with
+        commas
     """
 
-    def __init__(self, lib_path, events_file, output_file=None):
+    # Groups probed by `plan` kept in memory (least recently used first),
+    # which aren't saved in the cache
+    MAX_PROBES = 4096
+
+    def __init__(self, lib_path, cache_dir=None, rebuild=False):
         """
-        My_callbacks class constructor to initialize the object.
+        EventCatalog class constructor. It loads the cache of this host or
+        builds it if there is none.
 
         Parameters
         ----------
         lib_path : str
             Path to the shared library libmy_papi.so
-        events_file : str
-            Path where the file, with the events to be measured, is located
-        output_file : str, optional
-            Path (and name) of the file where the results will be printed. If
-            `None` is passed, then the results will be printed on screen
+        cache_dir : str, optional
+            Folder of the cache files (default is ~/.cache/my_papi)
+        rebuild : bool, optional
+            If `True`, the cache is built again (default is False)
         """
 
-        super(MyCallbacks, self).__init__()
+        super(EventCatalog, self).__init__()
+
+        import platform
+        import re
+        from collections import OrderedDict
 
-        # Creates an object of the class my_papi
-        self.mp = MyPapi(lib_path=lib_path)
+        self.p_lib = CDLL(lib_path)
+        self.__set_my_lib()
+
+        if cache_dir is None:
+            cache_dir = os.path.join(
+                os.environ.get("XDG_CACHE_HOME",
+                               os.path.expanduser("~/.cache")), "my_papi")
+        self.key = "%s %s" % (self.__get_cpu_model(), platform.release())
+        self.path = os.path.join(cache_dir,
+                                 re.sub(r"[^\w.-]+", "_", self.key) + ".json")
+
+        self.__probes = OrderedDict()
+        if rebuild or not self.__load():
+            self.build()
+    # ----------------------------------------------------------------------- #
 
-        # Prepares the measure on ALL cpus
-        # ! modify this to get the num of cpus automatic
-        # cpus = None
-        self.cpus = list(range(2, 32))
-        # self.cpus = [2]
-        self.mp.prepare_measure(events_file=events_file, cpus=self.cpus)
+    def build(self):
+        """Enumerates the events of this host and saves the cache.
 
-        # Save the output file variable for later
-        self.output_file = output_file
+        Parameters
+        ----------
+        None
+        """
+
+        # The length needed is returned when the buffer is too small
+        length = 1 << 20
+        while True:
+            buffer = create_string_buffer(length)
+            needed = self.p_lib.my_catalog_list_events(buffer, c_int(length))
+            if needed < length:
+                break
+            length = needed + 1
+        self.events = set(buffer.value.decode('utf-8').split())
+        self.num_counters = self.p_lib.my_catalog_get_num_counters()
+        self.checked = {}
+        self.groups = {}
+        self.plans = {}
+        self.save()
+    # ----------------------------------------------------------------------- #
+
+    def save(self):
+        """Writes the catalog to its cache file.
 
-        # We have to decompose the path, name and extension of the output file
-        if self.output_file is not None:
-            # Gets an array with head + tail: path + file_name
-            self.head_tail = os.path.split(output_file)
-            self.name_extension = os.path.splitext(self.head_tail[1])
+        Parameters
+        ----------
+        None
+        """
 
-    # --------------------------- Global methods ---------------------------- #
-    def on_train_begin(self, logs=None):
-        """Called at the beginning of fit."""
+        import json
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # Written aside and renamed, so a reader never sees half a file
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"key": self.key,
+                       "num_counters": self.num_counters,
+                       "events": sorted(self.events),
+                       "checked": self.checked,
+                       "groups": self.groups,
+                       "plans": self.plans}, f, indent=1)
+        os.replace(tmp_path, self.path)
+    # ----------------------------------------------------------------------- #
 
-        pass
+    def available(self, events):
+        """Returns which events can be counted in this host.
 
-    def on_train_end(self, logs=None):
-        """Called at the end of fit."""
+        Parameters
+        ----------
+        events : list
+            Names of the events
 
-        pass
+        Returns
+        -------
+        list
+            A bool per event
+        """
 
-    def on_test_begin(self, logs=None):
-        """Called at the beginning of evaluate."""
+        unknown = [e for e in events
+                   if e not in self.events and e not in self.checked]
+        for event in unknown:
+            self.checked[event] = self.__check([event]) == 1
+        if unknown:
+            self.save()
+        return [e in self.events or self.checked[e] for e in events]
+    # ----------------------------------------------------------------------- #
 
-        pass
+    def fits(self, events):
+        """Returns whether the events can be counted together without
+        multiplexing.
 
-    def on_test_end(self, logs=None):
-        """Called at the end of evaluate."""
+        Parameters
+        ----------
+        events : list
+            Names of the events
 
-        pass
+        Returns
+        -------
+        bool
+        """
 
-    def on_predict_begin(self, logs=None):
-        """Called at the beginning of predict."""
+        key = ",".join(sorted(set(events)))
+        if key not in self.groups:
+            self.groups[key] = self.__fits(events)
+            self.save()
+        return self.groups[key]
+    # ----------------------------------------------------------------------- #
 
-        pass
+    def plan(self, events, max_steps=100_000):
+        """Partitions the events in the minimum number of groups that fit in
+        the counters without multiplexing.
 
-    def on_predict_end(self, logs=None):
-        """Called at the end of predict."""
+        The first fit (each event goes to the first group where it fits)
+        gives a first plan. If it has more groups than the lower bound
+        (events / counters), the assignments are searched for a plan with
+        fewer groups until `max_steps` assignments are tried. The groups keep
+        the order of the events.
 
-        pass
-    # ------------------------- END Global methods -------------------------- #
+        Only the final plan is saved in the cache, the groups probed during
+        the search are kept in memory (up to `MAX_PROBES`).
 
-    # ------------------------- Batch-level methods ------------------------- #
-    def on_train_batch_begin(self, batch, logs=None):
-        """Called right before processing a batch during training."""
+        Parameters
+        ----------
+        events : list
+            Names of the events
+        max_steps : int, optional
+            Limit of the search, the best plan found is returned when it is
+            reached (default is 100000)
+
+        Returns
+        -------
+        list
+            Groups, each one a list with the names of its events
+
+        Raises
+        ------
+        ValueError
+            If some events are unavailable in this host
+        """
 
-        pass
+        events = list(dict.fromkeys(events))
+        key = ",".join(events)
+        if key in self.plans:
+            return [list(g) for g in self.plans[key]]
+        missing = [e for e, a in zip(events, self.available(events)) if not a]
+        if missing:
+            raise ValueError("Events not available in this host (%s): %s"
+                             % (self.key, ", ".join(missing)))
+
+        best = []
+        for event in events:
+            for group in best:
+                if self.__fits(group + [event]):
+                    group.append(event)
+                    break
+            else:
+                best.append([event])
+
+        lower_bound = -(-len(events) // max(self.num_counters, 1))
+        steps = 0
+
+        def search(i, groups):
+            # A subset of a group that fits also fits, so the event is tried
+            # in each group and then alone, pruning the plans not better
+            nonlocal best, steps
+            if len(best) == lower_bound or steps >= max_steps:
+                return
+            if i == len(events):
+                best = [list(g) for g in groups]
+                return
+            steps += 1
+            for group in groups:
+                if self.__fits(group + [events[i]]):
+                    group.append(events[i])
+                    search(i + 1, groups)
+                    group.pop()
+            if len(groups) + 1 < len(best):
+                groups.append([events[i]])
+                search(i + 1, groups)
+                groups.pop()
+
+        search(0, [])
+
+        self.plans[key] = best
+        self.save()
+        return [list(g) for g in best]
+    # ----------------------------------------------------------------------- #
 
-    def on_train_batch_end(self, batch, logs=None):
-        """Called at the end of training a batch. Within this method, logs is a
-        dict containing the metrics results."""
+    def validate(self, events, multiplex=False):
+        """Checks that the events can be measured, before preparing anything.
 
-        pass
+        Parameters
+        ----------
+        events : list
+            Names of the events
+        multiplex : bool, optional
+            Whether the events are going to be multiplexed, so they don't
+            need to fit in the counters (default is False)
+
+        Raises
+        ------
+        ValueError
+            If some events are unavailable or they don't fit in the counters
+            without multiplexing
+        """
 
-    def on_test_batch_begin(self, batch, logs=None):
-        """Called right before processing a batch during testing."""
+        missing = [e for e, a in zip(events, self.available(events)) if not a]
+        if missing:
+            raise ValueError("Events not available in this host (%s): %s"
+                             % (self.key, ", ".join(missing)))
+        if not multiplex and not self.fits(events):
+            raise ValueError("The %d events don't fit in the %d counters, "
+                             "multiplex them or split them in groups"
+                             % (len(events), self.num_counters))
+    # ----------------------------------------------------------------------- #
 
-        pass
+    def __load(self):
+        """Loads the cache file of this host. Returns whether it exists."""
+
+        import json
+
+        try:
+            with open(self.path) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if cache.get("key") != self.key:
+            return False
+        self.num_counters = cache["num_counters"]
+        self.events = set(cache["events"])
+        self.checked = cache["checked"]
+        self.groups = cache["groups"]
+        # Caches written before the plans were saved
+        self.plans = cache.get("plans", {})
+        return True
+    # ----------------------------------------------------------------------- #
 
-    def on_test_batch_end(self, batch, logs=None):
-        """Called at the end of testing a batch. Within this method, logs is a
-        dict containing the metrics results."""
+    def __fits(self, events):
+        """Returns whether the events fit together, probing them only if the
+        group isn't in the catalog nor in the probes in memory. The catalog
+        isn't changed."""
+
+        key = ",".join(sorted(set(events)))
+        if key in self.groups:
+            return self.groups[key]
+        if key in self.__probes:
+            self.__probes.move_to_end(key)
+            return self.__probes[key]
+        fits = self.__probes[key] = self.__check(events) == len(events)
+        if len(self.__probes) > self.MAX_PROBES:
+            self.__probes.popitem(last=False)
+        return fits
+    # ----------------------------------------------------------------------- #
 
-        pass
+    def __check(self, events):
+        """Probes the PMU and returns how many events fit together."""
 
-    def on_predict_batch_begin(self, batch, logs=None):
-        """Called right before processing a batch during predicting."""
+        num_events = len(events)
+        fits = (c_int * num_events)()
+        names = (c_char_p * num_events)(*[e.encode('utf-8') for e in events])
+        return self.p_lib.my_catalog_check_events(names, c_int(num_events),
+                                                  fits)
+    # ----------------------------------------------------------------------- #
 
-        pass
+    @staticmethod
+    def __get_cpu_model():
+        """Returns the model name of the cpu of this host."""
 
-    def on_predict_batch_end(self, batch, logs=None):
-        """Called at the end of predicting a batch. Within this method, logs is
-        a dict containing the metrics results."""
+        try:
+            with open("/proc/cpuinfo") as f:
+                for line in f:
+                    if line.startswith("model name"):
+                        return line.split(":", 1)[1].strip()
+        except OSError:
+            pass
+        import platform
 
-        pass
-    # ----------------------- END Batch-level methods ----------------------- #
+        return platform.processor() or platform.machine()
+    # ----------------------------------------------------------------------- #
 
-    # ------------------------- Epoch-level methods ------------------------- #
-    def on_epoch_begin(self, epoch, logs=None):
-        """Called at the beginning of an epoch during training."""
+    def __set_my_lib(self):
+        """
+        Defines the input/output of the functions of the catalog.
 
-        pass
+        Parameters
+        ----------
+        None
+        """
 
-    def on_epoch_end(self, epoch, logs=None):
-        """Called at the end of an epoch during training."""
+        # ------------------------------------------------------------------- #
+        # int my_catalog_list_events(char *buffer, int length)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_catalog_list_events.argtypes = [c_char_p, c_int]
+        self.p_lib.my_catalog_list_events.restype = c_int
 
-        pass
-    # ----------------------- END Epoch-level methods ----------------------- #
+        # ------------------------------------------------------------------- #
+        # int my_catalog_check_events(char **events, int num_events,
+        #                             int *fits)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_catalog_check_events.argtypes = [
+            POINTER(c_char_p), c_int, POINTER(c_int)]
+        self.p_lib.my_catalog_check_events.restype = c_int
 
-    def finalize_measure(self):
-        """Ends the measure."""
+        # ------------------------------------------------------------------- #
+        # int my_catalog_get_num_counters()
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_catalog_get_num_counters.argtypes = None
+        self.p_lib.my_catalog_get_num_counters.restype = c_int
+    # ----------------------------------------------------------------------- #
 
-        self.mp.finalize_measure()
 # --------------------------------------------------------------------------- #
 
-class MeasureOnTrainPhase(MyCallbacks):
+class MyPapiGroups(object):
     """
-    Custom callback to run with my_papi library and measures the system in the
-    training phase.
+    Class that measures more events than counters without multiplexing. The
+    events are planned in groups that fit in the counters
+    (`EventCatalog.plan`), or each file passed is a group, and each measure
+    (region) counts one group, in round robin.
+
+    The regions are supposed to repeat the same work (batches, epochs or
+    runs), so the events of all the groups are merged as the mean of the
+    regions where they were counted.
 
     Attributes
     ----------
-    self.mp : my_papi
-        Oject of the class my_papi
-    self.output_file : str
-        Path (and name) of the file where the results will be printed. If it's
-        `None`, then the results will be printed on screen
+    self.groups : list
+        Events of each group
+    self.events : numpy.ndarray
+        Names of all the events, in the order of the file
+    self.cpus_measured : numpy.ndarray
+        Cpus measured, one per row of the values
+    self.mp : MyPapi
+        Object of the class MyPapi, prepared with one group at a time
+    self.group : int
+        Group counted by the next region
+    self.last_group : int
+        Group counted by the last region (-1 before the first one)
+    self.totals : numpy.ndarray
+        Matrix (cpus x events) with the sum of the regions
+    self.regions : numpy.ndarray
+        Number of regions counted by each group
     """
 
-    def __init__(self, lib_path, events_file, output_file=None):
+    def __init__(self, lib_path, events_file, catalog=None, cpus=None,
+                 parallel=False):
         """
-        Class Constructor to initialize the object.
+        MyPapiGroups class constructor. It plans the groups and prepares the
+        first one. A single session is used: when the group changes, it is
+        prepared again, so only the counters of one group are open.
 
         Parameters
         ----------
         lib_path : str
             Path to the shared library libmy_papi.so
-        events_file : str
-            Path where the file, with the events to be measured, is located
-        output_file : str, optional
-            Path (and name) of the file where the results will be printed. If
-            `None` is passed, then the results will be printed on screen
+        events_file : str or list
+            Path of the file with all the events, one per line, or a list of
+            files with one group each (they aren't planned)
+        catalog : EventCatalog, optional
+            Catalog of this host, used to plan a single file (default is the
+            one of the cache)
+        cpus : list, optional
+            Cpus to be measured (default is all)
+        parallel : bool, optional
+            Whether the cpus are started and stopped in parallel (default is
+            False)
         """
 
-        super(MeasureOnTrainPhase, self).__init__(events_file=events_file,
-                                                  lib_path=lib_path,
-                                                  output_file=output_file)
+        super(MyPapiGroups, self).__init__()
+
+        if isinstance(events_file, str):
+            if catalog is None:
+                catalog = EventCatalog(lib_path)
+            self.groups = catalog.plan(read_events(events_file))
+        else:
+            self.groups = [read_events(f) for f in events_file]
+        events = list(dict.fromkeys(e for g in self.groups for e in g))
+        self.events = np.array(events)
+
+        # The library reads the events of each group from a file, kept until
+        # the measure is finalized
+        import tempfile
+        self.__plan_dir = tempfile.TemporaryDirectory(prefix="my_papi_")
+        self.__group_files = []
+        for i, group in enumerate(self.groups):
+            group_file = os.path.join(self.__plan_dir.name, "group_%d.cfg" % i)
+            write_events(group_file, group)
+            self.__group_files.append(group_file)
+        # Columns of the merged values of each group
+        self.__columns = [[events.index(e) for e in group]
+                          for group in self.groups]
+
+        self.__cpus = cpus
+        self.__parallel = parallel
+        self.mp = MyPapi(lib_path)
+        self.__prepare(0)
+        # The array of the library is released by the next prepare
+        self.cpus_measured = self.mp.cpus_measured.copy()
+
+        self.group = 0
+        self.last_group = -1
+        self.totals = np.zeros((len(self.cpus_measured), len(events)))
+        self.regions = np.zeros(len(self.groups), dtype=np.int64)
+    # ----------------------------------------------------------------------- #
+
+    def start_measure(self):
+        """Starts a region, counting the next group.
+
+        Parameters
+        ----------
+        None
 
-    # --------------------------- Global methods ---------------------------- #
-    def on_train_begin(self, logs=None):
-        """Called at the beginning of fit."""
+        Raises
+        ------
+        RuntimeError
+            If the measure is finalized
+        """
 
-        # Starts the measure with my_papi library
+        if self.mp.session is None:
+            raise RuntimeError("The measure of the groups is finalized")
+        if self.__prepared != self.group:
+            self.__prepare(self.group)
         self.mp.start_measure()
+    # ----------------------------------------------------------------------- #
+
+    def stop_measure(self):
+        """Stops the region, adds its values to the totals and moves to the
+        next group.
 
-    def on_train_end(self, logs=None):
-        """Called at the end of fit."""
+        Parameters
+        ----------
+        None
+        """
 
-        # Stops the measure with my_papi library
         self.mp.stop_measure()
+        self.totals[:, self.__columns[self.group]] += self.mp.values
+        self.regions[self.group] += 1
+        self.last_group = self.group
+        self.group = (self.group + 1) % len(self.groups)
+    # ----------------------------------------------------------------------- #
 
-        # Saves the results on a file
-        self.mp.print_measure(self.output_file)
-    # ------------------------- END Global methods -------------------------- #
-# --------------------------------------------------------------------------- #
+    def print_measure(self, output_file=None):
+        """Prints the results of the last region. In a file, each group has
+        its own one, ending in `_g<group>` before the extension.
 
-class MeasureOnEachEpoch(MyCallbacks):
-    """
-    Custom callback to run with my_papi library and measures the system in each
-    epoch.
+        Parameters
+        ----------
+        output_file : str, optional
+            Path (and name) of the file where the results will be printed.
+        """
 
-    Attributes
-    ----------
-    self.mp : my_papi
-        Oject of the class my_papi
-    self.output_file : str
-        Path (and name) of the file where the results will be printed. If it's
-        `None`, then the results will be printed on screen
-    """
+        if output_file is not None:
+            root, ext = os.path.splitext(output_file)
+            output_file = "%s_g%d%s" % (root, self.last_group, ext)
+        self.mp.print_measure(output_file)
+    # ----------------------------------------------------------------------- #
+
+    def flush_measure(self):
+        """Writes the results buffered by `print_measure` to their files.
 
-    def __init__(self, lib_path, events_file, output_file=None):
+        Parameters
+        ----------
+        None
         """
-        Class Constructor to initialize the object.
+
+        self.mp.flush_measure()
+    # ----------------------------------------------------------------------- #
+
+    def read_merged(self):
+        """Returns the events of all the groups merged, as the mean of the
+        regions where each one was counted.
 
         Parameters
         ----------
-        lib_path : str
-            Path to the shared library libmy_papi.so
-        events_file : str
-            Path where the file, with the events to be measured, is located
-        output_file : str, optional
-            Path (and name) of the file where the results will be printed. If
-            `None` is passed, then the results will be printed on screen
+        None
+
+        Returns
+        -------
+        values : numpy.ndarray
+            Matrix (cpus x events) with the mean per region of each event,
+            NaN if its group hasn't been counted yet
+        events : numpy.ndarray
+            Names of the events, one per column of `values`
+        coverage : numpy.ndarray
+            Number of regions where each event was counted
         """
 
-        super(MeasureOnEachEpoch, self).__init__(events_file=events_file,
-                                                 lib_path=lib_path,
-                                                 output_file=output_file)
+        coverage = np.zeros(len(self.events), dtype=np.int64)
+        for columns, regions in zip(self.__columns, self.regions):
+            coverage[columns] += regions
+        values = np.divide(self.totals, coverage,
+                           out=np.full(self.totals.shape, np.nan),
+                           where=coverage > 0)
+        return values, self.events, coverage
+    # ----------------------------------------------------------------------- #
 
-    # ------------------------- Epoch-level methods ------------------------- #
-    def on_epoch_begin(self, epoch, logs=None):
-        """Called at the beginning of an epoch during training."""
+    def finalize_measure(self):
+        """Destroys the session and the files of the groups. It can be called
+        more than once, the next regions raise an error.
 
-        # Starts the measure with my_papi library
-        self.mp.start_measure()
+        Parameters
+        ----------
+        None
+        """
 
-    def on_epoch_end(self, epoch, logs=None):
-        """Called at the end of an epoch during training."""
+        self.mp.finalize_measure()
+        self.__plan_dir.cleanup()
+    # ----------------------------------------------------------------------- #
 
-        # Stops the measure with my_papi library
-        self.mp.stop_measure()
+    def __prepare(self, group):
+        """Prepares the session with the events of a group, releasing the
+        counters of the previous one. Its buffered results are written."""
+
+        self.mp.prepare_measure(self.__group_files[group], self.__cpus,
+                                self.__parallel)
+        self.__prepared = group
+    # ----------------------------------------------------------------------- #
 
-        # Saves the results on a file
-        self.mp.print_measure(self.output_file)
-    # ----------------------- END Epoch-level methods ----------------------- #
 # --------------------------------------------------------------------------- #
 
-class MeasureOnDeterminedEpoch(MyCallbacks):
+class MyProfiler(object):
     """
-    Custom callback to run with my_papi library and measures the system in each
-    epoch.
+    Class that uses the libmy_papi.so library to sample where the events
+    happen. Each time an event counted on the calling thread reaches its
+    threshold (`PAPI_overflow`), the instruction pointer and the Python stack
+    are recorded, so the results can be rendered as a flamegraph weighted by
+    that event.
+
+    Only the thread that calls `prepare` and `start` is sampled, and it must
+    be the main thread because the Python stack is taken from a signal
+    handler. The overflow handler of the library stores the instruction
+    pointer and raises that signal, but Python runs its handlers later, so
+    the samples are attributed to the Python frame that is running when the
+    signal is handled (after the current bytecode or native call), not
+    exactly to the one that caused them.
 
     Attributes
     ----------
-    self.mp : my_papi
-        Oject of the class my_papi
-    self.output_file : str
-        Path (and name) of the file where the results will be printed. If it's
-        `None`, then the results will be printed on screen
+    self.p_lib : ctypes.CDLL
+        Library of my_papi
+    self.events : list
+        Names of the events of the profiler
+    self.thresholds : list
+        Number of occurrences of each event between two samples (0 to just
+        count it)
+    self.stacks : dict
+        Weight of each collapsed stack ("frame;frame;...") per event
+    self.totals : dict
+        Value of each event counted between `start` and `stop`
+    self.dropped : int
+        Number of samples discarded because the buffer of the library was full
     """
 
-    def __init__(self, lib_path, events_file, output_file=None):
+    def __init__(self, lib_path):
         """
-        Class Constructor to initialize the object.
+        MyProfiler class constructor to initialize the object.
 
         Parameters
         ----------
         lib_path : str
             Path to the shared library libmy_papi.so
-        events_file : str
-            Path where the file, with the events to be measured, is located
-        output_file : str, optional
-            Path (and name) of the file where the results will be printed. If
-            `None` is passed, then the results will be printed on screen
         """
 
-        super(MeasureOnDeterminedEpoch, self).__init__(events_file=events_file,
-                                                 lib_path=lib_path,
-                                                 output_file=output_file)
+        super(MyProfiler, self).__init__()
 
-    # ------------------------- Epoch-level methods ------------------------- #
-    def on_epoch_begin(self, epoch, logs=None):
-        """Called at the beginning of an epoch during training."""
+        self.p_lib = CDLL(lib_path)
+        self.__set_my_lib()
+
+        self.events = []
+        self.thresholds = []
+        self.stacks = {}
+        self.totals = {}
+        self.dropped = 0
+        # Name of the native function of each instruction pointer
+        self.__symbols = {}
+        self.__signum = None
+        self.__previous_handler = None
+        # Buffers where the samples of the library are fetched
+        self.__sample_events = (c_int * 4096)()
+        self.__sample_ips = (c_ulonglong * 4096)()
+    # ----------------------------------------------------------------------- #
 
-        if epoch == 2:
-          # Starts the measure with my_papi library
-          self.mp.start_measure()
+    def prepare(self, events_file, thresholds=1_000_000):
+        """Creates the event set of the profiler with the events of the file,
+        one per line, as in `MyPapi.prepare_measure`.
 
-    def on_epoch_end(self, epoch, logs=None):
-        """Called at the end of an epoch during training."""
+        Parameters
+        ----------
+        events_file : str
+            Path where the file is located
+        thresholds : int or dict, optional
+            Occurrences of the events between two samples. A dict gives the
+            threshold of each event by name and the missing ones are just
+            counted (default is 1000000 for all the events)
+        """
 
-        if epoch == 2:
-          # Stops the measure with my_papi library
-          self.mp.stop_measure()
+        num_events = self.p_lib.my_profile_prepare(events_file.encode('utf-8'))
+        self.events = [self.p_lib.my_profile_get_event_name(i).decode('utf-8')
+                       for i in range(num_events)]
+        if isinstance(thresholds, dict):
+            self.thresholds = [int(thresholds.get(e, 0)) for e in self.events]
+        else:
+            self.thresholds = [int(thresholds)] * num_events
+        self.stacks = {e: {} for e in self.events}
+    # ----------------------------------------------------------------------- #
 
-          # Saves the results on a file
-          self.mp.print_measure(self.output_file)
-    # ----------------------- END Epoch-level methods ----------------------- #
-# --------------------------------------------------------------------------- #
+    def start(self, signum=None):
+        """Starts counting and sampling the events.
 
-class MeasureOnEachBatch(MyCallbacks):
-    """
-    Custom callback to run with my_papi library and measures the system in each
-    batch.
+        Parameters
+        ----------
+        signum : int, optional
+            Signal raised by the overflow handler of the library after each
+            sample, so that the Python stack can be recorded. It must not be
+            one that the program or PAPI already uses (default is SIGUSR2)
+        """
 
-    Attributes
-    ----------
-    self.mp : my_papi
-        Oject of the class my_papi
-    self.output_file : str
-        Path (and name) of the file where the results will be printed. If it's
-        `None`, then the results will be printed on screen
-    """
+        import signal
+
+        if signum is None:
+            signum = signal.SIGUSR2
+        self.__signum = signum
+        self.__previous_handler = signal.signal(signum, self.__on_overflow)
+        num_events = len(self.events)
+        self.p_lib.my_profile_start((c_int * num_events)(*self.thresholds),
+                                    c_int(signum))
+    # ----------------------------------------------------------------------- #
+
+    def stop(self):
+        """Stops the profiler and records the samples not recorded yet.
+
+        Parameters
+        ----------
+        None
 
-    def __init__(self, lib_path, events_file, output_file=None):
+        Returns
+        -------
+        totals : dict
+            Value of each event counted since `start`
         """
-        Class Constructor to initialize the object.
+
+        num_events = len(self.events)
+        totals = (c_longlong * num_events)()
+        self.p_lib.my_profile_stop(totals,
+                                   (c_int * num_events)(*self.thresholds))
+        import signal
+        signal.signal(self.__signum, self.__previous_handler)
+        # The samples left were taken in the code that called this method
+        self.__record_samples(sys._getframe(1))
+        self.totals = dict(zip(self.events, totals))
+        self.dropped = self.p_lib.my_profile_get_dropped()
+        return self.totals
+    # ----------------------------------------------------------------------- #
+
+    def collapsed(self, event=None):
+        """Returns the samples of an event as collapsed stacks, the input of
+        flamegraph.pl or speedscope.
 
         Parameters
         ----------
-        lib_path : str
-            Path to the shared library libmy_papi.so
-        events_file : str
-            Path where the file, with the events to be measured, is located
-        output_file : str, optional
-            Path (and name) of the file where the results will be printed. If
-            `None` is passed, then the results will be printed on screen
+        event : str, optional
+            Name of the event that weights the stacks (default is the first
+            one)
+
+        Returns
+        -------
+        lines : list
+            Strings "frame;frame;... weight", from the outermost frame to
+            the native function where the event overflowed
         """
 
-        super(MeasureOnEachBatch, self).__init__(events_file=events_file,
-                                                 lib_path=lib_path,
-                                                 output_file=output_file)
+        if event is None:
+            event = self.events[0]
+        return ["%s %d" % (stack, weight)
+                for stack, weight in sorted(self.stacks[event].items())]
+    # ----------------------------------------------------------------------- #
 
-    # ------------------------- Batch-level methods ------------------------- #
-    def on_train_batch_begin(self, batch, logs=None):
-        """Called right before processing a batch during training."""
+    def save(self, output_file, event=None):
+        """Writes the collapsed stacks of an event on a file.
 
-        # Starts the measure with my_papi library
-        self.mp.start_measure()
+        Parameters
+        ----------
+        output_file : str
+            Path (and name) of the file
+        event : str, optional
+            Name of the event that weights the stacks (default is the first
+            one)
+        """
 
-    def on_train_batch_end(self, batch, logs=None):
-        """Called at the end of training a batch. Within this method, logs is a
-        dict containing the metrics results."""
+        with open(output_file, "w") as f:
+            for line in self.collapsed(event):
+                f.write(line + "\n")
+    # ----------------------------------------------------------------------- #
 
-        # Stops the measure with my_papi library
-        self.mp.stop_measure()
+    def finalize(self):
+        """Destroys the event set of the profiler.
 
-        # Saves the results on a file
-        self.mp.print_measure(self.output_file)
+        Parameters
+        ----------
+        None
+        """
 
-    def on_test_batch_begin(self, batch, logs=None):
-        """Called right before processing a batch during testing."""
-        pass
+        self.p_lib.my_profile_finalize()
+    # ----------------------------------------------------------------------- #
 
-    def on_test_batch_end(self, batch, logs=None):
-        """Called at the end of testing a batch. Within this method, logs is a
-        dict containing the metrics results."""
-        pass
+    def __on_overflow(self, signum, frame):
+        """Handler of the signal raised by the library after the samples."""
 
-    def on_predict_batch_begin(self, batch, logs=None):
-        """Called right before processing a batch during predicting."""
-        pass
+        self.__record_samples(frame)
+    # ----------------------------------------------------------------------- #
 
-    def on_predict_batch_end(self, batch, logs=None):
-        """Called at the end of predicting a batch. Within this method, logs is
-        a dict containing the metrics results."""
-        pass
-    # ----------------------- END Batch-level methods ----------------------- #
-# --------------------------------------------------------------------------- #
+    def __record_samples(self, frame):
+        """
+        Moves the samples of the library to `self.stacks`. All of them are
+        assigned to the Python stack of `frame` (the samples taken during a
+        native call are handled when it returns) and each one weights the
+        threshold of its event.
 
-class MeasureEpochAndBatch(keras.callbacks.Callback):
-    """
-    Custom callback to run with my_papi library and measures the system in each
-    epoch.
+        Parameters
+        ----------
+        frame : frame
+            Python frame that was running when the samples were taken
+        """
 
-    Attributes
-    ----------
-    self.mp : my_papi
-        Oject of the class my_papi
-    self.output_file : str
-        Path (and name) of the file where the results will be printed. If it's
-        `None`, then the results will be printed on screen
-    """
+        events = self.__sample_events
+        ips = self.__sample_ips
+        num_samples = self.p_lib.my_profile_fetch(events, ips,
+                                                  c_int(len(events)))
+        if num_samples == 0:
+            return
+
+        # Python frames, from the outermost to the innermost
+        python_stack = []
+        while frame is not None:
+            code = frame.f_code
+            python_stack.append("%s (%s:%d)" % (
+                code.co_name, os.path.basename(code.co_filename),
+                code.co_firstlineno))
+            frame = frame.f_back
+        python_stack = ";".join(reversed(python_stack))
+
+        while num_samples > 0:
+            for i in range(num_samples):
+                stack = python_stack + ";" + self.__symbol(ips[i])
+                stacks = self.stacks[self.events[events[i]]]
+                stacks[stack] = (stacks.get(stack, 0)
+                                 + self.thresholds[events[i]])
+            num_samples = self.p_lib.my_profile_fetch(events, ips,
+                                                      c_int(len(events)))
+    # ----------------------------------------------------------------------- #
+
+    def __symbol(self, ip):
+        """Returns the native function (and library) of an instruction
+        pointer."""
+
+        name = self.__symbols.get(ip)
+        if name is None:
+            buffer = create_string_buffer(256)
+            self.p_lib.my_profile_symbol(c_ulonglong(ip), buffer, c_int(256))
+            # ";" separates the frames of the collapsed stacks
+            name = buffer.value.decode('utf-8', 'replace').replace(";", ",")
+            self.__symbols[ip] = name
+        return name
+    # ----------------------------------------------------------------------- #
 
-    def __init__(self, lib_path, events_file, output_file=None):
+    def __set_my_lib(self):
         """
-        Class Constructor to initialize the object.
+        Defines the input/output of the functions of the profiler.
 
         Parameters
         ----------
-        lib_path : str
-            Path to the shared library libmy_papi.so
-        events_file : str
-            Path where the file, with the events to be measured, is located
-        output_file : str, optional
-            Path (and name) of the file where the results will be printed. If
-            `None` is passed, then the results will be printed on screen
+        None
         """
 
-        super(MeasureEpochAndBatch, self).__init__()
+        # ------------------------------------------------------------------- #
+        # int my_profile_prepare(char *input_file_name)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_profile_prepare.argtypes = [c_char_p]
+        self.p_lib.my_profile_prepare.restype = c_int
 
-        # Creates two objects of the class my_papi
-        self.mp_epoch = MyPapi(lib_path=lib_path)
-        self.mp_batch = MyPapi(lib_path=lib_path)
+        # ------------------------------------------------------------------- #
+        # const char *my_profile_get_event_name(int index)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_profile_get_event_name.argtypes = [c_int]
+        self.p_lib.my_profile_get_event_name.restype = c_char_p
 
-        # Prepares the measure on ALL cpus
-        # ! modify this to get the num of cpus automatic
-        # cpus = None
-        self.cpus = list(range(2, 32))
-        self.mp_epoch.prepare_measure(events_file=events_file, cpus=self.cpus)
-        self.mp_batch.prepare_measure(events_file=events_file, cpus=self.cpus)
+        # ------------------------------------------------------------------- #
+        # int my_profile_start(int *thresholds, int signum)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_profile_start.argtypes = [POINTER(c_int), c_int]
+        self.p_lib.my_profile_start.restype = c_int
 
-        # Save the output file variable for later
-        self.output_file = output_file
+        # ------------------------------------------------------------------- #
+        # int my_profile_stop(long long *totals, int *thresholds)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_profile_stop.argtypes = [POINTER(c_longlong),
+                                               POINTER(c_int)]
+        self.p_lib.my_profile_stop.restype = c_int
 
-        # We have to decompose the path, name and extension of the output file
-        if self.output_file is not None:
-            # Gets an array with head + tail: path + file_name
-            self.head_tail = os.path.split(output_file)
-            self.name_extension = os.path.splitext(self.head_tail[1])
+        # ------------------------------------------------------------------- #
+        # int my_profile_fetch(int *events, unsigned long long *ips,
+        #                      int max_samples)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_profile_fetch.argtypes = [
+            POINTER(c_int), POINTER(c_ulonglong), c_int]
+        self.p_lib.my_profile_fetch.restype = c_int
 
-            # From the file indicated, generate a new file
-            self.batch_output_file = self.head_tail[0] + "/" + str(self.name_extension[0]
-            + "_batch" + self.name_extension[1])
-        else:
-            self.batch_output_file = None
-        # Just measure the batches indicated
-        self.measure_batch = True
+        # ------------------------------------------------------------------- #
+        # long long my_profile_get_dropped()
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_profile_get_dropped.argtypes = None
+        self.p_lib.my_profile_get_dropped.restype = c_longlong
 
-    # ------------------------- Batch-level methods ------------------------- #
-    def on_train_batch_begin(self, batch, logs=None):
-        """Called right before processing a batch during training."""
+        # ------------------------------------------------------------------- #
+        # int my_profile_symbol(unsigned long long ip, char *name, int length)
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_profile_symbol.argtypes = [c_ulonglong, c_char_p, c_int]
+        self.p_lib.my_profile_symbol.restype = c_int
 
-        if self.measure_batch:
-            self.mp_batch.start_measure()
+        # ------------------------------------------------------------------- #
+        # int my_profile_finalize()
+        # ------------------------------------------------------------------- #
+        self.p_lib.my_profile_finalize.argtypes = None
+        self.p_lib.my_profile_finalize.restype = c_int
+    # ----------------------------------------------------------------------- #
 
-    def on_train_batch_end(self, batch, logs=None):
-        """Called at the end of training a batch. Within this method, logs is a
-        dict containing the metrics results."""
+# --------------------------------------------------------------------------- #
 
-        if self.measure_batch:
-            self.mp_batch.stop_measure()
-            self.mp_batch.print_measure(self.batch_output_file)
-    # ----------------------- END Batch-level methods ----------------------- #
+def _hook_forks():
+    """
+    Sets (once) the hooks of the forks. They are only set when the children
+    are going to be counted, so the rest of the forks aren't changed.
+    """
 
-    # ------------------------- Epoch-level methods ------------------------- #
-    def on_epoch_begin(self, epoch, logs=None):
-        """Called at the beginning of an epoch during training."""
+    global _forks_hooked
+    from multiprocessing import util
 
-        print("Begin del epoch", epoch)
+    if not _forks_hooked:
+        os.register_at_fork(after_in_child=_after_fork)
+        # Run by the processes of multiprocessing when they start, out of
+        # the fork itself
+        util.register_after_fork(_hook_forks, lambda obj: _start_worker())
+        _forks_hooked = True
+# --------------------------------------------------------------------------- #
 
-        if epoch == 1:
-            self.measure_batch = False
+def _after_fork():
+    """
+    Hook of the forks, run by the child in the middle of the fork, so it
+    just forgets the measure of the parent and defers the rest to
+    `_start_worker`.
+    """
 
-        # Starts the measure with my_papi library
-        self.mp_epoch.start_measure()
+    global _worker, _forked
 
-    def on_epoch_end(self, epoch, logs=None):
-        """Called at the end of an epoch during training."""
+    _worker = None
+    _forked = True
+# --------------------------------------------------------------------------- #
 
-        print("\nEnd del epoch", epoch)
+def _start_worker():
+    """
+    Starts counting this child process if the parent asked for it (see
+    `MyPapi.enable_workers`). Its totals are written when it exits, also if
+    it is terminated by multiprocessing.
+    """
 
-        # Stops the measure with my_papi library
-        self.mp_epoch.stop_measure()
+    global _worker, _forked
+    import signal
+
+    if _worker is not None:
+        return
+    config = _workers
+    if config is None:
+        if _WORKERS_ENV not in os.environ:
+            return
+        import json
+        config = json.loads(os.environ[_WORKERS_ENV])
+    if config["pid"] == os.getpid():
+        # The parent itself
+        return
+
+    # Set first, since the objects created below call this function too
+    _worker = (None, config["workers_dir"])
+    if _forked:
+        CDLL(config["lib_path"]).my_after_fork_child()
+        _forked = False
+    mp = MyPapi(config["lib_path"])
+    mp.prepare_attach_measure(config["events_file"], os.getpid(),
+                              config["multiplex"])
+    mp.start_measure()
+    _worker = (mp, config["workers_dir"])
+
+    # The processes of multiprocessing end with os._exit, after running the
+    # finalizers registered once they have started, and the rest with the
+    # atexit handlers
+    import atexit
+    from multiprocessing import util
+    atexit.register(_stop_worker)
+    util.Finalize(mp, _stop_worker, exitpriority=100)
+
+    # multiprocessing terminates its workers with SIGTERM: the totals are
+    # written and then the previous handler (or the default action) runs
+    if threading.current_thread() is not threading.main_thread():
+        return
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def terminate(signum, frame):
+        _stop_worker()
+        if callable(previous):
+            previous(signum, frame)
+        elif previous != signal.SIG_IGN:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            os.kill(os.getpid(), signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, terminate)
+# --------------------------------------------------------------------------- #
 
-        # Saves the results on a file
-        self.mp_epoch.print_measure(self.output_file)
+def _stop_worker():
+    """
+    Stops the measure of this child process and writes its totals in the
+    folder of the workers, as worker_<pid>.npz.
+    """
 
-        # if epoch == 1:
-        #     self.measure_batch = False
-    # ----------------------- END Epoch-level methods ----------------------- #
+    global _worker
+    import signal
+
+    if _worker is None or _worker[0] is None:
+        return
+    (mp, workers_dir), _worker = _worker, None
+    # A SIGTERM waits until the file is written
+    blocked = signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGTERM})
+    mp.stop_measure()
+
+    # Written aside and renamed, so the parent never reads half a file
+    path = os.path.join(workers_dir, "worker_%d.npz" % os.getpid())
+    with open(path + ".tmp", "wb") as f:
+        np.savez(f, values=mp.values, events=mp.events,
+                 cpus=mp.cpus_measured, times=mp.times, pid=os.getpid())
+    os.replace(path + ".tmp", path)
+    mp.finalize_measure()
+    signal.pthread_sigmask(signal.SIG_SETMASK, blocked)
 # --------------------------------------------------------------------------- #
@@ -0,0 +1,928 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# --------------------------------------------------------------------------- #
+__author__ = "Juan Luis Padilla Salomé"
+__copyright__ = "Copyright 2021"
+__credits__ = ["University of Cantabria", "Pablo Abad", "Pablo Prieto"]
+__license__ = "GPL"
+__version__ = "1.0.0"
+__maintainer__ = "Juan Luis Padilla Salomé"
+__email__ = "juan-luis.padilla@alumnos.unican.es"
+__status__ = "Production"
+# --------------------------------------------------------------------------- #
+
+# Imports for the module
+import os
+from statistics import NormalDist
+import numpy as np
+
+# Forces the program to execute on CPU
+os.environ['CUDA_VISIBLE_DEVICES'] = '0'
+# Just disables the warning, doesn't take advantage of AVX/FMA to run faster
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+
+# Last import or warnning will appear on screen (libcudart not found)
+from tensorflow import keras
+
+from MyPapi import MyPapi, MyPapiGroups, MyProfiler, get_cpus
+# --------------------------------------------------------------------------- #
+
+class MyCallbacks(keras.callbacks.Callback):
+    """
+    Abstact class which have custom callbacks to use with my_papi library.
+
+    Attributes
+    ----------
+    self.mp : my_papi
+        Oject of the class my_papi
+    self.output_file : str
+        Path (and name) of the file where the results will be printed. If it's
+        `None`, then the results will be printed on screen
+    """
+
+    def __init__(self, lib_path, events_file, output_file=None):
+        """
+        My_callbacks class constructor to initialize the object.
+
+        Parameters
+        ----------
+        lib_path : str
+            Path to the shared library libmy_papi.so
+        events_file : str
+            Path where the file, with the events to be measured, is located
+        output_file : str, optional
+            Path (and name) of the file where the results will be printed. If
+            `None` is passed, then the results will be printed on screen
+        """
+
+        super(MyCallbacks, self).__init__()
+
+        # Creates an object of the class my_papi
+        self.mp = MyPapi(lib_path=lib_path)
+
+        # Prepares the measure on the cpus where the process can run
+        self.cpus = get_cpus()
+        self.mp.prepare_measure(events_file=events_file, cpus=self.cpus)
+
+        # Save the output file variable for later
+        self.output_file = output_file
+
+        # We have to decompose the path, name and extension of the output file
+        if self.output_file is not None:
+            # Gets an array with head + tail: path + file_name
+            self.head_tail = os.path.split(output_file)
+            self.name_extension = os.path.splitext(self.head_tail[1])
+
+    # --------------------------- Global methods ---------------------------- #
+    def on_train_begin(self, logs=None):
+        """Called at the beginning of fit."""
+
+        pass
+
+    def on_train_end(self, logs=None):
+        """Called at the end of fit."""
+
+        # Writes the results buffered during the training
+        self.mp.flush_measure()
+
+    def on_test_begin(self, logs=None):
+        """Called at the beginning of evaluate."""
+
+        pass
+
+    def on_test_end(self, logs=None):
+        """Called at the end of evaluate."""
+
+        pass
+
+    def on_predict_begin(self, logs=None):
+        """Called at the beginning of predict."""
+
+        pass
+
+    def on_predict_end(self, logs=None):
+        """Called at the end of predict."""
+
+        pass
+    # ------------------------- END Global methods -------------------------- #
+
+    # ------------------------- Batch-level methods ------------------------- #
+    def on_train_batch_begin(self, batch, logs=None):
+        """Called right before processing a batch during training."""
+
+        pass
+
+    def on_train_batch_end(self, batch, logs=None):
+        """Called at the end of training a batch. Within this method, logs is a
+        dict containing the metrics results."""
+
+        pass
+
+    def on_test_batch_begin(self, batch, logs=None):
+        """Called right before processing a batch during testing."""
+
+        pass
+
+    def on_test_batch_end(self, batch, logs=None):
+        """Called at the end of testing a batch. Within this method, logs is a
+        dict containing the metrics results."""
+
+        pass
+
+    def on_predict_batch_begin(self, batch, logs=None):
+        """Called right before processing a batch during predicting."""
+
+        pass
+
+    def on_predict_batch_end(self, batch, logs=None):
+        """Called at the end of predicting a batch. Within this method, logs is
+        a dict containing the metrics results."""
+
+        pass
+    # ----------------------- END Batch-level methods ----------------------- #
+
+    # ------------------------- Epoch-level methods ------------------------- #
+    def on_epoch_begin(self, epoch, logs=None):
+        """Called at the beginning of an epoch during training."""
+
+        pass
+
+    def on_epoch_end(self, epoch, logs=None):
+        """Called at the end of an epoch during training."""
+
+        pass
+    # ----------------------- END Epoch-level methods ----------------------- #
+
+    def finalize_measure(self):
+        """Ends the measure."""
+
+        self.mp.finalize_measure()
+# --------------------------------------------------------------------------- #
+
+class MeasureOnTrainPhase(MyCallbacks):
+    """
+    Custom callback to run with my_papi library and measures the system in the
+    training phase.
+
+    Attributes
+    ----------
+    self.mp : my_papi
+        Oject of the class my_papi
+    self.output_file : str
+        Path (and name) of the file where the results will be printed. If it's
+        `None`, then the results will be printed on screen
+    """
+
+    def __init__(self, lib_path, events_file, output_file=None):
+        """
+        Class Constructor to initialize the object.
+
+        Parameters
+        ----------
+        lib_path : str
+            Path to the shared library libmy_papi.so
+        events_file : str
+            Path where the file, with the events to be measured, is located
+        output_file : str, optional
+            Path (and name) of the file where the results will be printed. If
+            `None` is passed, then the results will be printed on screen
+        """
+
+        super(MeasureOnTrainPhase, self).__init__(events_file=events_file,
+                                                  lib_path=lib_path,
+                                                  output_file=output_file)
+
+    # --------------------------- Global methods ---------------------------- #
+    def on_train_begin(self, logs=None):
+        """Called at the beginning of fit."""
+
+        # Starts the measure with my_papi library
+        self.mp.start_measure()
+
+    def on_train_end(self, logs=None):
+        """Called at the end of fit."""
+
+        # Stops the measure with my_papi library
+        self.mp.stop_measure()
+
+        # Saves the results on a file
+        self.mp.print_measure(self.output_file)
+        self.mp.flush_measure()
+    # ------------------------- END Global methods -------------------------- #
+# --------------------------------------------------------------------------- #
+
+class MeasureOnEachEpoch(MyCallbacks):
+    """
+    Custom callback to run with my_papi library and measures the system in each
+    epoch.
+
+    Attributes
+    ----------
+    self.mp : my_papi
+        Oject of the class my_papi
+    self.output_file : str
+        Path (and name) of the file where the results will be printed. If it's
+        `None`, then the results will be printed on screen
+    """
+
+    def __init__(self, lib_path, events_file, output_file=None):
+        """
+        Class Constructor to initialize the object.
+
+        Parameters
+        ----------
+        lib_path : str
+            Path to the shared library libmy_papi.so
+        events_file : str
+            Path where the file, with the events to be measured, is located
+        output_file : str, optional
+            Path (and name) of the file where the results will be printed. If
+            `None` is passed, then the results will be printed on screen
+        """
+
+        super(MeasureOnEachEpoch, self).__init__(events_file=events_file,
+                                                 lib_path=lib_path,
+                                                 output_file=output_file)
+
+    # ------------------------- Epoch-level methods ------------------------- #
+    def on_epoch_begin(self, epoch, logs=None):
+        """Called at the beginning of an epoch during training."""
+
+        # Starts the measure with my_papi library
+        self.mp.start_measure()
+
+    def on_epoch_end(self, epoch, logs=None):
+        """Called at the end of an epoch during training."""
+
+        # Stops the measure with my_papi library
+        self.mp.stop_measure()
+
+        # Saves the results on a file
+        self.mp.print_measure(self.output_file)
+    # ----------------------- END Epoch-level methods ----------------------- #
+# --------------------------------------------------------------------------- #
+
+class MeasureOnDeterminedEpoch(MyCallbacks):
+    """
+    Custom callback to run with my_papi library and measures the system in each
+    epoch.
+
+    Attributes
+    ----------
+    self.mp : my_papi
+        Oject of the class my_papi
+    self.output_file : str
+        Path (and name) of the file where the results will be printed. If it's
+        `None`, then the results will be printed on screen
+    """
+
+    def __init__(self, lib_path, events_file, output_file=None):
+        """
+        Class Constructor to initialize the object.
+
+        Parameters
+        ----------
+        lib_path : str
+            Path to the shared library libmy_papi.so
+        events_file : str
+            Path where the file, with the events to be measured, is located
+        output_file : str, optional
+            Path (and name) of the file where the results will be printed. If
+            `None` is passed, then the results will be printed on screen
+        """
+
+        super(MeasureOnDeterminedEpoch, self).__init__(events_file=events_file,
+                                                 lib_path=lib_path,
+                                                 output_file=output_file)
+
+    # ------------------------- Epoch-level methods ------------------------- #
+    def on_epoch_begin(self, epoch, logs=None):
+        """Called at the beginning of an epoch during training."""
+
+        if epoch == 2:
+          # Starts the measure with my_papi library
+          self.mp.start_measure()
+
+    def on_epoch_end(self, epoch, logs=None):
+        """Called at the end of an epoch during training."""
+
+        if epoch == 2:
+          # Stops the measure with my_papi library
+          self.mp.stop_measure()
+
+          # Saves the results on a file
+          self.mp.print_measure(self.output_file)
+    # ----------------------- END Epoch-level methods ----------------------- #
+# --------------------------------------------------------------------------- #
+
+class MeasureOnEachBatch(MyCallbacks):
+    """
+    Custom callback to run with my_papi library and measures the system in each
+    batch. Each region goes from the beginning to the end of its batch, so
+    the other callbacks and the time between batches aren't counted, and it
+    is labelled with the number of the batch. Each boundary is a single call
+    to the library: `next_region` when the batch begins and `end_region`
+    when it ends.
+
+    With a sampling policy, only some batches are measured: every N batches,
+    a random fraction of them or a fixed number per epoch (reservoir). The
+    batches sampled are kept in `self.mp.results` (the region is the epoch
+    and the label the batch) and, at the end of each epoch, the total of
+    each event in the epoch is estimated with a confidence interval. The
+    estimates are printed to the file ending in `_estimates` (or on screen).
+    The random policies use the variance of a simple random sample. `every`
+    is a systematic sample, whose variance can't be estimated without bias
+    from a single start, so it uses the successive differences between the
+    batches sampled, which follows the trends along the epoch; its interval
+    is still an approximation. The reservoir needs the number of batches of
+    each epoch (`steps`), there is no fallback when it's unknown.
+
+    Attributes
+    ----------
+    self.mp : my_papi
+        Oject of the class my_papi
+    self.output_file : str
+        Path (and name) of the file where the results will be printed. If it's
+        `None`, then the results will be printed on screen
+    self.sampling : bool
+        Whether only some batches are measured
+    self.estimates : list
+        Epoch, batches, batches sampled and, per event, the estimated total
+        and the bounds of its confidence interval of each epoch
+    """
+
+    def __init__(self, lib_path, events_file, output_file=None, every=1,
+                 fraction=None, reservoir=None, confidence=0.95, seed=None):
+        """
+        Class Constructor to initialize the object.
+
+        Parameters
+        ----------
+        lib_path : str
+            Path to the shared library libmy_papi.so
+        events_file : str
+            Path where the file, with the events to be measured, is located
+        output_file : str, optional
+            Path (and name) of the file where the results will be printed. If
+            `None` is passed, then the results will be printed on screen
+        every : int, optional
+            Measures one batch of every `every` (default is 1, all of them)
+        fraction : float, optional
+            Measures each batch with this probability (default is None)
+        reservoir : int, optional
+            Measures this number of batches per epoch, chosen at random
+            when the epoch begins. The number of batches of the epoch must
+            be known, i.e. the `steps` of Keras (default is None)
+        confidence : float, optional
+            Confidence level of the intervals (default is 0.95)
+        seed : int, optional
+            Seed of the random choices (default is None)
+
+        Raises
+        ------
+        ValueError
+            If more than one sampling policy is passed
+        """
+
+        super(MeasureOnEachBatch, self).__init__(events_file=events_file,
+                                                 lib_path=lib_path,
+                                                 output_file=output_file)
+
+        if (every != 1) + (fraction is not None) + (reservoir is not None) > 1:
+            raise ValueError("Only one sampling policy can be used")
+
+        # Whether the region of a batch is open
+        self.measuring = False
+
+        self.every = every
+        self.fraction = fraction
+        self.reservoir = reservoir
+        self.sampling = every != 1 or fraction is not None or \
+            reservoir is not None
+        # Normal quantile of the two-sided interval
+        self.z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        self.rng = np.random.default_rng(seed)
+        self.estimates = []
+
+        # Batches of the current epoch: seen, chosen in advance by the
+        # reservoir and the samples (batch, values, begin, end)
+        self.__batches = 0
+        self.__chosen = None
+        self.__samples = []
+
+    # --------------------------- Global methods ---------------------------- #
+    def on_train_end(self, logs=None):
+        """Called at the end of fit."""
+
+        super(MeasureOnEachBatch, self).on_train_end(logs)
+        if self.sampling and self.output_file is not None:
+            name, extension = os.path.splitext(self.output_file)
+            with open(name + "_estimates" + extension, "w") as f:
+                f.write("EPOCH,BATCHES,SAMPLED,EVENT,ESTIMATE,LOW,HIGH\n")
+                for epoch, batches, sampled, totals in self.estimates:
+                    for event, (estimate, low, high) in totals.items():
+                        f.write("%d,%d,%d,%s,%.0f,%.0f,%.0f\n"
+                                % (epoch, batches, sampled, event, estimate,
+                                   low, high))
+    # ------------------------- END Global methods -------------------------- #
+
+    # ------------------------- Batch-level methods ------------------------- #
+    def on_train_batch_begin(self, batch, logs=None):
+        """Called right before processing a batch during training."""
+
+        if not self.sampling:
+            # The measure is stopped, so this just starts it with the label
+            # (a single call to the library)
+            self.mp.next_region(batch, self.output_file)
+            self.measuring = True
+            return
+
+        self.__batches += 1
+        if self.__chosen is not None:
+            sampled = batch in self.__chosen
+        elif self.fraction is not None:
+            sampled = self.rng.random() < self.fraction
+        else:
+            sampled = batch % self.every == 0
+        if sampled:
+            self.mp.start_measure()
+            self.measuring = True
+
+    def on_train_batch_end(self, batch, logs=None):
+        """Called at the end of training a batch. Within this method, logs is a
+        dict containing the metrics results."""
+
+        if not self.measuring:
+            return
+
+        self.measuring = False
+        if not self.sampling:
+            # Stops and prints the region with a single call to the library
+            self.mp.end_region(self.output_file)
+            return
+        self.mp.stop_measure()
+        self.__samples.append((batch, self.mp.values.copy(),
+                               self.mp.times[0], self.mp.times[1]))
+
+    def on_test_batch_begin(self, batch, logs=None):
+        """Called right before processing a batch during testing."""
+        pass
+
+    def on_test_batch_end(self, batch, logs=None):
+        """Called at the end of testing a batch. Within this method, logs is a
+        dict containing the metrics results."""
+        pass
+
+    def on_predict_batch_begin(self, batch, logs=None):
+        """Called right before processing a batch during predicting."""
+        pass
+
+    def on_predict_batch_end(self, batch, logs=None):
+        """Called at the end of predicting a batch. Within this method, logs is
+        a dict containing the metrics results."""
+        pass
+    # ----------------------- END Batch-level methods ----------------------- #
+
+    # ------------------------- Epoch-level methods ------------------------- #
+    def on_epoch_begin(self, epoch, logs=None):
+        """Called at the beginning of an epoch during training.
+
+        Raises
+        ------
+        ValueError
+            If the reservoir is used and the number of batches of the epoch
+            isn't known
+        """
+
+        self.__batches = 0
+        self.__samples = []
+        self.__chosen = None
+        if self.reservoir is None:
+            return
+        # The reservoir is chosen in advance, so only those batches are
+        # measured
+        steps = self.params.get("steps") if self.params else None
+        if not steps:
+            raise ValueError("The reservoir needs the number of batches of "
+                             "each epoch (steps), use `every` or `fraction` "
+                             "instead")
+        self.__chosen = set(self.rng.choice(
+            steps, min(self.reservoir, steps), replace=False).tolist())
+
+    def on_epoch_end(self, epoch, logs=None):
+        """Called at the end of an epoch during training."""
+
+        if not self.sampling:
+            return
+
+        for batch, values, begin, end in self.__samples:
+            self.mp.results.append(values, self.mp.events,
+                                   self.mp.cpus_measured, begin, end,
+                                   region=epoch, label=batch)
+        if not self.__samples:
+            return
+        totals = self.__estimate()
+        self.estimates.append((epoch, self.__batches, len(self.__samples),
+                               totals))
+        if self.output_file is None:
+            print("Epoch %d: %d of %d batches measured"
+                  % (epoch, len(self.__samples), self.__batches))
+            for event, (estimate, low, high) in totals.items():
+                print("\t%-42s %20.0f [%.0f, %.0f]"
+                      % (event, estimate, low, high))
+    # ----------------------- END Epoch-level methods ----------------------- #
+
+    def __estimate(self):
+        """
+        Estimates the total of each event in the epoch from the mean of the
+        batches sampled, with the interval of the normal approximation. The
+        variance of a systematic sample (`every`) is estimated from the
+        successive differences and the one of a random sample from the
+        sample variance. The finite population correction makes it exact when
+        all are sampled.
+        """
+
+        # Total of each batch sampled (all the cpus) per event
+        sums = np.array([values.sum(axis=0)
+                         for _, values, _, _ in self.__samples], dtype=float)
+        n, N = len(sums), self.__batches
+        mean = sums.mean(axis=0)
+        if n > 1:
+            if self.every != 1:
+                # Samples in the order of the batches
+                variance = (np.diff(sums, axis=0) ** 2).sum(axis=0) \
+                    / (2 * (n - 1))
+            else:
+                variance = sums.var(axis=0, ddof=1)
+            fpc = np.sqrt((N - n) / (N - 1)) if N > n else 0.0
+            error = self.z * np.sqrt(variance / n) * fpc
+        else:
+            # A single batch can't tell the variance, unless it's the only one
+            error = np.zeros(len(mean)) if N == 1 else \
+                np.full(len(mean), np.inf)
+        # The events can't be negative
+        return {event: (N * m, max(N * (m - e), 0.0), N * (m + e))
+                for event, m, e in zip(self.mp.events, mean, error)}
+# --------------------------------------------------------------------------- #
+
+class MeasureOnEachBatchLap(MyCallbacks):
+    """
+    Custom callback to run with my_papi library and measures the system in each
+    batch. The counters are started once at the beginning of the training and
+    read at the end of each batch, so there is no gap between batches.
+
+    Attributes
+    ----------
+    self.mp : my_papi
+        Oject of the class my_papi
+    self.output_file : str
+        Path (and name) of the file where the results will be printed. If it's
+        `None`, then the results will be printed on screen
+    """
+
+    def __init__(self, lib_path, events_file, output_file=None):
+        """
+        Class Constructor to initialize the object.
+
+        Parameters
+        ----------
+        lib_path : str
+            Path to the shared library libmy_papi.so
+        events_file : str
+            Path where the file, with the events to be measured, is located
+        output_file : str, optional
+            Path (and name) of the file where the results will be printed. If
+            `None` is passed, then the results will be printed on screen
+        """
+
+        super(MeasureOnEachBatchLap, self).__init__(events_file=events_file,
+                                                    lib_path=lib_path,
+                                                    output_file=output_file)
+
+    # --------------------------- Global methods ---------------------------- #
+    def on_train_begin(self, logs=None):
+        """Called at the beginning of fit."""
+
+        # Starts the measure with my_papi library
+        self.mp.start_measure()
+
+    def on_train_end(self, logs=None):
+        """Called at the end of fit."""
+
+        # Stops the measure with my_papi library
+        self.mp.stop_measure()
+
+        # Writes the results buffered during the training
+        self.mp.flush_measure()
+    # ------------------------- END Global methods -------------------------- #
+
+    # ------------------------- Batch-level methods ------------------------- #
+    def on_train_batch_end(self, batch, logs=None):
+        """Called at the end of training a batch. Within this method, logs is a
+        dict containing the metrics results."""
+
+        # Reads the deltas of this batch and saves them on a file
+        self.mp.lap()
+        self.mp.print_measure(self.output_file)
+    # ----------------------- END Batch-level methods ----------------------- #
+# --------------------------------------------------------------------------- #
+
+class MeasureEpochAndBatch(keras.callbacks.Callback):
+    """
+    Custom callback to run with my_papi library and measures the system in each
+    epoch.
+
+    Attributes
+    ----------
+    self.mp : my_papi
+        Oject of the class my_papi
+    self.output_file : str
+        Path (and name) of the file where the results will be printed. If it's
+        `None`, then the results will be printed on screen
+    """
+
+    def __init__(self, lib_path, events_file, output_file=None):
+        """
+        Class Constructor to initialize the object.
+
+        Parameters
+        ----------
+        lib_path : str
+            Path to the shared library libmy_papi.so
+        events_file : str
+            Path where the file, with the events to be measured, is located
+        output_file : str, optional
+            Path (and name) of the file where the results will be printed. If
+            `None` is passed, then the results will be printed on screen
+        """
+
+        super(MeasureEpochAndBatch, self).__init__()
+
+        # Creates two objects of the class my_papi
+        self.mp_epoch = MyPapi(lib_path=lib_path)
+        self.mp_batch = MyPapi(lib_path=lib_path)
+
+        # Prepares the measure on the cpus where the process can run
+        self.cpus = get_cpus()
+        self.mp_epoch.prepare_measure(events_file=events_file, cpus=self.cpus)
+        self.mp_batch.prepare_measure(events_file=events_file, cpus=self.cpus)
+
+        # Save the output file variable for later
+        self.output_file = output_file
+
+        # We have to decompose the path, name and extension of the output file
+        if self.output_file is not None:
+            # Gets an array with head + tail: path + file_name
+            self.head_tail = os.path.split(output_file)
+            self.name_extension = os.path.splitext(self.head_tail[1])
+
+            # From the file indicated, generate a new file
+            self.batch_output_file = self.head_tail[0] + "/" + str(self.name_extension[0]
+            + "_batch" + self.name_extension[1])
+        else:
+            self.batch_output_file = None
+        # Just measure the batches indicated
+        self.measure_batch = True
+
+    # ------------------------- Batch-level methods ------------------------- #
+    def on_train_batch_begin(self, batch, logs=None):
+        """Called right before processing a batch during training."""
+
+        if self.measure_batch:
+            self.mp_batch.start_measure()
+
+    def on_train_batch_end(self, batch, logs=None):
+        """Called at the end of training a batch. Within this method, logs is a
+        dict containing the metrics results."""
+
+        if self.measure_batch:
+            self.mp_batch.stop_measure()
+            self.mp_batch.print_measure(self.batch_output_file)
+    # ----------------------- END Batch-level methods ----------------------- #
+
+    # --------------------------- Global methods ---------------------------- #
+    def on_train_end(self, logs=None):
+        """Called at the end of fit."""
+
+        # Writes the results buffered during the training
+        self.mp_epoch.flush_measure()
+        self.mp_batch.flush_measure()
+    # ------------------------- END Global methods -------------------------- #
+
+    # ------------------------- Epoch-level methods ------------------------- #
+    def on_epoch_begin(self, epoch, logs=None):
+        """Called at the beginning of an epoch during training."""
+
+        print("Begin del epoch", epoch)
+
+        if epoch == 1:
+            self.measure_batch = False
+
+        # Starts the measure with my_papi library
+        self.mp_epoch.start_measure()
+
+    def on_epoch_end(self, epoch, logs=None):
+        """Called at the end of an epoch during training."""
+
+        print("\nEnd del epoch", epoch)
+
+        # Stops the measure with my_papi library
+        self.mp_epoch.stop_measure()
+
+        # Saves the results on a file
+        self.mp_epoch.print_measure(self.output_file)
+
+        # if epoch == 1:
+        #     self.measure_batch = False
+    # ----------------------- END Epoch-level methods ----------------------- #
+# --------------------------------------------------------------------------- #
+
+
+class MeasureGroupsRoundRobin(keras.callbacks.Callback):
+    """
+    Custom callback to run with my_papi library and measure more events than
+    counters in a single training. The active group of events is switched at
+    each epoch, or every N batches, in round robin.
+
+    The results of each group are printed to their own file (`_g<group>`
+    before the extension) and the regions are listed in order in the file
+    ending in `_schedule`, with the epoch, first batch and group of each one.
+
+    Attributes
+    ----------
+    self.mpg : MyPapiGroups
+        Object of the class MyPapiGroups
+    self.output_file : str
+        Path (and name) of the files where the results will be printed. If
+        it's `None`, then the results will be printed on screen
+    self.batches : int
+        Batches of each region, or `None` if the regions are the epochs
+    self.schedule : list
+        Epoch, first batch and group of each region
+    """
+
+    def __init__(self, lib_path, events_file, output_file=None, batches=None,
+                 cpus=None):
+        """
+        Class Constructor to initialize the object.
+
+        Parameters
+        ----------
+        lib_path : str
+            Path to the shared library libmy_papi.so
+        events_file : str or list
+            Path of the file with all the events, which are planned in groups,
+            or list of files with one group each
+        output_file : str, optional
+            Path (and name) of the files where the results will be printed. If
+            `None` is passed, then the results will be printed on screen
+        batches : int, optional
+            Batches of each region. If `None` is passed, the group is switched
+            at each epoch (default is None)
+        cpus : list, optional
+            Cpus to be measured (default is all)
+        """
+
+        super(MeasureGroupsRoundRobin, self).__init__()
+
+        self.mpg = MyPapiGroups(lib_path, events_file, cpus=cpus)
+        # Each fit after the first one measures with new sessions
+        self.__groups_args = (lib_path, events_file)
+        self.__cpus = cpus
+        self.__finalized = False
+        self.output_file = output_file
+        self.batches = batches
+        self.schedule = []
+        self.__epoch = 0
+        self.__running = False
+
+    # --------------------------- Global methods ---------------------------- #
+    def on_train_begin(self, logs=None):
+        """Called at the beginning of fit."""
+
+        if self.__finalized:
+            self.mpg = MyPapiGroups(*self.__groups_args, cpus=self.__cpus)
+            self.schedule = []
+            self.__finalized = False
+
+    def on_train_end(self, logs=None):
+        """Called at the end of fit."""
+
+        self.mpg.flush_measure()
+        if self.output_file is not None:
+            name, extension = os.path.splitext(self.output_file)
+            with open(name + "_schedule" + extension, "w") as f:
+                f.write("REGION,EPOCH,BATCH,GROUP\n")
+                for region, (epoch, batch, group) in enumerate(self.schedule):
+                    f.write("%d,%d,%d,%d\n" % (region, epoch, batch, group))
+        self.mpg.finalize_measure()
+        self.__finalized = True
+    # ------------------------- END Global methods -------------------------- #
+
+    # ------------------------- Batch-level methods ------------------------- #
+    def on_train_batch_begin(self, batch, logs=None):
+        """Called right before processing a batch during training."""
+
+        if self.batches is not None and not self.__running:
+            self.__start(batch)
+
+    def on_train_batch_end(self, batch, logs=None):
+        """Called at the end of training a batch. Within this method, logs is a
+        dict containing the metrics results."""
+
+        if (self.batches is not None and
+                batch + 1 - self.schedule[-1][1] >= self.batches):
+            self.__stop()
+    # ----------------------- END Batch-level methods ----------------------- #
+
+    # ------------------------- Epoch-level methods ------------------------- #
+    def on_epoch_begin(self, epoch, logs=None):
+        """Called at the beginning of an epoch during training."""
+
+        self.__epoch = epoch
+        if self.batches is None:
+            self.__start(0)
+
+    def on_epoch_end(self, epoch, logs=None):
+        """Called at the end of an epoch during training."""
+
+        # The last region of the epoch may have less batches
+        if self.__running:
+            self.__stop()
+    # ----------------------- END Epoch-level methods ----------------------- #
+
+    def __start(self, batch):
+        """Starts a region with the next group."""
+
+        self.schedule.append((self.__epoch, batch, self.mpg.group))
+        self.__running = True
+        self.mpg.start_measure()
+
+    def __stop(self):
+        """Stops the region and prints its results."""
+
+        self.mpg.stop_measure()
+        self.__running = False
+        self.mpg.print_measure(self.output_file)
+# --------------------------------------------------------------------------- #
+
+class ProfileOnTrainPhase(keras.callbacks.Callback):
+    """
+    Custom callback to run with my_papi library and sample where the events
+    happen in the training phase. The results are written as collapsed stacks
+    (one file per event) to render flamegraphs.
+
+    Attributes
+    ----------
+    self.profiler : MyProfiler
+        Object of the class MyProfiler
+    self.output_file : str
+        Path (and name) of the files where the collapsed stacks will be saved.
+        The name of each event is appended before the extension
+    """
+
+    def __init__(self, lib_path, events_file, output_file,
+                 thresholds=1_000_000):
+        """
+        Class Constructor to initialize the object.
+
+        Parameters
+        ----------
+        lib_path : str
+            Path to the shared library libmy_papi.so
+        events_file : str
+            Path where the file, with the events to be sampled, is located
+        output_file : str
+            Path (and name) of the files where the collapsed stacks will be
+            saved
+        thresholds : int or dict, optional
+            Occurrences of the events between two samples, as in
+            `MyProfiler.prepare` (default is 1000000)
+        """
+
+        super(ProfileOnTrainPhase, self).__init__()
+
+        self.profiler = MyProfiler(lib_path)
+        self.profiler.prepare(events_file, thresholds)
+        self.output_file = output_file
+
+    # --------------------------- Global methods ---------------------------- #
+    def on_train_begin(self, logs=None):
+        """Called at the beginning of fit."""
+
+        self.profiler.start()
+
+    def on_train_end(self, logs=None):
+        """Called at the end of fit."""
+
+        self.profiler.stop()
+
+        # Saves the stacks of each event on a file
+        name, extension = os.path.splitext(self.output_file)
+        for event in self.profiler.events:
+            self.profiler.save(name + "_" + event.replace(":", "_")
+                               + extension, event)
+        self.profiler.finalize()
+    # ------------------------- END Global methods -------------------------- #
+# --------------------------------------------------------------------------- #
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# --------------------------------------------------------------------------- #
+__author__ = "Juan Luis Padilla Salomé"
+__copyright__ = "Copyright 2021"
+__credits__ = ["University of Cantabria", "Pablo Abad", "Pablo Prieto"]
+__license__ = "GPL"
+__version__ = "1.0.0"
+__maintainer__ = "Juan Luis Padilla Salomé"
+__email__ = "juan-luis.padilla@alumnos.unican.es"
+__status__ = "Production"
+# --------------------------------------------------------------------------- #
+
+
+def process_alive(pid):
+    """Returns whether the process exists and isn't a zombie."""
+
+    try:
+        with open("/proc/%d/stat" % pid) as f:
+            # The state goes after the name, which is between parenthesis
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except (FileNotFoundError, IndexError):
+        return False
+# --------------------------------------------------------------------------- #
+
+
+# --------------------------------------------------------------------------- #
+if __name__ == "__main__":
+    """Attaches to a process already running (e.g. a training job) and counts
+    the events of its threads, including the ones created later, without
+    modifying it. A snapshot with the events counted in each interval is
+    taken until the process exits or Ctrl+C is pressed.
+    @param pid id of the process to be measured.
+    @param events_file file with the events, one per line.
+    @param interval seconds between two snapshots (default is 1).
+    @param output_file file where the snapshots are saved (default is the
+        screen).
+    """
+
+    # standard library
+    import pathlib
+    import sys
+    import time
+
+    # 3rd party packages
+
+    # local source
+    from MyPapi import MyPapi
+
+    # ----------------------------------------------------------------------- #
+
+    # Reads the parameters and check the correctness
+    if len(sys.argv) < 3:
+        print("[ERROR] Wrong parameters.\n\tUsage: python3 attach.py [PID] "
+              "[EVENTS_FILE] [INTERVAL (s)] [OUTPUT_FILE]")
+        sys.exit(-1)
+
+    pid = int(sys.argv[1])
+    if not process_alive(pid):
+        print("[ERROR] The process %d doesn't exist." % pid)
+        sys.exit(-1)
+
+    events_file = sys.argv[2]
+
+    interval = 1.0
+    if len(sys.argv) > 3:
+        interval = float(sys.argv[3])
+
+    output_file = None
+    if len(sys.argv) > 4:
+        output_file = sys.argv[4]
+
+    # The library is next to this script
+    LIB_DIR = pathlib.Path(__file__).absolute().parent.parent / "lib"
+    libname = LIB_DIR / "libmy_papi.so"
+
+    mp = MyPapi(str(libname))
+    mp.prepare_attach_measure(events_file, pid)
+
+    mp.start_measure()
+    try:
+        running = True
+        while running:
+            time.sleep(interval)
+            running = process_alive(pid)
+            # Events counted since the previous snapshot
+            values = mp.lap()
+            if output_file is not None:
+                mp.print_measure(output_file)
+            else:
+                # The threads are added up, the rows are in the file
+                totals = values.sum(axis=0)
+                print("%.3f " % time.time() + " ".join(
+                    "%s=%d" % (e, v) for e, v in zip(mp.events, totals)))
+    except KeyboardInterrupt:
+        pass
+    mp.stop_measure()
+    mp.finalize_measure()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# --------------------------------------------------------------------------- #
+__author__ = "Juan Luis Padilla Salomé"
+__copyright__ = "Copyright 2021"
+__credits__ = ["University of Cantabria", "Pablo Abad", "Pablo Prieto"]
+__license__ = "GPL"
+__version__ = "1.0.0"
+__maintainer__ = "Juan Luis Padilla Salomé"
+__email__ = "juan-luis.padilla@alumnos.unican.es"
+__status__ = "Production"
+# --------------------------------------------------------------------------- #
+
+
+# --------------------------------------------------------------------------- #
+if __name__ == "__main__":
+    """Shows the catalog of events of this host (building its cache the first
+    time) and checks the files of events passed, before running anything.
+    With `plan`, the events of a file are split in groups that fit in the
+    counters, which are saved as new files of events.
+    @param rebuild if passed, the cache is built again.
+    @param events_files files with the events, one per line.
+    @param plan EVENTS_FILE [OUTPUT_PREFIX] plans the groups of the file and
+        saves each one in OUTPUT_PREFIX_<group>.cfg (default is just to show
+        them).
+    """
+
+    # standard library
+    import pathlib
+    import sys
+
+    # 3rd party packages
+
+    # local source
+    from MyPapi import EventCatalog, read_events, write_events
+
+    # ----------------------------------------------------------------------- #
+
+    # Reads the parameters
+    args = sys.argv[1:]
+    rebuild = len(args) > 0 and args[0] == "rebuild"
+    if rebuild:
+        args = args[1:]
+    plan = len(args) > 0 and args[0] == "plan"
+    if plan and len(args) not in (2, 3):
+        print("[ERROR] Wrong parameters.\n\tUsage: python3 catalog.py "
+              "[rebuild] plan [EVENTS_FILE] [OUTPUT_PREFIX]")
+        sys.exit(-1)
+
+    # The library is next to this script
+    LIB_DIR = pathlib.Path(__file__).absolute().parent.parent / "lib"
+    libname = LIB_DIR / "libmy_papi.so"
+
+    catalog = EventCatalog(str(libname), rebuild=rebuild)
+    print("Host: %s" % catalog.key)
+    print("Cache: %s" % catalog.path)
+    print("Counters: %d" % catalog.num_counters)
+    print("Events: %d" % len(catalog.events))
+
+    if plan:
+        groups = catalog.plan(read_events(args[1]))
+        print("\n%s: %d groups" % (args[1], len(groups)))
+        for i, group in enumerate(groups):
+            print("\t%d: %s" % (i, ", ".join(group)))
+            if len(args) > 2:
+                write_events("%s_%d.cfg" % (args[2], i), group)
+        sys.exit(0)
+
+    for events_file in args:
+        events = read_events(events_file)
+        missing = [e for e, a in zip(events, catalog.available(events))
+                   if not a]
+        print("\n%s: %d events" % (events_file, len(events)))
+        if missing:
+            print("\tNot available: %s" % ", ".join(missing))
+        else:
+            print("\tFit together: %s" % catalog.fits(events))
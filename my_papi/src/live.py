@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# --------------------------------------------------------------------------- #
+__author__ = "Juan Luis Padilla Salomé"
+__copyright__ = "Copyright 2021"
+__credits__ = ["University of Cantabria", "Pablo Abad", "Pablo Prieto"]
+__license__ = "GPL"
+__version__ = "1.0.0"
+__maintainer__ = "Juan Luis Padilla Salomé"
+__email__ = "juan-luis.padilla@alumnos.unican.es"
+__status__ = "Production"
+# --------------------------------------------------------------------------- #
+
+# Imports for the module
+import mmap
+import struct
+import time
+import numpy as np
+
+# Layout of the header (struct my_live): magic, sequence, times, cpus, events
+HEADER = struct.Struct("<8sQ4qii")
+MAGIC = b"MYPAPI1\0"
+MAX_LENGTH_EVENT_NAME = 150
+# --------------------------------------------------------------------------- #
+
+
+class LiveCounters(object):
+    """
+    Reader of the values published by `MyPapi.publish_measure` in a file
+    mapped in memory. It never locks the writer: a read is retried if the
+    values changed while they were copied.
+
+    Attributes
+    ----------
+    self.events : list
+        Names of the events, one per column of the values
+    self.num_cpus : int
+        Number of rows (cpus or threads) of the values
+    """
+
+    def __init__(self, live_file):
+        """
+        LiveCounters class constructor. It maps the file.
+
+        Parameters
+        ----------
+        live_file : str
+            Path of the file where the values are published
+        """
+
+        super(LiveCounters, self).__init__()
+
+        with open(live_file, "rb") as f:
+            self.__mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, _, _, _, _, _, self.num_cpus, num_events = \
+            HEADER.unpack_from(self.__mm)
+        if magic != MAGIC:
+            raise ValueError("'%s' isn't a file of live counters" % live_file)
+
+        self.__num_values = self.num_cpus * num_events
+        names = HEADER.size + 8 * (self.num_cpus + self.__num_values)
+        self.events = [
+            self.__mm[names + j * MAX_LENGTH_EVENT_NAME:
+                      names + (j + 1) * MAX_LENGTH_EVENT_NAME]
+            .split(b"\0", 1)[0].decode('utf-8') for j in range(num_events)]
+    # ----------------------------------------------------------------------- #
+
+    def read(self, max_tries=1000):
+        """Returns a consistent copy of the last values published.
+
+        Parameters
+        ----------
+        max_tries : int, optional
+            Number of copies tried while the values are being written
+            (default is 1000)
+
+        Returns
+        -------
+        values : numpy.ndarray
+            Matrix (cpus x events) with the values of each cpu
+        ids : numpy.ndarray
+            Cpu (or thread) of each row, 0 if the row is free
+        times : numpy.ndarray
+            Real and virtual time (ns) when the region began and ended
+
+        Raises
+        ------
+        RuntimeError
+            If no consistent copy is got after `max_tries`
+        """
+
+        for _ in range(max_tries):
+            seq = self.__get_seq()
+            if seq % 2 == 1:
+                time.sleep(0)
+                continue
+            times = np.array(HEADER.unpack_from(self.__mm)[2:6])
+            data = np.frombuffer(self.__mm, dtype=np.int64,
+                                 count=self.num_cpus + self.__num_values,
+                                 offset=HEADER.size).copy()
+            if self.__get_seq() == seq:
+                return (data[self.num_cpus:].reshape(self.num_cpus, -1),
+                        data[:self.num_cpus], times)
+        raise RuntimeError("The live counters are changing too fast")
+    # ----------------------------------------------------------------------- #
+
+    def close(self):
+        """Unmaps the file.
+
+        Parameters
+        ----------
+        None
+        """
+
+        self.__mm.close()
+    # ----------------------------------------------------------------------- #
+
+    def __get_seq(self):
+        """Returns the sequence of the seqlock."""
+
+        return struct.unpack_from("<Q", self.__mm, 8)[0]
+    # ----------------------------------------------------------------------- #
+
+# --------------------------------------------------------------------------- #
+
+
+# --------------------------------------------------------------------------- #
+if __name__ == "__main__":
+    """Shows the values published by a process that is being measured (see
+    `MyPapi.publish_measure`), refreshing them until Ctrl+C is pressed. The
+    cpus (or threads) are added up.
+    @param live_file file where the values are published.
+    @param interval seconds between two refreshes (default is 1).
+    """
+
+    # standard library
+    import sys
+
+    # 3rd party packages
+
+    # local source
+
+    # ----------------------------------------------------------------------- #
+
+    # Reads the parameters and check the correctness
+    if len(sys.argv) < 2:
+        print("[ERROR] Wrong parameters.\n\tUsage: python3 live.py "
+              "[LIVE_FILE] [INTERVAL (s)]")
+        sys.exit(-1)
+
+    live_file = sys.argv[1]
+
+    interval = 1.0
+    if len(sys.argv) > 2:
+        interval = float(sys.argv[2])
+
+    live = LiveCounters(live_file)
+    try:
+        while True:
+            values, ids, times = live.read()
+            real = (times[1] - times[0]) / 1e9
+            # The free rows of the threads are zero
+            totals = values.sum(axis=0)
+            print("\n%s | region of %.3f s" % (time.strftime("%H:%M:%S"), real))
+            for event, total in zip(live.events, totals):
+                rate = total / real if real > 0 else 0
+                print("\t%-42s %20d %16.4g/s" % (event, total, rate))
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    live.close()
@@ -1,36 +1,287 @@
+#define _GNU_SOURCE
+#include <dirent.h>
+#include <dlfcn.h>
+#include <fcntl.h>
 #include <locale.h>
+#include <pthread.h>
+#include <signal.h>
+#include <stdatomic.h>
 #include <stdbool.h>
+#include <stdint.h>
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
+#include <sys/mman.h>
+#include <sys/syscall.h>
+#include <time.h>
+#include <unistd.h>
 #include "my_papi.h"
 
+// ----------------------------------------------------------------------------
+// Types
+// ----------------------------------------------------------------------------
+// Operations that the workers of the parallel mode can perform
+enum worker_op
+{
+    WORKER_START,
+    WORKER_STOP,
+    WORKER_EXIT
+};
+
+// Argument of each worker: its session and the index of its event set
+struct my_worker_arg
+{
+    my_session_t *session;
+    int index;
+};
+
+// Header of the live file, followed by the ids of the rows (num_cpus), the
+// values (num_cpus x num_events) and the names of the events
+// (MAX_LENGTH_EVENT_NAME bytes each). Readers copy the times, ids and values
+// and retry if the sequence was odd or changed meanwhile (seqlock)
+struct my_live
+{
+    char magic[8];
+    atomic_ullong seq;
+    long long times[NUM_REGION_TIMES];
+    int num_cpus;
+    int num_events;
+    long long data[];
+};
+
+// Everything needed to perform a measure. Each session has its own event
+// sets and results, so several of them can be used at the same time
+struct my_session
+{
+    // Array of strings which corresponds to the events to be measured
+    char **events;
+
+    // Number of the events to be measured
+    int num_events;
+
+    // Codes of the events, resolved once from their names
+    int *event_codes;
+
+    // Whether the events have been added (one by one) to an event set
+    // without errors, so the next ones can add all of them at once
+    bool events_checked;
+
+    // Array of event sets (PAPI_NULL if the row isn't counting)
+    int *event_sets;
+
+    // Number of event sets handled by the session: one per cpu or, in
+    // thread_mode, just the one of the thread that prepared it
+    int num_event_sets;
+
+    // CPUS where we have to measure or, in thread_mode or attached to a
+    // process, the id of the thread of each row (0 if the row is free)
+    int *cpus;
+
+    // Number of cpus (rows of the results), the same as num_event_sets
+    // unless in thread_mode
+    int num_cpus;
+
+    // Whether each row counts a thread of this process instead of a cpu.
+    // The threads register themselves and handle their own event sets
+    bool thread_mode;
+
+    // Protects the rows of the threads when they register/unregister
+    pthread_mutex_t threads_lock;
+
+    // Whether the event sets are counting
+    bool running;
+
+    // Matrix (num_cpus x num_events, one row after another) were the results
+    // are stored
+    long long *values;
+
+    // Values read on the previous lap, used to compute the deltas of each lap
+    long long *lap_values;
+
+    // Mean values (num_cpus x num_events) of an empty region, read and lap,
+    // subtracted from the values of each stop, read and lap (NULL if not
+    // calibrated), and the total of each event below which they can't be
+    // told apart from it
+    long long *overhead[NUM_OVERHEADS];
+    long long *noise_floor[NUM_OVERHEADS];
+
+    // Whether each event of the last stop, read or lap is within the noise
+    // floor
+    int *noisy;
+
+    // Values read from one event set on each lap
+    long long *snapshot;
+
+    // Whether the events are multiplexed in the counters
+    bool multiplex_mode;
+
+    // Whether the events of the next prepared measure will be multiplexed
+    bool multiplex_requested;
+
+    // Real and virtual time (ns) when the last region began and ended
+    long long times[NUM_REGION_TIMES];
+
+    // Real and virtual time (ns) of the previous lap (or of the start)
+    long long lap_times[2];
+
+    // Label of the current region given by my_session_next_region (-1 if
+    // none), written with its values
+    long long label;
+
+    // If multiplexed, the perf events (num_cpus x num_events) that PAPI
+    // opened for the events of each event set. PAPI scales the values with
+    // their times enabled and running but doesn't return them, so they are
+    // read from these descriptors
+    int *mpx_fds;
+
+    // Count and times enabled and running (num_cpus x num_events x
+    // NUM_MPX_VALUES) of the perf events at the start and at the previous
+    // lap
+    long long *mpx_begin;
+    long long *mpx_lap;
+
+    // Raw count and times enabled and running (num_cpus x num_events x
+    // NUM_MPX_VALUES) of each event in the last region
+    long long *mpx_values;
+
+    // Whether the event sets are started/stopped by the workers
+    bool parallel_mode;
+
+    // One worker per event set and its argument
+    pthread_t *workers;
+    struct my_worker_arg *worker_args;
+
+    // Barriers that release the workers and wait for them to finish
+    pthread_barrier_t workers_go;
+    pthread_barrier_t workers_done;
+
+    // Operation to be performed by the workers when released
+    enum worker_op worker_op;
+
+    // Time (ns) when each event set was started or stopped
+    long long *op_times;
+
+    // Time (ns) between the first and the last event set started/stopped
+    long long start_skew;
+    long long stop_skew;
+
+    // Thread that reads the counters periodically and whether it's running
+    pthread_t sampler;
+    atomic_bool sampler_running;
+
+    // Time (ns) between two samples
+    long long sampler_interval;
+
+    // Ring buffer with the samples: timestamp (ns) followed by the values of
+    // all the cpus. Written by the sampler and read by the fetch
+    long long *samples;
+
+    // Number of samples that fit in the ring buffer
+    size_t max_samples;
+
+    // Number of samples written and read (they only grow)
+    atomic_size_t samples_head;
+    atomic_size_t samples_tail;
+
+    // Number of samples discarded because the ring buffer was full
+    atomic_llong samples_dropped;
+
+    // Buffer with the records (values of each stop) pending to be written
+    long long *records;
+
+    // Index of the output file of each buffered record
+    int *record_files;
+
+    // Number of records stored and reserved in the buffer
+    size_t num_records;
+    size_t max_records;
+
+    // Output files referenced by the buffered records
+    char **output_files;
+
+    // Number of output files referenced by the buffered records
+    int num_output_files;
+
+    // Live file (mapped in memory) with the last values, or NULL
+    struct my_live *live;
+    size_t live_size;
+
+    // Serializes the writers of the live file (the sampler and the rest)
+    pthread_mutex_t live_lock;
+
+    // Serializes the calls to PAPI of the sampler with the ones of the reads,
+    // laps, resets and regions of the session (the stop joins the sampler)
+    pthread_mutex_t sampler_lock;
+
+    // If the rows are added up in the output files, the index of the group
+    // of each row (NULL if they aren't)
+    int *row_groups;
+
+    // Id printed for each group (e.g. the core or socket) and their number
+    int *group_ids;
+    int num_groups;
+
+    // Values (num_groups x num_events) and multiplexed values (num_groups x
+    // num_events x NUM_MPX_VALUES) of the groups of the record being written
+    long long *group_values;
+    long long *group_mpx;
+
+    // Stack of the regions entered and not exited yet: the id of each one
+    // and its frame (see my_region_frame)
+    int *region_stack;
+    long long *region_frames;
+    int region_depth;
+    int max_region_depth;
+
+    // Totals of each id of region (see my_region_totals) and number of ids
+    long long *region_totals;
+    int num_region_ids;
+};
+
 // ----------------------------------------------------------------------------
 // Global parameters
 // ----------------------------------------------------------------------------
 // We use retval to keep track of the number of the return value
 static int retval = 0;
 
-// Array of strings which corresponds to the events to be measured
-static char **events = NULL;
+// Whether the multiplex support of PAPI has been initialized
+static bool multiplex_initialized = false;
+
+// The multiplexed event sets are created with this lock, so the perf events
+// that PAPI opens meanwhile are theirs
+static pthread_mutex_t perf_fds_lock = PTHREAD_MUTEX_INITIALIZER;
+
+// Number of sessions created and not destroyed yet
+static int num_sessions = 0;
 
-// Number of the events to be measured
-static size_t num_events = 0;
+// Session used by the functions without a session parameter
+static my_session_t *default_session = NULL;
 
-// Array of event sets
-static int event_sets[MAX_CPUS] = {0};
+// Event set of the profiler, counting the thread that prepared it
+static int prof_event_set = PAPI_NULL;
 
-// Number of event sets which should be the same as the g_num_cpus
-static int num_event_sets = 0;
+// Events of the profiler, their codes and how many there are
+static char **prof_events = NULL;
+static int *prof_codes = NULL;
+static int prof_num_events = 0;
 
-// CPUS where we have to measure
-static int g_cpus[MAX_CPUS] = {0};
+// Indices of the events which overflowed, filled by the handler
+static int *prof_indices = NULL;
 
-// Number of cpus which should be the same as num_event_sets
-static int g_num_cpus = 0;
+// Signal raised on each overflow (0 if none)
+static int prof_signum = 0;
 
-// Matrix were the results are stored
-static long long values[MAX_CPUS][MAX_EVENTS] = {0};
+// Ring buffer of overflows (index of the event and instruction pointer).
+// Written by the handler and read by my_profile_fetch
+static int prof_sample_events[PROFILE_MAX_SAMPLES];
+static unsigned long long prof_sample_ips[PROFILE_MAX_SAMPLES];
+
+// Number of overflows written and read (they only grow)
+static atomic_size_t prof_head = 0;
+static atomic_size_t prof_tail = 0;
+
+// Number of overflows discarded because the ring buffer was full
+static atomic_llong prof_dropped = 0;
 
 // ----------------------------------------------------------------------------
 // Low_level functions
@@ -42,6 +293,13 @@ int my_PAPI_add_event(int EventSet, int Event)
     return retval;
 }
 
+int my_PAPI_add_events(int EventSet, int *EventCodes, int number)
+{
+    if ((retval = PAPI_add_events(EventSet, EventCodes, number)) != PAPI_OK)
+        ERROR_RETURN(retval);
+    return retval;
+}
+
 int my_PAPI_add_named_event(int EventSet, const char *EventName)
 {
     // printf("\tPAPI: '%s'\n", EventName);
@@ -60,6 +318,20 @@ int my_PAPI_assign_eventset_component(int EventSet, int cidx)
     return retval;
 }
 
+int my_PAPI_attach(int EventSet, unsigned long tid)
+{
+    if ((retval = PAPI_attach(EventSet, tid)) != PAPI_OK)
+        ERROR_RETURN(retval);
+    return retval;
+}
+
+int my_PAPI_cleanup_eventset(int EventSet)
+{
+    if ((retval = PAPI_cleanup_eventset(EventSet)) != PAPI_OK)
+        ERROR_RETURN(retval);
+    return retval;
+}
+
 int my_PAPI_create_eventset(int *EventSet)
 {
     if ((retval = PAPI_create_eventset(EventSet)) != PAPI_OK)
@@ -67,6 +339,23 @@ int my_PAPI_create_eventset(int *EventSet)
     return retval;
 }
 
+int my_PAPI_destroy_eventset(int *EventSet)
+{
+    if ((retval = PAPI_destroy_eventset(EventSet)) != PAPI_OK)
+        ERROR_RETURN(retval);
+    return retval;
+}
+
+int my_PAPI_event_name_to_code(const char *in, int *out)
+{
+    if ((retval = PAPI_event_name_to_code(in, out)) != PAPI_OK)
+    {
+        fprintf(stderr, "[MyPapi] Error: unknown event '%s'\n", in);
+        ERROR_RETURN(retval);
+    }
+    return retval;
+}
+
 const PAPI_hw_info_t *my_PAPI_get_hardware_info(void)
 {
     const PAPI_hw_info_t *hwinfo;
@@ -79,6 +368,13 @@ const PAPI_hw_info_t *my_PAPI_get_hardware_info(void)
     return hwinfo;
 }
 
+int my_PAPI_multiplex_init(void)
+{
+    if ((retval = PAPI_multiplex_init()) != PAPI_OK)
+        ERROR_RETURN(retval);
+    return retval;
+}
+
 int my_PAPI_get_opt(int option, PAPI_option_t *ptr)
 {
     return PAPI_get_opt(option, ptr);
@@ -98,6 +394,10 @@ int my_PAPI_library_init(int version)
             PAPI_perror("[MyPapi] Error initializing the PAPI library\n");
             ERROR_RETURN(retval);
         }
+        // PAPI is called from other threads (the sampler, the workers and
+        // the threads measured) and its thread support must be initialized
+        // before any event set is created
+        my_PAPI_thread_init(pthread_self);
     }
     return retval;
 }
@@ -109,6 +409,22 @@ int my_PAPI_list_events(int EventSet, int *Events, int *number)
     return retval;
 }
 
+int my_PAPI_overflow(int EventSet, int EventCode, int threshold, int flags,
+                     PAPI_overflow_handler_t handler)
+{
+    if ((retval = PAPI_overflow(EventSet, EventCode, threshold, flags,
+                                handler)) != PAPI_OK)
+        ERROR_RETURN(retval);
+    return retval;
+}
+
+int my_PAPI_read(int EventSet, long long *values)
+{
+    if ((retval = PAPI_read(EventSet, values)) != PAPI_OK)
+        ERROR_RETURN(retval);
+    return retval;
+}
+
 int my_PAPI_register_thread(void)
 {
     if ((retval = PAPI_register_thread()) != PAPI_OK)
@@ -123,6 +439,20 @@ int my_PAPI_unregister_thread(void)
     return retval;
 }
 
+int my_PAPI_reset(int EventSet)
+{
+    if ((retval = PAPI_reset(EventSet)) != PAPI_OK)
+        ERROR_RETURN(retval);
+    return retval;
+}
+
+int my_PAPI_set_multiplex(int EventSet)
+{
+    if ((retval = PAPI_set_multiplex(EventSet)) != PAPI_OK)
+        ERROR_RETURN(retval);
+    return retval;
+}
+
 int my_PAPI_set_opt(int option, PAPI_option_t *ptr)
 {
     if ((retval = PAPI_set_opt(option, ptr)) != PAPI_OK)
@@ -174,285 +504,2646 @@ int my_get_total_cpus()
     return hwinfo->totalcpus;
 }
 
-// ----------------------------------------------------------------------------
-// For python
-// ----------------------------------------------------------------------------
-int my_prepare_measure(char *input_file_name, int num_cpus, int *cpus)
+// Allocates zeroed memory or ends the execution if it isn't possible
+static void *my_calloc(size_t num, size_t size)
 {
-    int i, j;
-    FILE *fp;
-    const int cidx = 0;
-    PAPI_option_t opts;
-    char line[MAX_LENGTH_EVENT_NAME];
-
-    /* -------------------------- Checking PARAMS -------------------------- */
-    if (num_cpus < 1 || num_cpus > MAX_CPUS)
-    {
-        fprintf(stderr, "[MyPapi] Error: wrong number of cpus '%d'\n",
-                num_cpus);
-        exit(EXIT_FAILURE);
-    }
-    fp = fopen(input_file_name, "r");
-    if (fp == NULL)
+    void *ptr = calloc(num, size);
+    if (ptr == NULL && num != 0 && size != 0)
     {
-        fprintf(stderr, "[MyPapi] Error: couldn't open file '%s'\n",
-                input_file_name);
+        fprintf(stderr, "[MyPapi] Error: couldn't allocate memory.\n");
         exit(EXIT_FAILURE);
     }
-    /* ------------------------ END checking PARAMS ------------------------ */
+    return ptr;
+}
 
-    /* ------------------------ FIRST READ of file ------------------------- */
-    // Read lines of a maximum size equals to MAX_LENGTH_EVENT_NAME
-    num_events = 0;
-    while (fgets(line, MAX_LENGTH_EVENT_NAME, fp) != NULL)
+// Resizes the memory or ends the execution if it isn't possible
+static void *my_realloc(void *ptr, size_t size)
+{
+    ptr = realloc(ptr, size);
+    if (ptr == NULL && size != 0)
     {
-        num_events++;
+        fprintf(stderr, "[MyPapi] Error: couldn't allocate memory.\n");
+        exit(EXIT_FAILURE);
     }
-    /* ----------------------- END FIRST READ of file ---------------------- */
+    return ptr;
+}
 
-    events = (char **)calloc(sizeof(char **), num_events);
+// Reads the events of the file, one per line, into an array which grows as
+// needed. Empty lines, comments ('#') and repeated events are skipped. The
+// file is closed and the number of events returned
+static int my_read_events(FILE *fp, char ***events)
+{
+    size_t j, num_events = 0, max_events = 0;
+    char line[MAX_LENGTH_EVENT_NAME];
 
-    /* ------------------------ SECOND READ of file ------------------------ */
-    // Extract the events from each line and store them in the array
-    i = 0;
-    rewind(fp);
+    *events = NULL;
     while (fgets(line, MAX_LENGTH_EVENT_NAME, fp) != NULL)
     {
-        events[i] = (char *)calloc(sizeof(char *), MAX_LENGTH_EVENT_NAME);
         // Substitute '\n' or '\r' for '\0'
         line[strcspn(line, "\r\n")] = 0;
-        strncpy(events[i++], line, strlen(line));
+        if (line[0] == '\0' || line[0] == '#')
+        {
+            continue;
+        }
+        for (j = 0; j < num_events && strcmp((*events)[j], line) != 0; j++)
+            ;
+        if (j < num_events)
+        {
+            fprintf(stderr, "[MyPapi] Warning: repeated event '%s'\n", line);
+            continue;
+        }
+        if (num_events == max_events)
+        {
+            max_events = (max_events == 0) ? 16 : 2 * max_events;
+            *events = (char **)my_realloc(*events,
+                                          sizeof(char *) * max_events);
+        }
+        (*events)[num_events++] = strdup(line);
     }
     fclose(fp);
-    /* ---------------------- END SECOND READ of file ---------------------- */
+    return (int)num_events;
+}
 
-    /* ---------------------------- CONFIG PAPI ---------------------------- */
-    my_PAPI_library_init(PAPI_VER_CURRENT);
-    for (i = 0; i < num_cpus; i++)
+// Ends the execution if the session passed is NULL
+static void my_check_session(my_session_t *session)
+{
+    if (session == NULL)
     {
-        event_sets[i] = PAPI_NULL;
-        my_PAPI_create_eventset(&event_sets[i]);
-        my_PAPI_assign_eventset_component(event_sets[i], cidx);
+        fprintf(stderr, "[MyPapi] Error: NULL session.\n");
+        exit(EXIT_FAILURE);
+    }
+}
 
-        // Force granularity to PAPI_GRN_SYS
-        opts.granularity.eventset = event_sets[i];
-        opts.granularity.granularity = PAPI_GRN_SYS;
-        my_PAPI_set_opt(PAPI_GRANUL, &opts);
+// Row of the matrix of values (or lap values) of the event set passed
+static long long *my_row(my_session_t *session, long long *matrix,
+                         int event_set_index)
+{
+    return &matrix[(size_t)event_set_index * session->num_events];
+}
+
+// Number of values of the results (one per event and cpu)
+static size_t my_values_size(my_session_t *session)
+{
+    return (size_t)session->num_cpus * session->num_events;
+}
+
+// Number of values stored in each record: the results, the times and label
+// of the region, if multiplexed, the raw count and times of each event and,
+// in thread_mode, the thread ids
+static size_t my_record_size(my_session_t *session)
+{
+    return my_values_size(session) + NUM_REGION_TIMES + 1 +
+           (session->multiplex_mode
+                ? NUM_MPX_VALUES * my_values_size(session)
+                : 0) +
+           (session->thread_mode ? session->num_cpus : 0);
+}
+
+// Id (in the kernel) of the calling thread
+static int my_get_thread_id()
+{
+    return (int)syscall(SYS_gettid);
+}
+
+// Lists the descriptors of the perf events open in this process in
+// ascending order. Returns how many there are
+static int my_list_perf_fds(int **fds)
+{
+    int i, fd, num_fds = 0;
+    char path[64], target[64];
+    ssize_t length;
+    DIR *dir;
+    struct dirent *entry;
 
-        // Attach event set to cpu i
-        opts.cpu.eventset = event_sets[i];
-        // If cpus == NULL then, order by num
-        if (cpus == NULL)
+    *fds = NULL;
+    dir = opendir("/proc/self/fd");
+    if (dir == NULL)
+    {
+        fprintf(stderr, "[MyPapi] Error: couldn't list the descriptors of "
+                        "the process.\n");
+        exit(EXIT_FAILURE);
+    }
+    while ((entry = readdir(dir)) != NULL)
+    {
+        if (entry->d_name[0] == '.')
         {
-            // The first "num_cpus" cpus to be attached
-            opts.cpu.cpu_num = i;
-            g_cpus[i] = i;
+            continue;
         }
-        else
+        fd = atoi(entry->d_name);
+        snprintf(path, sizeof(path), "/proc/self/fd/%d", fd);
+        length = readlink(path, target, sizeof(target) - 1);
+        if (length < 0)
         {
-            opts.cpu.cpu_num = cpus[i];
-            g_cpus[i] = cpus[i];
+            continue;
         }
-        my_PAPI_set_opt(PAPI_CPU_ATTACH, &opts);
-        // Adding events
-        for (j = 0; j < num_events; j++)
+        target[length] = '\0';
+        if (strcmp(target, "anon_inode:[perf_event]") != 0)
+        {
+            continue;
+        }
+        // Insertion in order, there are a few of them
+        *fds = (int *)my_realloc(*fds, sizeof(int) * (num_fds + 1));
+        for (i = num_fds; i > 0 && (*fds)[i - 1] > fd; i--)
         {
-            my_PAPI_add_named_event(event_sets[i], events[j]);
+            (*fds)[i] = (*fds)[i - 1];
         }
+        (*fds)[i] = fd;
+        num_fds++;
     }
-    /* -------------------------- END CONFIG PAPI -------------------------- */
+    closedir(dir);
+    return num_fds;
+}
 
-    // Storing the num of cpus
-    g_num_cpus = num_cpus;
-    num_event_sets = num_cpus;
+// Finds the perf events of the multiplexed event set of the row: the ones
+// open now that weren't before creating it. PAPI opens one per event (each
+// in its own group) in the order they were added, so they take increasing
+// descriptors
+static void my_find_multiplex_fds(my_session_t *session, int row,
+                                  const int *before, int num_before)
+{
+    int i, j = 0, k = 0, num_after, *after;
+    int *fds = &session->mpx_fds[(size_t)row * session->num_events];
 
-#ifdef DEBUGGING
-    /* ----------------------------- DEBUGGING ----------------------------- */
-    printf("[MyPapi] DEBUG: my_prepare_measure(input_file_name = '%s', ",
-           input_file_name);
-    printf("num_cpus = '%d', cpus = [", num_cpus);
-    if (cpus == NULL)
-    {
-        printf("NULL");
-    }
-    else
+    num_after = my_list_perf_fds(&after);
+    for (i = 0; i < num_after; i++)
     {
-        for (i = 0; i < num_cpus; i++)
+        while (j < num_before && before[j] < after[i])
         {
-            printf("'%d'", cpus[i]);
-            if (i != num_cpus - 1)
-            {
-                printf(", ");
-            }
+            j++;
         }
-    }
-    printf("])\n");
-
-    printf("[MyPapi] DEBUG: my_prepare_measure(): events = [");
-    for (i = 0; i < num_events; i++)
-    {
-        printf("'%s'", events[i]);
-        if (i != num_events - 1)
+        if (j < num_before && before[j] == after[i])
         {
-            printf(", ");
+            continue;
         }
-    }
-    printf("], num_events = '%zu'\n", num_events);
-
-    printf("[MyPapi] DEBUG: my_prepare_measure(): event_sets = [");
-    for (i = 0; i < MAX_CPUS; i++)
-    {
-        printf("'%d'", event_sets[i]);
-        if (i != MAX_CPUS - 1)
+        if (k < session->num_events)
         {
-            printf(", ");
+            fds[k] = after[i];
         }
+        k++;
     }
-    printf("]\n");
-    /* --------------------------- END DEBUGGING --------------------------- */
-#endif
-    return EXIT_SUCCESS;
-}
-
-int my_start_measure()
-{
-    int i;
-    /* -------------------------- Checking PARAMS -------------------------- */
-    if (num_event_sets == 0)
+    free(after);
+    if (k != session->num_events)
     {
-        fprintf(stderr, "[MyPapi] Error: no event set created.\n");
+        fprintf(stderr, "[MyPapi] Error: found %d perf events for the %d "
+                        "multiplexed events, their times enabled and running "
+                        "can't be read.\n",
+                k, session->num_events);
         exit(EXIT_FAILURE);
     }
-    /* ------------------------ END checking PARAMS ------------------------ */
+}
 
-    for (i = 0; i < num_event_sets; i++)
+// Reads the count and the times enabled and running (ns) of a perf event of
+// a multiplexed event set, in the order of enum multiplex_value
+static void my_read_perf_fd(int fd, long long *counts)
+{
+    // PAPI may also ask for the id of the event, after the times
+    long long buffer[NUM_MPX_VALUES + 1];
+    if (read(fd, buffer, sizeof(buffer)) <
+        (ssize_t)(sizeof(long long) * NUM_MPX_VALUES))
     {
-        my_PAPI_start(event_sets[i]);
+        fprintf(stderr, "[MyPapi] Error: couldn't read the perf event %d.\n",
+                fd);
+        exit(EXIT_FAILURE);
     }
-    return EXIT_SUCCESS;
+    memcpy(counts, buffer, sizeof(long long) * NUM_MPX_VALUES);
 }
 
-int my_stop_measure()
+// Creates the event set of the row with the events of the session. If
+// cpu >= 0, it counts everything that runs on that cpu. Otherwise, if
+// tid > 0, it counts that thread and the ones it creates from now on
+// (inherit). If not, it counts the calling thread
+static void my_create_event_set(my_session_t *session, int row, int cpu,
+                                int tid)
 {
-    int i;
-    /* -------------------------- Checking PARAMS -------------------------- */
-    if (num_event_sets == 0)
+    int j, num_before = 0, *before = NULL;
+    int *event_set = &session->event_sets[row];
+    const int cidx = 0;
+    PAPI_option_t opts;
+
+    if (session->multiplex_mode)
     {
-        fprintf(stderr, "[MyPapi] Error: no event set to stop.\n");
-        exit(EXIT_FAILURE);
+        pthread_mutex_lock(&perf_fds_lock);
+        num_before = my_list_perf_fds(&before);
     }
-    /* ------------------------ END checking PARAMS ------------------------ */
 
-    for (i = 0; i < num_event_sets; i++)
+    *event_set = PAPI_NULL;
+    my_PAPI_create_eventset(event_set);
+    my_PAPI_assign_eventset_component(*event_set, cidx);
+
+    // The event set must be multiplexed before adding the events
+    if (session->multiplex_mode)
     {
-        my_PAPI_stop(event_sets[i], values[i]);
+        my_PAPI_set_multiplex(*event_set);
     }
-    return EXIT_SUCCESS;
-}
 
-int my_print_measure(char *output_file_name)
-{
-    int i, j;
-    FILE *fp;
-    long long val;
-    setlocale(LC_NUMERIC, "");
-    bool print_as_csv = false;
+    if (cpu >= 0)
+    {
+        // Force granularity to PAPI_GRN_SYS
+        opts.granularity.eventset = *event_set;
+        opts.granularity.granularity = PAPI_GRN_SYS;
+        my_PAPI_set_opt(PAPI_GRANUL, &opts);
 
-// #ifdef DEBUGGING
-//     /* ----------------------------- DEBUGGING ----------------------------- */
-//     printf("[MyPapi] DEBUG: my_print_measure(output_file_name = '%s')\n",
-//            output_file_name);
-//     /* --------------------------- END DEBUGGING --------------------------- */
-// #endif
+        // Attach event set to the cpu
+        opts.cpu.eventset = *event_set;
+        opts.cpu.cpu_num = cpu;
+        my_PAPI_set_opt(PAPI_CPU_ATTACH, &opts);
+    }
+    else if (tid > 0)
+    {
+        // The children are counted along with the thread
+        opts.inherit.eventset = *event_set;
+        opts.inherit.inherit = PAPI_INHERIT_ALL;
+        my_PAPI_set_opt(PAPI_INHERIT, &opts);
+        my_PAPI_attach(*event_set, tid);
+    }
 
-    if (output_file_name == NULL)
+    // The first event set validates the events, one by one to know which
+    // one fails. The rest are the same, so they are added in a single call
+    if (session->events_checked)
     {
-        fp = stdout;
+        my_PAPI_add_events(*event_set, session->event_codes,
+                           session->num_events);
     }
     else
     {
-        print_as_csv = true;
-        fp = fopen(output_file_name, "a+");
-        if (fp == NULL)
+        for (j = 0; j < session->num_events; j++)
         {
-            fprintf(stderr, "[MyPapi] Error: couldn't open file '%s'\n",
-                    output_file_name);
-            exit(EXIT_FAILURE);
+            if ((retval = PAPI_add_event(*event_set,
+                                         session->event_codes[j])) != PAPI_OK)
+            {
+                fprintf(stderr, "[MyPapi] Error: couldn't add event '%s', it "
+                                "isn't available or doesn't fit with the "
+                                "previous ones\n",
+                        session->events[j]);
+                ERROR_RETURN(retval);
+            }
         }
+        session->events_checked = true;
     }
 
-    if (print_as_csv)
+    if (session->multiplex_mode)
     {
-        // Separator
-        char sep = ':';
-        for (i = 0; i < num_event_sets; i++)
-        {
-            for (j = 0; j < num_events; j++)
+        my_find_multiplex_fds(session, row, before, num_before);
+        pthread_mutex_unlock(&perf_fds_lock);
+        free(before);
+    }
+}
+
+// If multiplexed, the counts and times of the perf events of the row now
+// are the base of the next stop, read and lap (after a start or a reset)
+static void my_begin_multiplex(my_session_t *session, int row)
+{
+    int j;
+    size_t k;
+
+    if (!session->multiplex_mode)
+    {
+        return;
+    }
+    for (j = 0; j < session->num_events; j++)
+    {
+        k = ((size_t)row * session->num_events + j) * NUM_MPX_VALUES;
+        my_read_perf_fd(session->mpx_fds[k / NUM_MPX_VALUES],
+                        &session->mpx_begin[k]);
+        memcpy(&session->mpx_lap[k], &session->mpx_begin[k],
+               sizeof(long long) * NUM_MPX_VALUES);
+    }
+}
+
+// If multiplexed, stores the raw count and the times enabled and running of
+// the events of the row since the start (or the previous lap) and scales
+// its values with them (PAPI scales them with the times since the events
+// were opened)
+static void my_read_multiplex(my_session_t *session, int row, bool lap)
+{
+    int j, m;
+    size_t k;
+    long long now[NUM_MPX_VALUES], *begin, *mpx;
+    long long *values = my_row(session, session->values, row);
+
+    if (!session->multiplex_mode)
+    {
+        return;
+    }
+    for (j = 0; j < session->num_events; j++)
+    {
+        k = ((size_t)row * session->num_events + j) * NUM_MPX_VALUES;
+        my_read_perf_fd(session->mpx_fds[k / NUM_MPX_VALUES], now);
+        begin = lap ? &session->mpx_lap[k] : &session->mpx_begin[k];
+        mpx = &session->mpx_values[k];
+        for (m = 0; m < NUM_MPX_VALUES; m++)
+        {
+            mpx[m] = now[m] - begin[m];
+            if (lap)
             {
-                val = values[i][j];
-                // if (val != 0)
-                // {
-                    fprintf(fp, "%d%c%lld%c%c%s\n", g_cpus[i], sep, val, sep,
-                            sep, events[j]);
-                // }
+                begin[m] = now[m];
             }
         }
+        // An event that was never in a counter wasn't counted
+        values[j] = (mpx[MPX_TIME_RUNNING] > 0)
+                        ? (long long)((double)mpx[MPX_RAW] *
+                                      mpx[MPX_TIME_ENABLED] /
+                                      mpx[MPX_TIME_RUNNING])
+                        : 0;
     }
-    else
+}
+
+// Copies the values and the times (of the region) to the live file, if
+// any. The sequence is odd while they are copied, so the readers never use a
+// mix of two snapshots
+static void my_publish(my_session_t *session, const long long *values,
+                       const long long *times)
+{
+    int i;
+    struct my_live *live;
+
+    pthread_mutex_lock(&session->live_lock);
+    live = session->live;
+    if (live != NULL)
+    {
+        atomic_fetch_add_explicit(&live->seq, 1, memory_order_relaxed);
+        atomic_thread_fence(memory_order_release);
+        memcpy(live->times, times, sizeof(long long) * NUM_REGION_TIMES);
+        for (i = 0; i < session->num_cpus; i++)
+        {
+            live->data[i] = session->cpus[i];
+        }
+        memcpy(&live->data[session->num_cpus], values,
+               sizeof(long long) * my_values_size(session));
+        atomic_fetch_add_explicit(&live->seq, 1, memory_order_release);
+    }
+    pthread_mutex_unlock(&session->live_lock);
+}
+
+// Unmaps the live file, which keeps the last values published
+static void my_unpublish(my_session_t *session)
+{
+    pthread_mutex_lock(&session->live_lock);
+    if (session->live != NULL)
+    {
+        munmap(session->live, session->live_size);
+        session->live = NULL;
+        session->live_size = 0;
+    }
+    pthread_mutex_unlock(&session->live_lock);
+}
+
+// Stops adding up the rows in groups
+static void my_free_groups(my_session_t *session)
+{
+    free(session->row_groups);
+    free(session->group_ids);
+    free(session->group_values);
+    free(session->group_mpx);
+    session->row_groups = NULL;
+    session->group_ids = NULL;
+    session->group_values = NULL;
+    session->group_mpx = NULL;
+    session->num_groups = 0;
+}
+
+// Releases the stack of regions and their totals
+static void my_free_regions(my_session_t *session)
+{
+    free(session->region_stack);
+    free(session->region_frames);
+    free(session->region_totals);
+    session->region_stack = NULL;
+    session->region_frames = NULL;
+    session->region_totals = NULL;
+    session->region_depth = 0;
+    session->max_region_depth = 0;
+    session->num_region_ids = 0;
+}
+
+// Stops (if needed) and destroys the event sets of the session and releases
+// the memory used by the events, cpus and results
+static void my_free_config(my_session_t *session)
+{
+    int i;
+    my_session_stop_sampler(session);
+    free(session->samples);
+    session->samples = NULL;
+    if (session->running)
+    {
+        my_session_stop(session);
+    }
+    // The layout of the live file and the groups depend on the config
+    my_unpublish(session);
+    my_free_groups(session);
+    my_free_regions(session);
+    if (my_PAPI_is_initialized() != PAPI_NOT_INITED)
+    {
+        for (i = 0; i < session->num_event_sets; i++)
+        {
+            my_PAPI_cleanup_eventset(session->event_sets[i]);
+            my_PAPI_destroy_eventset(&session->event_sets[i]);
+        }
+    }
+    for (i = 0; i < session->num_events; i++)
+    {
+        free(session->events[i]);
+    }
+    free(session->events);
+    free(session->event_codes);
+    free(session->event_sets);
+    free(session->cpus);
+    free(session->values);
+    free(session->lap_values);
+    for (i = 0; i < NUM_OVERHEADS; i++)
+    {
+        free(session->overhead[i]);
+        free(session->noise_floor[i]);
+        session->overhead[i] = session->noise_floor[i] = NULL;
+    }
+    free(session->noisy);
+    free(session->snapshot);
+    free(session->workers);
+    free(session->worker_args);
+    free(session->op_times);
+    free(session->mpx_fds);
+    free(session->mpx_begin);
+    free(session->mpx_lap);
+    free(session->mpx_values);
+    session->events = NULL;
+    session->event_codes = NULL;
+    session->event_sets = NULL;
+    session->cpus = NULL;
+    session->values = NULL;
+    session->lap_values = NULL;
+    session->noisy = NULL;
+    session->snapshot = NULL;
+    session->workers = NULL;
+    session->worker_args = NULL;
+    session->op_times = NULL;
+    session->mpx_fds = NULL;
+    session->mpx_begin = NULL;
+    session->mpx_lap = NULL;
+    session->mpx_values = NULL;
+    session->num_events = 0;
+    session->num_event_sets = 0;
+    session->num_cpus = 0;
+    session->thread_mode = false;
+}
+
+// Time (ns) between the first and the last operation on the event sets
+static long long my_get_skew(my_session_t *session)
+{
+    int i;
+    long long first = session->op_times[0], last = session->op_times[0];
+    for (i = 1; i < session->num_event_sets; i++)
+    {
+        if (session->op_times[i] < first)
+            first = session->op_times[i];
+        if (session->op_times[i] > last)
+            last = session->op_times[i];
+    }
+    return last - first;
+}
+
+// Loop of each worker: wait to be released and start/stop its event set
+static void *my_worker(void *arg)
+{
+    my_session_t *session = ((struct my_worker_arg *)arg)->session;
+    int i = ((struct my_worker_arg *)arg)->index;
+    while (true)
+    {
+        pthread_barrier_wait(&session->workers_go);
+        if (session->worker_op == WORKER_EXIT)
+        {
+            break;
+        }
+        if (session->worker_op == WORKER_START)
+        {
+            my_PAPI_start(session->event_sets[i]);
+        }
+        else
+        {
+            my_PAPI_stop(session->event_sets[i],
+                         my_row(session, session->values, i));
+        }
+        session->op_times[i] = PAPI_get_real_nsec();
+        pthread_barrier_wait(&session->workers_done);
+    }
+    return NULL;
+}
+
+// Releases the workers to perform the operation and waits for all of them
+static void my_run_workers(my_session_t *session, enum worker_op op)
+{
+    session->worker_op = op;
+    pthread_barrier_wait(&session->workers_go);
+    if (op != WORKER_EXIT)
+    {
+        pthread_barrier_wait(&session->workers_done);
+    }
+}
+
+// Subtracts the overhead of the kind of operation from the values (they
+// can't be negative) and marks the events whose total (all the rows) is
+// within the noise floor. Returns the number of them
+static int my_subtract_overhead(my_session_t *session,
+                                enum overhead_kind kind)
+{
+    int i, j, num_noisy = 0;
+    long long total, *value;
+    long long *overhead = session->overhead[kind];
+
+    if (overhead == NULL)
+    {
+        memset(session->noisy, 0, sizeof(int) * session->num_events);
+        return 0;
+    }
+    for (j = 0; j < session->num_events; j++)
+    {
+        total = 0;
+        for (i = 0; i < session->num_cpus; i++)
+        {
+            value = &my_row(session, session->values, i)[j];
+            *value = (*value > my_row(session, overhead, i)[j])
+                         ? *value - my_row(session, overhead, i)[j]
+                         : 0;
+            total += *value;
+        }
+        session->noisy[j] = total < session->noise_floor[kind][j];
+        num_noisy += session->noisy[j];
+    }
+    return num_noisy;
+}
+
+// In thread_mode, reads the rows of the registered threads that are still
+// alive (each one counts with its own event set). On a lap, the values are
+// the deltas since the previous read
+static void my_read_threads(my_session_t *session, bool lap)
+{
+    int i, j;
+    long long total, *row, *previous;
+    pthread_mutex_lock(&session->threads_lock);
+    for (i = 1; i < session->num_cpus; i++)
     {
-        bool print_cpu, print_header;
-        for (i = 0; i < g_num_cpus; i++)
+        if (session->event_sets[i] == PAPI_NULL)
+        {
+            continue;
+        }
+        row = my_row(session, session->values, i);
+        my_PAPI_read(session->event_sets[i], row);
+        if (lap)
         {
-            print_cpu = false;
-            print_header = false;
-            for (j = 0; j < num_events; j++)
+            previous = my_row(session, session->lap_values, i);
+            for (j = 0; j < session->num_events; j++)
             {
-                val = values[i][j];
-                // if (val != 0)
-                // {
-                    print_cpu = true;
-                    if (print_cpu && !print_header)
-                    {
-                        print_header = true;
-                        fprintf(fp, "%s\n", "+-----+------------------------------"
-                                            "-------------+-----------------+");
-                        fprintf(fp, "| %s | %-42s| %-16s|\n", "CPU", "Event",
-                                "Value");
-                        fprintf(fp, "%s\n", "+=====+=============================="
-                                            "=============+=================+");
-                    }
-                    fprintf(fp, "|  %02d | %-42s| %'-16lld|\n", g_cpus[i],
-                            events[j], val);
-                // }
+                total = row[j];
+                row[j] -= previous[j];
+                previous[j] = total;
             }
-            if (print_cpu)
+        }
+        my_read_multiplex(session, i, lap);
+    }
+    pthread_mutex_unlock(&session->threads_lock);
+}
+
+// In thread_mode, sets to zero the counters of the registered threads that
+// are still alive, so they begin with the measure
+static void my_reset_threads(my_session_t *session)
+{
+    int i;
+    pthread_mutex_lock(&session->threads_lock);
+    for (i = 1; i < session->num_cpus; i++)
+    {
+        if (session->event_sets[i] != PAPI_NULL)
+        {
+            my_PAPI_reset(session->event_sets[i]);
+            my_begin_multiplex(session, i);
+        }
+    }
+    pthread_mutex_unlock(&session->threads_lock);
+}
+
+// Frame of the region entered at the depth passed: the real time (ns) when
+// it began and of the nested regions, the values when it began and the
+// values of the nested regions
+static long long *my_region_frame(my_session_t *session, int depth)
+{
+    return &session->region_frames[(size_t)depth *
+                                   (2 + 2 * my_values_size(session))];
+}
+
+// Totals of the region id passed: the number of exits, the real time (ns)
+// inclusive and exclusive and the values inclusive and exclusive
+static long long *my_region_totals(my_session_t *session, int region)
+{
+    return &session->region_totals[(size_t)region *
+                                   (3 + 2 * my_values_size(session))];
+}
+
+// Number of values of each sample: the timestamp and the results
+static size_t my_sample_size(my_session_t *session)
+{
+    return 1 + my_values_size(session);
+}
+
+// Loop of the sampler: read all the event sets on each interval and store
+// them in the ring buffer without locks (there is just one writer)
+static void *my_sampler(void *arg)
+{
+    int i;
+    my_session_t *session = (my_session_t *)arg;
+    size_t head, tail;
+    long long *sample, times[NUM_REGION_TIMES];
+    struct timespec next;
+
+    clock_gettime(CLOCK_MONOTONIC, &next);
+    while (atomic_load(&session->sampler_running))
+    {
+        head = atomic_load_explicit(&session->samples_head,
+                                    memory_order_relaxed);
+        tail = atomic_load_explicit(&session->samples_tail,
+                                    memory_order_acquire);
+        if (head - tail == session->max_samples)
+        {
+            // Full: the reader is too slow, keep the oldest samples
+            atomic_fetch_add(&session->samples_dropped, 1);
+        }
+        else
+        {
+            sample = &session->samples[(head % session->max_samples) *
+                                       my_sample_size(session)];
+            pthread_mutex_lock(&session->sampler_lock);
+            sample[0] = PAPI_get_real_nsec();
+            for (i = 0; i < session->num_event_sets; i++)
             {
-                fprintf(fp, "%s\n", "+-----+--------------------------------------"
-                                    "-----+-----------------+");
+                my_PAPI_read(session->event_sets[i],
+                             &sample[1 + (size_t)i * session->num_events]);
             }
+            // A lap or a reset may move the beginning of the region
+            times[REAL_BEGIN] = session->times[REAL_BEGIN];
+            times[VIRT_BEGIN] = session->times[VIRT_BEGIN];
+            pthread_mutex_unlock(&session->sampler_lock);
+            times[REAL_END] = sample[0];
+            times[VIRT_END] = PAPI_get_virt_nsec();
+            // Publish the sample once it's complete
+            atomic_store_explicit(&session->samples_head, head + 1,
+                                  memory_order_release);
+            my_publish(session, &sample[1], times);
         }
+
+        // Sleep until the next deadline, so the interval doesn't drift
+        next.tv_nsec += session->sampler_interval;
+        while (next.tv_nsec >= 1000000000L)
+        {
+            next.tv_nsec -= 1000000000L;
+            next.tv_sec++;
+        }
+        clock_nanosleep(CLOCK_MONOTONIC, TIMER_ABSTIME, &next, NULL);
     }
+    return NULL;
+}
 
-    if (output_file_name != NULL)
+// Returns the index of the output file, adding it if it's a new one
+static int my_get_output_file_index(my_session_t *session,
+                                    const char *output_file_name)
+{
+    int i;
+    for (i = 0; i < session->num_output_files; i++)
     {
-        fclose(fp);
+        if (strcmp(session->output_files[i], output_file_name) == 0)
+        {
+            return i;
+        }
     }
-    // else
-    // {
-    //     fflush(fp);
-    // }
-    return EXIT_SUCCESS;
+    session->output_files = (char **)my_realloc(
+        session->output_files, sizeof(char *) * (session->num_output_files + 1));
+    session->output_files[session->num_output_files] = strdup(output_file_name);
+    return session->num_output_files++;
 }
 
-int my_finalize_measure()
+// Appends the current values to the buffer of records
+static void my_buffer_record(my_session_t *session,
+                             const char *output_file_name)
 {
-    // Stops the PAPI lib
-    my_PAPI_shutdown();
-    // ! Frees memory (?)
-    for (size_t i = 0; i < num_events; i++)
+    int i;
+    size_t record_size = my_record_size(session);
+    long long *record;
+
+    // Grow the buffer (doubling it) when there is no space left
+    if (session->num_records == session->max_records)
     {
-        free(events[i]);
+        session->max_records = (session->max_records == 0)
+                                   ? INITIAL_NUM_RECORDS
+                                   : 2 * session->max_records;
+        session->records = (long long *)my_realloc(
+            session->records,
+            sizeof(long long) * record_size * session->max_records);
+        session->record_files = (int *)my_realloc(
+            session->record_files, sizeof(int) * session->max_records);
     }
-    return EXIT_SUCCESS;
+
+    // The values of all the cpus are contiguous, so it's a single copy
+    record = &session->records[session->num_records * record_size];
+    if (session->thread_mode)
+    {
+        pthread_mutex_lock(&session->threads_lock);
+    }
+    memcpy(record, session->values,
+           sizeof(long long) * my_values_size(session));
+    record += my_values_size(session);
+    memcpy(record, session->times, sizeof(session->times));
+    record += NUM_REGION_TIMES;
+    *record++ = session->label;
+    if (session->multiplex_mode)
+    {
+        memcpy(record, session->mpx_values,
+               sizeof(long long) * NUM_MPX_VALUES * my_values_size(session));
+        record += NUM_MPX_VALUES * my_values_size(session);
+    }
+    if (session->thread_mode)
+    {
+        // The threads change from one measure to another
+        for (i = 0; i < session->num_cpus; i++)
+        {
+            record[i] = session->cpus[i];
+        }
+        pthread_mutex_unlock(&session->threads_lock);
+    }
+    session->record_files[session->num_records++] =
+        my_get_output_file_index(session, output_file_name);
+
+    // Write them to disk when the threshold is reached
+    if (session->num_records * record_size * sizeof(long long) >=
+        FLUSH_THRESHOLD_BYTES)
+    {
+        my_session_flush(session);
+    }
+}
+
+// Writes the values of a row (cpu, thread or group of them) of a record. If
+// multiplexed, mpx has the raw count and times of each event of the row,
+// otherwise NULL
+static void my_write_row(FILE *fp, my_session_t *session, int id,
+                         const long long *values, const long long *region,
+                         const long long *mpx)
+{
+    int j;
+    // Separator
+    char sep = ':';
+
+    for (j = 0; j < session->num_events; j++)
+    {
+        fprintf(fp, "%d%c%lld%c%c%s\n", id, sep, values[j], sep, sep,
+                session->events[j]);
+    }
+    // Times (and label) of the region, so the values can be used as rates
+    fprintf(fp, "%d%c%lld%cns%c%s\n", id, sep, region[REAL_BEGIN], sep, sep,
+            "REAL_TIME_BEGIN");
+    fprintf(fp, "%d%c%lld%cns%c%s\n", id, sep, region[REAL_END], sep, sep,
+            "REAL_TIME_END");
+    fprintf(fp, "%d%c%lld%cns%c%s\n", id, sep, region[VIRT_BEGIN], sep, sep,
+            "VIRT_TIME_BEGIN");
+    fprintf(fp, "%d%c%lld%cns%c%s\n", id, sep, region[VIRT_END], sep, sep,
+            "VIRT_TIME_END");
+    if (region[NUM_REGION_TIMES] >= 0)
+    {
+        fprintf(fp, "%d%c%lld%clabel%c%s\n", id, sep, region[NUM_REGION_TIMES],
+                sep, sep, "REGION_LABEL");
+    }
+    // The values above are the estimates scaled with these
+    for (j = 0; mpx != NULL && j < session->num_events; j++)
+    {
+        fprintf(fp, "%d%c%lld%craw%c%s (raw)\n", id, sep,
+                mpx[j * NUM_MPX_VALUES + MPX_RAW], sep, sep,
+                session->events[j]);
+        fprintf(fp, "%d%c%lld%cns%c%s (time enabled)\n", id, sep,
+                mpx[j * NUM_MPX_VALUES + MPX_TIME_ENABLED], sep, sep,
+                session->events[j]);
+        fprintf(fp, "%d%c%lld%cns%c%s (time running)\n", id, sep,
+                mpx[j * NUM_MPX_VALUES + MPX_TIME_RUNNING], sep, sep,
+                session->events[j]);
+    }
+}
+
+// Adds up the values (and multiplexed values) of the rows of each group
+static void my_add_up_groups(my_session_t *session, const long long *values,
+                             const long long *mpx)
+{
+    int g, i, j;
+    size_t size = NUM_MPX_VALUES * session->num_events;
+
+    memset(session->group_values, 0,
+           sizeof(long long) * session->num_groups * session->num_events);
+    memset(session->group_mpx, 0,
+           sizeof(long long) * session->num_groups * size);
+    for (i = 0; i < session->num_cpus; i++)
+    {
+        g = session->row_groups[i];
+        for (j = 0; j < session->num_events; j++)
+        {
+            session->group_values[g * session->num_events + j] +=
+                values[i * session->num_events + j];
+        }
+        for (j = 0; mpx != NULL && j < (int)size; j++)
+        {
+            session->group_mpx[g * size + j] += mpx[i * size + j];
+        }
+    }
+}
+
+// Releases the memory used by the buffer of records
+static void my_free_records(my_session_t *session)
+{
+    int i;
+    for (i = 0; i < session->num_output_files; i++)
+    {
+        free(session->output_files[i]);
+    }
+    free(session->output_files);
+    free(session->records);
+    free(session->record_files);
+    session->output_files = NULL;
+    session->records = NULL;
+    session->record_files = NULL;
+    session->num_output_files = 0;
+    session->num_records = 0;
+    session->max_records = 0;
+}
+
+// ----------------------------------------------------------------------------
+// Sessions
+// ----------------------------------------------------------------------------
+my_session_t *my_session_create()
+{
+    my_session_t *session = (my_session_t *)my_calloc(1, sizeof(my_session_t));
+    session->label = -1;
+    pthread_mutex_init(&session->threads_lock, NULL);
+    pthread_mutex_init(&session->live_lock, NULL);
+    pthread_mutex_init(&session->sampler_lock, NULL);
+    num_sessions++;
+    return session;
+}
+
+// Releases the previous configuration of the session, reads the events of the
+// file and allocates the results for num_rows cpus (or threads)
+static void my_prepare_config(my_session_t *session, FILE *fp, int num_rows)
+{
+    int i;
+
+    // The buffered records, workers and event sets belong to the previous
+    // configuration
+    my_session_flush(session);
+    my_free_records(session);
+    my_session_set_parallel(session, false);
+    my_free_config(session);
+    session->multiplex_mode = session->multiplex_requested;
+
+    session->num_events = my_read_events(fp, &session->events);
+
+    /* ---------------------------- ALLOCATION ----------------------------- */
+    // The results of all the cpus are stored in a single block
+    session->event_sets = (int *)my_calloc(num_rows, sizeof(int));
+    session->cpus = (int *)my_calloc(num_rows, sizeof(int));
+    session->values = (long long *)my_calloc(
+        (size_t)num_rows * session->num_events, sizeof(long long));
+    session->lap_values = (long long *)my_calloc(
+        (size_t)num_rows * session->num_events, sizeof(long long));
+    session->noisy = (int *)my_calloc(session->num_events, sizeof(int));
+    session->snapshot = (long long *)my_calloc(session->num_events,
+                                               sizeof(long long));
+    session->workers = (pthread_t *)my_calloc(num_rows, sizeof(pthread_t));
+    session->worker_args = (struct my_worker_arg *)my_calloc(
+        num_rows, sizeof(struct my_worker_arg));
+    session->op_times = (long long *)my_calloc(num_rows, sizeof(long long));
+    if (session->multiplex_mode)
+    {
+        session->mpx_fds = (int *)my_calloc(
+            (size_t)num_rows * session->num_events, sizeof(int));
+        session->mpx_begin = (long long *)my_calloc(
+            (size_t)num_rows * session->num_events * NUM_MPX_VALUES,
+            sizeof(long long));
+        session->mpx_lap = (long long *)my_calloc(
+            (size_t)num_rows * session->num_events * NUM_MPX_VALUES,
+            sizeof(long long));
+        session->mpx_values = (long long *)my_calloc(
+            (size_t)num_rows * session->num_events * NUM_MPX_VALUES,
+            sizeof(long long));
+    }
+    for (i = 0; i < num_rows; i++)
+    {
+        session->event_sets[i] = PAPI_NULL;
+    }
+    /* -------------------------- END ALLOCATION --------------------------- */
+
+    my_PAPI_library_init(PAPI_VER_CURRENT);
+
+    // The names are looked up once, all the event sets use the codes
+    session->event_codes = (int *)my_calloc(session->num_events, sizeof(int));
+    for (i = 0; i < session->num_events; i++)
+    {
+        my_PAPI_event_name_to_code(session->events[i],
+                                   &session->event_codes[i]);
+    }
+    session->events_checked = false;
+
+    if (session->multiplex_mode)
+    {
+        if (!multiplex_initialized)
+        {
+            my_PAPI_multiplex_init();
+            multiplex_initialized = true;
+        }
+    }
+}
+
+int my_session_prepare(my_session_t *session, char *input_file_name,
+                       int num_cpus, int *cpus)
+{
+    int i;
+    FILE *fp;
+
+    /* -------------------------- Checking PARAMS -------------------------- */
+    my_check_session(session);
+    if (num_cpus < 1)
+    {
+        fprintf(stderr, "[MyPapi] Error: wrong number of cpus '%d'\n",
+                num_cpus);
+        exit(EXIT_FAILURE);
+    }
+    fp = fopen(input_file_name, "r");
+    if (fp == NULL)
+    {
+        fprintf(stderr, "[MyPapi] Error: couldn't open file '%s'\n",
+                input_file_name);
+        exit(EXIT_FAILURE);
+    }
+    /* ------------------------ END checking PARAMS ------------------------ */
+
+    my_prepare_config(session, fp, num_cpus);
+
+    /* ---------------------------- CONFIG PAPI ---------------------------- */
+    for (i = 0; i < num_cpus; i++)
+    {
+        // If cpus == NULL then, the first "num_cpus" cpus are attached
+        session->cpus[i] = (cpus == NULL) ? i : cpus[i];
+        my_create_event_set(session, i, session->cpus[i], 0);
+    }
+    /* -------------------------- END CONFIG PAPI -------------------------- */
+
+    // Storing the num of cpus
+    session->num_cpus = num_cpus;
+    session->num_event_sets = num_cpus;
+
+#ifdef DEBUGGING
+    /* ----------------------------- DEBUGGING ----------------------------- */
+    printf("[MyPapi] DEBUG: my_session_prepare(input_file_name = '%s', ",
+           input_file_name);
+    printf("num_cpus = '%d', cpus = [", num_cpus);
+    if (cpus == NULL)
+    {
+        printf("NULL");
+    }
+    else
+    {
+        for (i = 0; i < num_cpus; i++)
+        {
+            printf("'%d'", cpus[i]);
+            if (i != num_cpus - 1)
+            {
+                printf(", ");
+            }
+        }
+    }
+    printf("])\n");
+
+    printf("[MyPapi] DEBUG: my_session_prepare(): events = [");
+    for (i = 0; i < session->num_events; i++)
+    {
+        printf("'%s'", session->events[i]);
+        if (i != session->num_events - 1)
+        {
+            printf(", ");
+        }
+    }
+    printf("], num_events = '%d'\n", session->num_events);
+
+    printf("[MyPapi] DEBUG: my_session_prepare(): event_sets = [");
+    for (i = 0; i < session->num_event_sets; i++)
+    {
+        printf("'%d'", session->event_sets[i]);
+        if (i != session->num_event_sets - 1)
+        {
+            printf(", ");
+        }
+    }
+    printf("]\n");
+    /* --------------------------- END DEBUGGING --------------------------- */
+#endif
+    return EXIT_SUCCESS;
+}
+
+int my_session_prepare_threads(my_session_t *session, char *input_file_name,
+                               int max_threads)
+{
+    FILE *fp;
+
+    /* -------------------------- Checking PARAMS -------------------------- */
+    my_check_session(session);
+    if (max_threads < 1)
+    {
+        fprintf(stderr, "[MyPapi] Error: wrong number of threads '%d'\n",
+                max_threads);
+        exit(EXIT_FAILURE);
+    }
+    fp = fopen(input_file_name, "r");
+    if (fp == NULL)
+    {
+        fprintf(stderr, "[MyPapi] Error: couldn't open file '%s'\n",
+                input_file_name);
+        exit(EXIT_FAILURE);
+    }
+    /* ------------------------ END checking PARAMS ------------------------ */
+
+    my_prepare_config(session, fp, max_threads);
+
+    // The first row is the thread that prepares the session, the rest are
+    // taken by the threads when they register
+    session->thread_mode = true;
+    session->cpus[0] = my_get_thread_id();
+    my_create_event_set(session, 0, -1, 0);
+    session->num_cpus = max_threads;
+    session->num_event_sets = 1;
+    return EXIT_SUCCESS;
+}
+
+int my_session_prepare_attach(my_session_t *session, char *input_file_name,
+                              int pid)
+{
+    int i, num_tids = 0, *tids = NULL;
+    char path[64];
+    FILE *fp;
+    DIR *dir;
+    struct dirent *entry;
+
+    /* -------------------------- Checking PARAMS -------------------------- */
+    my_check_session(session);
+    snprintf(path, sizeof(path), "/proc/%d/task", pid);
+    dir = (pid > 0) ? opendir(path) : NULL;
+    if (dir == NULL)
+    {
+        fprintf(stderr, "[MyPapi] Error: couldn't find the process '%d'\n",
+                pid);
+        exit(EXIT_FAILURE);
+    }
+    fp = fopen(input_file_name, "r");
+    if (fp == NULL)
+    {
+        fprintf(stderr, "[MyPapi] Error: couldn't open file '%s'\n",
+                input_file_name);
+        exit(EXIT_FAILURE);
+    }
+    /* ------------------------ END checking PARAMS ------------------------ */
+
+    // Threads already running. The ones created later are inherited by the
+    // thread that creates them
+    while ((entry = readdir(dir)) != NULL)
+    {
+        if (entry->d_name[0] == '.')
+        {
+            continue;
+        }
+        tids = (int *)my_realloc(tids, sizeof(int) * (num_tids + 1));
+        tids[num_tids++] = atoi(entry->d_name);
+    }
+    closedir(dir);
+
+    my_prepare_config(session, fp, num_tids);
+
+    /* ---------------------------- CONFIG PAPI ---------------------------- */
+    for (i = 0; i < num_tids; i++)
+    {
+        session->cpus[i] = tids[i];
+        my_create_event_set(session, i, -1, tids[i]);
+    }
+    /* -------------------------- END CONFIG PAPI -------------------------- */
+    free(tids);
+
+    session->num_cpus = num_tids;
+    session->num_event_sets = num_tids;
+    return EXIT_SUCCESS;
+}
+
+int my_session_register_thread(my_session_t *session)
+{
+    int i, tid;
+    /* -------------------------- Checking PARAMS -------------------------- */
+    my_check_session(session);
+    if (!session->thread_mode)
+    {
+        fprintf(stderr, "[MyPapi] Error: the session doesn't count "
+                        "threads.\n");
+        exit(EXIT_FAILURE);
+    }
+    /* ------------------------ END checking PARAMS ------------------------ */
+
+    tid = my_get_thread_id();
+    pthread_mutex_lock(&session->threads_lock);
+    // First free row (the ones of finished threads are kept until the start)
+    for (i = 1; i < session->num_cpus && session->cpus[i] != 0; i++)
+        ;
+    if (i == session->num_cpus)
+    {
+        pthread_mutex_unlock(&session->threads_lock);
+        fprintf(stderr, "[MyPapi] Warning: no row left for thread '%d'\n",
+                tid);
+        return -1;
+    }
+    session->cpus[i] = tid;
+
+    // Each thread creates and starts its own event set. The row is taken
+    // once it is counting, so the stop and the reads can use it
+    my_PAPI_register_thread();
+    my_create_event_set(session, i, -1, 0);
+    my_PAPI_start(session->event_sets[i]);
+    my_begin_multiplex(session, i);
+    pthread_mutex_unlock(&session->threads_lock);
+    return i;
+}
+
+int my_session_unregister_thread(my_session_t *session)
+{
+    int i, event_set, tid;
+    my_check_session(session);
+
+    if (!session->thread_mode)
+    {
+        return -1;
+    }
+    tid = my_get_thread_id();
+    pthread_mutex_lock(&session->threads_lock);
+    for (i = 1; i < session->num_cpus; i++)
+    {
+        if (session->cpus[i] == tid && session->event_sets[i] != PAPI_NULL)
+        {
+            break;
+        }
+    }
+    if (i == session->num_cpus)
+    {
+        // The thread wasn't registered (e.g. there was no row left)
+        pthread_mutex_unlock(&session->threads_lock);
+        return -1;
+    }
+
+    // The values are kept in its row until the next start
+    event_set = session->event_sets[i];
+    my_PAPI_stop(event_set, my_row(session, session->values, i));
+    my_read_multiplex(session, i, false);
+    session->event_sets[i] = PAPI_NULL;
+    pthread_mutex_unlock(&session->threads_lock);
+
+    my_PAPI_cleanup_eventset(event_set);
+    my_PAPI_destroy_eventset(&event_set);
+    my_PAPI_unregister_thread();
+    return i;
+}
+
+int my_session_start(my_session_t *session)
+{
+    int i;
+    /* -------------------------- Checking PARAMS -------------------------- */
+    my_check_session(session);
+    if (session->num_event_sets == 0)
+    {
+        fprintf(stderr, "[MyPapi] Error: no event set created.\n");
+        exit(EXIT_FAILURE);
+    }
+    /* ------------------------ END checking PARAMS ------------------------ */
+
+    if (session->thread_mode)
+    {
+        // The rows of the threads finished in previous measures are released
+        pthread_mutex_lock(&session->threads_lock);
+        for (i = 1; i < session->num_cpus; i++)
+        {
+            if (session->event_sets[i] == PAPI_NULL)
+            {
+                session->cpus[i] = 0;
+                memset(my_row(session, session->values, i), 0,
+                       sizeof(long long) * session->num_events);
+            }
+        }
+        pthread_mutex_unlock(&session->threads_lock);
+        my_reset_threads(session);
+    }
+
+    if (session->parallel_mode)
+    {
+        my_run_workers(session, WORKER_START);
+    }
+    else
+    {
+        for (i = 0; i < session->num_event_sets; i++)
+        {
+            my_PAPI_start(session->event_sets[i]);
+            session->op_times[i] = PAPI_get_real_nsec();
+        }
+    }
+    session->times[REAL_BEGIN] = session->lap_times[0] = PAPI_get_real_nsec();
+    session->times[VIRT_BEGIN] = session->lap_times[1] = PAPI_get_virt_nsec();
+    session->running = true;
+    session->start_skew = my_get_skew(session);
+    for (i = 0; i < session->num_event_sets; i++)
+    {
+        my_begin_multiplex(session, i);
+    }
+    // PAPI_start sets the counters to zero, so does the first lap
+    memset(session->lap_values, 0,
+           sizeof(long long) * my_values_size(session));
+    return EXIT_SUCCESS;
+}
+
+int my_session_stop(my_session_t *session)
+{
+    int i, num_noisy;
+    /* -------------------------- Checking PARAMS -------------------------- */
+    my_check_session(session);
+    if (session->num_event_sets == 0)
+    {
+        fprintf(stderr, "[MyPapi] Error: no event set to stop.\n");
+        exit(EXIT_FAILURE);
+    }
+    /* ------------------------ END checking PARAMS ------------------------ */
+
+    // The sampler can't read the event sets once they are stopped
+    my_session_stop_sampler(session);
+
+    if (session->parallel_mode)
+    {
+        my_run_workers(session, WORKER_STOP);
+    }
+    else
+    {
+        for (i = 0; i < session->num_event_sets; i++)
+        {
+            my_PAPI_stop(session->event_sets[i],
+                         my_row(session, session->values, i));
+            session->op_times[i] = PAPI_get_real_nsec();
+        }
+    }
+    if (session->thread_mode)
+    {
+        my_read_threads(session, false);
+    }
+    session->times[REAL_END] = PAPI_get_real_nsec();
+    session->times[VIRT_END] = PAPI_get_virt_nsec();
+    session->running = false;
+    session->stop_skew = my_get_skew(session);
+    for (i = 0; i < session->num_event_sets; i++)
+    {
+        my_read_multiplex(session, i, false);
+    }
+    num_noisy = my_subtract_overhead(session, OVERHEAD_STOP);
+    my_publish(session, session->values, session->times);
+    return num_noisy;
+}
+
+int my_session_next_region(my_session_t *session, char *output_file_name,
+                           long long label)
+{
+    int num_noisy = 0;
+    my_check_session(session);
+    // The first call just opens the first region
+    if (session->running)
+    {
+        num_noisy = my_session_stop(session);
+        my_session_print(session, output_file_name);
+    }
+    session->label = label;
+    my_session_start(session);
+    return num_noisy;
+}
+
+int my_session_stop_print(my_session_t *session, char *output_file_name)
+{
+    int num_noisy;
+    num_noisy = my_session_stop(session);
+    my_session_print(session, output_file_name);
+    return num_noisy;
+}
+
+int my_session_read(my_session_t *session)
+{
+    int i, num_noisy;
+    /* -------------------------- Checking PARAMS -------------------------- */
+    my_check_session(session);
+    if (session->num_event_sets == 0)
+    {
+        fprintf(stderr, "[MyPapi] Error: no event set to read.\n");
+        exit(EXIT_FAILURE);
+    }
+    /* ------------------------ END checking PARAMS ------------------------ */
+
+    // The counters keep counting, the values are the totals since the start
+    pthread_mutex_lock(&session->sampler_lock);
+    for (i = 0; i < session->num_event_sets; i++)
+    {
+        my_PAPI_read(session->event_sets[i],
+                     my_row(session, session->values, i));
+    }
+    pthread_mutex_unlock(&session->sampler_lock);
+    for (i = 0; i < session->num_event_sets; i++)
+    {
+        my_read_multiplex(session, i, false);
+    }
+    if (session->thread_mode)
+    {
+        my_read_threads(session, false);
+    }
+    session->times[REAL_END] = PAPI_get_real_nsec();
+    session->times[VIRT_END] = PAPI_get_virt_nsec();
+    num_noisy = my_subtract_overhead(session, OVERHEAD_READ);
+    my_publish(session, session->values, session->times);
+    return num_noisy;
+}
+
+int my_session_lap(my_session_t *session)
+{
+    int i, j, num_noisy;
+    long long *lap, *delta;
+    /* -------------------------- Checking PARAMS -------------------------- */
+    my_check_session(session);
+    if (session->num_event_sets == 0)
+    {
+        fprintf(stderr, "[MyPapi] Error: no event set to read.\n");
+        exit(EXIT_FAILURE);
+    }
+    /* ------------------------ END checking PARAMS ------------------------ */
+
+    // The counters are never stopped, the deltas between consecutive reads
+    // are the values of the lap so no event is lost between laps
+    pthread_mutex_lock(&session->sampler_lock);
+    for (i = 0; i < session->num_event_sets; i++)
+    {
+        my_PAPI_read(session->event_sets[i], session->snapshot);
+        lap = my_row(session, session->lap_values, i);
+        delta = my_row(session, session->values, i);
+        for (j = 0; j < session->num_events; j++)
+        {
+            delta[j] = session->snapshot[j] - lap[j];
+            lap[j] = session->snapshot[j];
+        }
+    }
+    pthread_mutex_unlock(&session->sampler_lock);
+    for (i = 0; i < session->num_event_sets; i++)
+    {
+        my_read_multiplex(session, i, true);
+    }
+    if (session->thread_mode)
+    {
+        my_read_threads(session, true);
+    }
+    // The lap begins where the previous one ended. The sampler reads the
+    // beginning, so it's changed under its lock
+    pthread_mutex_lock(&session->sampler_lock);
+    session->times[REAL_BEGIN] = session->lap_times[0];
+    session->times[VIRT_BEGIN] = session->lap_times[1];
+    pthread_mutex_unlock(&session->sampler_lock);
+    session->times[REAL_END] = session->lap_times[0] = PAPI_get_real_nsec();
+    session->times[VIRT_END] = session->lap_times[1] = PAPI_get_virt_nsec();
+    // The deltas are corrected (with the overhead of a lap, which is just a
+    // read), not the totals of the next lap
+    num_noisy = my_subtract_overhead(session, OVERHEAD_LAP);
+    my_publish(session, session->values, session->times);
+    return num_noisy;
+}
+
+int my_session_reset(my_session_t *session)
+{
+    int i;
+    /* -------------------------- Checking PARAMS -------------------------- */
+    my_check_session(session);
+    if (session->num_event_sets == 0)
+    {
+        fprintf(stderr, "[MyPapi] Error: no event set to reset.\n");
+        exit(EXIT_FAILURE);
+    }
+    /* ------------------------ END checking PARAMS ------------------------ */
+
+    pthread_mutex_lock(&session->sampler_lock);
+    for (i = 0; i < session->num_event_sets; i++)
+    {
+        my_PAPI_reset(session->event_sets[i]);
+        my_begin_multiplex(session, i);
+    }
+    // The sampler reads the beginning of the region
+    session->times[REAL_BEGIN] = session->lap_times[0] = PAPI_get_real_nsec();
+    session->times[VIRT_BEGIN] = session->lap_times[1] = PAPI_get_virt_nsec();
+    pthread_mutex_unlock(&session->sampler_lock);
+    if (session->thread_mode)
+    {
+        my_reset_threads(session);
+    }
+    memset(session->lap_values, 0,
+           sizeof(long long) * my_values_size(session));
+    return EXIT_SUCCESS;
+}
+
+int my_session_enter_region(my_session_t *session, int region)
+{
+    int i;
+    long long *frame;
+    /* -------------------------- Checking PARAMS -------------------------- */
+    my_check_session(session);
+    if (session->num_event_sets == 0)
+    {
+        fprintf(stderr, "[MyPapi] Error: no event set to read.\n");
+        exit(EXIT_FAILURE);
+    }
+    if (region < 0)
+    {
+        fprintf(stderr, "[MyPapi] Error: wrong region %d.\n", region);
+        exit(EXIT_FAILURE);
+    }
+    /* ------------------------ END checking PARAMS ------------------------ */
+
+    // The first region starts the counters, which are never stopped by the
+    // regions, so all of them come from the same stream
+    if (!session->running)
+    {
+        my_session_start(session);
+    }
+    if (session->region_depth == session->max_region_depth)
+    {
+        session->max_region_depth = (session->max_region_depth == 0)
+                                        ? 8
+                                        : 2 * session->max_region_depth;
+        session->region_stack = (int *)my_realloc(
+            session->region_stack,
+            sizeof(int) * session->max_region_depth);
+        session->region_frames = (long long *)my_realloc(
+            session->region_frames,
+            sizeof(long long) * session->max_region_depth *
+                (2 + 2 * my_values_size(session)));
+    }
+    session->region_stack[session->region_depth] = region;
+    frame = my_region_frame(session, session->region_depth);
+    memset(frame, 0, sizeof(long long) * (2 + 2 * my_values_size(session)));
+    pthread_mutex_lock(&session->sampler_lock);
+    for (i = 0; i < session->num_event_sets; i++)
+    {
+        my_PAPI_read(session->event_sets[i], my_row(session, &frame[2], i));
+    }
+    pthread_mutex_unlock(&session->sampler_lock);
+    frame[0] = PAPI_get_real_nsec();
+    session->region_depth++;
+    return EXIT_SUCCESS;
+}
+
+int my_session_exit_region(my_session_t *session)
+{
+    int i, j, region;
+    size_t k, size;
+    long long now, delta, *frame, *totals, *parent = NULL;
+    /* -------------------------- Checking PARAMS -------------------------- */
+    my_check_session(session);
+    if (session->region_depth == 0)
+    {
+        fprintf(stderr, "[MyPapi] Error: no region to exit.\n");
+        exit(EXIT_FAILURE);
+    }
+    if (!session->running)
+    {
+        fprintf(stderr, "[MyPapi] Error: the measure was stopped inside a "
+                        "region.\n");
+        exit(EXIT_FAILURE);
+    }
+    /* ------------------------ END checking PARAMS ------------------------ */
+
+    now = PAPI_get_real_nsec();
+    size = my_values_size(session);
+    session->region_depth--;
+    region = session->region_stack[session->region_depth];
+    frame = my_region_frame(session, session->region_depth);
+    if (session->region_depth > 0)
+    {
+        parent = my_region_frame(session, session->region_depth - 1);
+    }
+
+    // The totals grow with the ids, the new ones start at zero
+    if (region >= session->num_region_ids)
+    {
+        session->region_totals = (long long *)my_realloc(
+            session->region_totals,
+            sizeof(long long) * (region + 1) * (3 + 2 * size));
+        memset(my_region_totals(session, session->num_region_ids), 0,
+               sizeof(long long) * (region + 1 - session->num_region_ids) *
+                   (3 + 2 * size));
+        session->num_region_ids = region + 1;
+    }
+    totals = my_region_totals(session, region);
+
+    // Inclusive is the delta since the enter and exclusive subtracts the
+    // deltas of the nested regions, which are added to the parent
+    totals[0]++;
+    delta = now - frame[0];
+    totals[1] += delta;
+    totals[2] += delta - frame[1];
+    if (parent != NULL)
+    {
+        parent[1] += delta;
+    }
+    pthread_mutex_lock(&session->sampler_lock);
+    for (i = 0; i < session->num_event_sets; i++)
+    {
+        my_PAPI_read(session->event_sets[i], session->snapshot);
+        for (j = 0; j < session->num_events; j++)
+        {
+            k = (size_t)i * session->num_events + j;
+            delta = session->snapshot[j] - frame[2 + k];
+            totals[3 + k] += delta;
+            totals[3 + size + k] += delta - frame[2 + size + k];
+            if (parent != NULL)
+            {
+                parent[2 + size + k] += delta;
+            }
+        }
+    }
+    pthread_mutex_unlock(&session->sampler_lock);
+    return EXIT_SUCCESS;
+}
+
+long long *my_session_get_regions(my_session_t *session)
+{
+    my_check_session(session);
+    return session->region_totals;
+}
+
+int my_session_get_num_regions(my_session_t *session)
+{
+    my_check_session(session);
+    return session->num_region_ids;
+}
+
+int my_session_clear_regions(my_session_t *session)
+{
+    my_check_session(session);
+    if (session->region_totals != NULL)
+    {
+        memset(session->region_totals, 0,
+               sizeof(long long) * session->num_region_ids *
+                   (3 + 2 * my_values_size(session)));
+    }
+    return EXIT_SUCCESS;
+}
+
+int my_session_set_parallel(my_session_t *session, int enable)
+{
+    int i;
+    my_check_session(session);
+    if (enable && !session->parallel_mode)
+    {
+        /* ------------------------ Checking PARAMS ------------------------ */
+        if (session->num_event_sets == 0)
+        {
+            fprintf(stderr, "[MyPapi] Error: no event set created.\n");
+            exit(EXIT_FAILURE);
+        }
+        if (session->thread_mode)
+        {
+            fprintf(stderr, "[MyPapi] Error: the event sets of the threads "
+                            "can't be handled by the workers.\n");
+            exit(EXIT_FAILURE);
+        }
+        /* ---------------------- END checking PARAMS ---------------------- */
+
+        // The workers and this thread wait on the barriers
+        pthread_barrier_init(&session->workers_go, NULL,
+                             session->num_event_sets + 1);
+        pthread_barrier_init(&session->workers_done, NULL,
+                             session->num_event_sets + 1);
+        for (i = 0; i < session->num_event_sets; i++)
+        {
+            session->worker_args[i].session = session;
+            session->worker_args[i].index = i;
+            if (pthread_create(&session->workers[i], NULL, my_worker,
+                               &session->worker_args[i]) != 0)
+            {
+                fprintf(stderr, "[MyPapi] Error: couldn't create a worker.\n");
+                exit(EXIT_FAILURE);
+            }
+        }
+        session->parallel_mode = true;
+    }
+    else if (!enable && session->parallel_mode)
+    {
+        my_run_workers(session, WORKER_EXIT);
+        for (i = 0; i < session->num_event_sets; i++)
+        {
+            pthread_join(session->workers[i], NULL);
+        }
+        pthread_barrier_destroy(&session->workers_go);
+        pthread_barrier_destroy(&session->workers_done);
+        session->parallel_mode = false;
+    }
+    return EXIT_SUCCESS;
+}
+
+int my_session_publish(my_session_t *session, char *live_file_name)
+{
+    int fd, j;
+    size_t size;
+    char *names;
+    struct my_live *live;
+
+    /* -------------------------- Checking PARAMS -------------------------- */
+    my_check_session(session);
+    my_unpublish(session);
+    if (live_file_name == NULL)
+    {
+        return EXIT_SUCCESS;
+    }
+    if (session->num_cpus == 0)
+    {
+        fprintf(stderr, "[MyPapi] Error: the measure must be prepared.\n");
+        exit(EXIT_FAILURE);
+    }
+    /* ------------------------ END checking PARAMS ------------------------ */
+
+    size = sizeof(struct my_live) +
+           sizeof(long long) * (session->num_cpus + my_values_size(session)) +
+           (size_t)session->num_events * MAX_LENGTH_EVENT_NAME;
+    fd = open(live_file_name, O_RDWR | O_CREAT | O_TRUNC, 0644);
+    if (fd < 0 || ftruncate(fd, size) != 0)
+    {
+        fprintf(stderr, "[MyPapi] Error: couldn't create file '%s'\n",
+                live_file_name);
+        exit(EXIT_FAILURE);
+    }
+    live = (struct my_live *)mmap(NULL, size, PROT_READ | PROT_WRITE,
+                                  MAP_SHARED, fd, 0);
+    close(fd);
+    if (live == MAP_FAILED)
+    {
+        fprintf(stderr, "[MyPapi] Error: couldn't map file '%s'\n",
+                live_file_name);
+        exit(EXIT_FAILURE);
+    }
+
+    // The names don't change, they are written once
+    live->num_cpus = session->num_cpus;
+    live->num_events = session->num_events;
+    names = (char *)&live->data[session->num_cpus + my_values_size(session)];
+    for (j = 0; j < session->num_events; j++)
+    {
+        strncpy(&names[(size_t)j * MAX_LENGTH_EVENT_NAME], session->events[j],
+                MAX_LENGTH_EVENT_NAME - 1);
+    }
+    atomic_thread_fence(memory_order_release);
+    memcpy(live->magic, LIVE_MAGIC, sizeof(live->magic));
+
+    pthread_mutex_lock(&session->live_lock);
+    session->live = live;
+    session->live_size = size;
+    pthread_mutex_unlock(&session->live_lock);
+    my_publish(session, session->values, session->times);
+    return EXIT_SUCCESS;
+}
+
+int my_session_set_overhead(my_session_t *session, int kind,
+                            long long *overhead, long long *noise_floor)
+{
+    /* -------------------------- Checking PARAMS -------------------------- */
+    my_check_session(session);
+    if (kind < 0 || kind >= NUM_OVERHEADS)
+    {
+        fprintf(stderr, "[MyPapi] Error: wrong kind of overhead %d.\n", kind);
+        exit(EXIT_FAILURE);
+    }
+    if (overhead != NULL && session->thread_mode)
+    {
+        fprintf(stderr, "[MyPapi] Error: the overhead of the threads can't "
+                        "be subtracted.\n");
+        exit(EXIT_FAILURE);
+    }
+    if (overhead != NULL && noise_floor == NULL)
+    {
+        fprintf(stderr, "[MyPapi] Error: the overhead needs its noise "
+                        "floor.\n");
+        exit(EXIT_FAILURE);
+    }
+    /* ------------------------ END checking PARAMS ------------------------ */
+
+    free(session->overhead[kind]);
+    free(session->noise_floor[kind]);
+    session->overhead[kind] = session->noise_floor[kind] = NULL;
+    if (overhead != NULL)
+    {
+        session->overhead[kind] = (long long *)my_calloc(
+            my_values_size(session), sizeof(long long));
+        memcpy(session->overhead[kind], overhead,
+               sizeof(long long) * my_values_size(session));
+        session->noise_floor[kind] = (long long *)my_calloc(
+            session->num_events, sizeof(long long));
+        memcpy(session->noise_floor[kind], noise_floor,
+               sizeof(long long) * session->num_events);
+    }
+    return EXIT_SUCCESS;
+}
+
+int *my_session_get_noisy(my_session_t *session)
+{
+    my_check_session(session);
+    return session->noisy;
+}
+
+int my_session_set_groups(my_session_t *session, int *groups)
+{
+    int g, i;
+
+    /* -------------------------- Checking PARAMS -------------------------- */
+    my_check_session(session);
+    if (groups != NULL && session->thread_mode)
+    {
+        fprintf(stderr, "[MyPapi] Error: the rows of the threads can't be "
+                        "added up.\n");
+        exit(EXIT_FAILURE);
+    }
+    /* ------------------------ END checking PARAMS ------------------------ */
+
+    // The records buffered are written as they were measured
+    my_session_flush(session);
+    my_free_groups(session);
+    if (groups == NULL)
+    {
+        return EXIT_SUCCESS;
+    }
+
+    // The groups are numbered in order of appearance
+    session->row_groups = (int *)my_calloc(session->num_cpus, sizeof(int));
+    session->group_ids = (int *)my_calloc(session->num_cpus, sizeof(int));
+    for (i = 0; i < session->num_cpus; i++)
+    {
+        for (g = 0; g < session->num_groups; g++)
+        {
+            if (session->group_ids[g] == groups[i])
+            {
+                break;
+            }
+        }
+        if (g == session->num_groups)
+        {
+            session->group_ids[session->num_groups++] = groups[i];
+        }
+        session->row_groups[i] = g;
+    }
+    session->group_values = (long long *)my_calloc(
+        (size_t)session->num_groups * session->num_events, sizeof(long long));
+    session->group_mpx = (long long *)my_calloc(
+        (size_t)session->num_groups * session->num_events * NUM_MPX_VALUES,
+        sizeof(long long));
+    return EXIT_SUCCESS;
+}
+
+int my_session_set_multiplex(my_session_t *session, int enable)
+{
+    my_check_session(session);
+    session->multiplex_requested = enable;
+    return EXIT_SUCCESS;
+}
+
+long long *my_session_get_multiplex_values(my_session_t *session)
+{
+    my_check_session(session);
+    return session->multiplex_mode ? session->mpx_values : NULL;
+}
+
+long long *my_session_get_times(my_session_t *session)
+{
+    my_check_session(session);
+    return session->times;
+}
+
+long long my_session_get_start_skew(my_session_t *session)
+{
+    my_check_session(session);
+    return session->start_skew;
+}
+
+long long my_session_get_stop_skew(my_session_t *session)
+{
+    my_check_session(session);
+    return session->stop_skew;
+}
+
+int my_session_start_sampler(my_session_t *session, long long interval_ns,
+                             int max_samples)
+{
+    /* -------------------------- Checking PARAMS -------------------------- */
+    my_check_session(session);
+    if (!session->running)
+    {
+        fprintf(stderr, "[MyPapi] Error: the measure must be started.\n");
+        exit(EXIT_FAILURE);
+    }
+    if (session->thread_mode)
+    {
+        fprintf(stderr, "[MyPapi] Error: the event sets of the threads "
+                        "can't be read by the sampler.\n");
+        exit(EXIT_FAILURE);
+    }
+    if (interval_ns < 1 || max_samples < 1)
+    {
+        fprintf(stderr, "[MyPapi] Error: wrong sampler interval '%lld' or "
+                        "number of samples '%d'\n",
+                interval_ns, max_samples);
+        exit(EXIT_FAILURE);
+    }
+    /* ------------------------ END checking PARAMS ------------------------ */
+
+    my_session_stop_sampler(session);
+
+    session->sampler_interval = interval_ns;
+    session->max_samples = max_samples;
+    session->samples = (long long *)my_realloc(
+        session->samples,
+        sizeof(long long) * my_sample_size(session) * max_samples);
+    atomic_store(&session->samples_head, 0);
+    atomic_store(&session->samples_tail, 0);
+    atomic_store(&session->samples_dropped, 0);
+    atomic_store(&session->sampler_running, true);
+    if (pthread_create(&session->sampler, NULL, my_sampler, session) != 0)
+    {
+        fprintf(stderr, "[MyPapi] Error: couldn't create the sampler.\n");
+        exit(EXIT_FAILURE);
+    }
+    return EXIT_SUCCESS;
+}
+
+int my_session_stop_sampler(my_session_t *session)
+{
+    my_check_session(session);
+    if (atomic_exchange(&session->sampler_running, false))
+    {
+        pthread_join(session->sampler, NULL);
+    }
+    return EXIT_SUCCESS;
+}
+
+int my_session_get_num_samples(my_session_t *session)
+{
+    my_check_session(session);
+    return (int)(atomic_load(&session->samples_head) -
+                 atomic_load(&session->samples_tail));
+}
+
+long long my_session_get_dropped_samples(my_session_t *session)
+{
+    my_check_session(session);
+    return atomic_load(&session->samples_dropped);
+}
+
+int my_session_fetch_samples(my_session_t *session, long long *samples,
+                             int max_samples)
+{
+    size_t head, tail, n, i;
+    size_t sample_size;
+
+    my_check_session(session);
+    if (session->samples == NULL)
+    {
+        return 0;
+    }
+    sample_size = my_sample_size(session);
+    head = atomic_load_explicit(&session->samples_head, memory_order_acquire);
+    tail = atomic_load_explicit(&session->samples_tail, memory_order_relaxed);
+    n = head - tail;
+    if (max_samples >= 0 && n > (size_t)max_samples)
+    {
+        n = max_samples;
+    }
+    for (i = 0; i < n; i++)
+    {
+        memcpy(&samples[i * sample_size],
+               &session->samples[((tail + i) % session->max_samples) *
+                                 sample_size],
+               sizeof(long long) * sample_size);
+    }
+    // The sampler can reuse the slots once they have been copied
+    atomic_store_explicit(&session->samples_tail, tail + n,
+                          memory_order_release);
+    return (int)n;
+}
+
+int my_session_print(my_session_t *session, char *output_file_name)
+{
+    int i, j;
+    FILE *fp;
+    long long val, *mpx;
+
+    my_check_session(session);
+    if (output_file_name != NULL)
+    {
+        // Just copy the values, they are written later by my_session_flush
+        my_buffer_record(session, output_file_name);
+        return EXIT_SUCCESS;
+    }
+
+    fp = stdout;
+    setlocale(LC_NUMERIC, "");
+    bool print_cpu, print_header;
+    for (i = 0; i < session->num_cpus; i++)
+    {
+        if (session->thread_mode && session->cpus[i] == 0)
+        {
+            continue;
+        }
+        print_cpu = false;
+        print_header = false;
+        for (j = 0; j < session->num_events; j++)
+        {
+            val = my_row(session, session->values, i)[j];
+            // if (val != 0)
+            // {
+                print_cpu = true;
+                if (print_cpu && !print_header)
+                {
+                    print_header = true;
+                    fprintf(fp, "%s\n", "+-----+------------------------------"
+                                        "-------------+-----------------+");
+                    fprintf(fp, "| %s | %-42s| %-16s|\n",
+                            session->thread_mode ? "TID" : "CPU", "Event",
+                            "Value");
+                    fprintf(fp, "%s\n", "+=====+=============================="
+                                        "=============+=================+");
+                }
+                fprintf(fp, "|  %02d | %-42s| %'-16lld|\n", session->cpus[i],
+                        session->events[j], val);
+            // }
+        }
+        if (print_cpu)
+        {
+            fprintf(fp, "%s\n", "+-----+--------------------------------------"
+                                "-----+-----------------+");
+        }
+        // The values are scaled with the times of each event
+        for (j = 0; session->multiplex_mode && j < session->num_events; j++)
+        {
+            mpx = &session->mpx_values[((size_t)i * session->num_events + j) *
+                                       NUM_MPX_VALUES];
+            fprintf(fp, "Multiplexed %s: raw = %'lld, enabled = %'lld ns, "
+                        "running = %'lld ns\n",
+                    session->events[j], mpx[MPX_RAW], mpx[MPX_TIME_ENABLED],
+                    mpx[MPX_TIME_RUNNING]);
+        }
+    }
+    fprintf(fp, "Skew between cpus (ns): start = %'lld, stop = %'lld\n",
+            session->start_skew, session->stop_skew);
+    fprintf(fp, "Elapsed (ns): real = %'lld, virtual = %'lld\n",
+            session->times[REAL_END] - session->times[REAL_BEGIN],
+            session->times[VIRT_END] - session->times[VIRT_BEGIN]);
+    return EXIT_SUCCESS;
+}
+
+// Writes the rows of a buffered record (one per cpu, thread or group)
+static void my_write_record(FILE *fp, my_session_t *session, long long *record)
+{
+    int g, i, id;
+    size_t size = NUM_MPX_VALUES * session->num_events;
+    long long *region, *mpx, *ids;
+
+    region = &record[my_values_size(session)];
+    mpx = session->multiplex_mode ? &region[NUM_REGION_TIMES + 1] : NULL;
+    ids = &region[NUM_REGION_TIMES + 1 +
+                  (session->multiplex_mode ? session->num_cpus * size : 0)];
+    if (session->row_groups != NULL)
+    {
+        // One row per group, with the values of its cpus added up
+        my_add_up_groups(session, record, mpx);
+        for (g = 0; g < session->num_groups; g++)
+        {
+            my_write_row(fp, session, session->group_ids[g],
+                         my_row(session, session->group_values, g), region,
+                         mpx ? &session->group_mpx[g * size] : NULL);
+        }
+        return;
+    }
+    for (i = 0; i < session->num_cpus; i++)
+    {
+        // In thread_mode, the first column is the id of the thread
+        id = session->thread_mode ? (int)ids[i] : session->cpus[i];
+        if (session->thread_mode && id == 0)
+        {
+            continue;
+        }
+        my_write_row(fp, session, id, my_row(session, record, i), region,
+                     mpx ? &mpx[i * size] : NULL);
+    }
+}
+
+int my_session_flush(my_session_t *session)
+{
+    int f;
+    size_t r, record_size, *first, *order;
+    FILE *fp;
+
+    my_check_session(session);
+    if (session->num_records == 0)
+    {
+        return EXIT_SUCCESS;
+    }
+    record_size = my_record_size(session);
+
+    // The records are grouped by file in a single pass (counting sort), so
+    // each file is opened once and receives all its records in order
+    first = (size_t *)my_calloc(session->num_output_files + 1, sizeof(size_t));
+    order = (size_t *)my_calloc(session->num_records, sizeof(size_t));
+    for (r = 0; r < session->num_records; r++)
+    {
+        first[session->record_files[r] + 1]++;
+    }
+    for (f = 0; f < session->num_output_files; f++)
+    {
+        first[f + 1] += first[f];
+    }
+    for (r = 0; r < session->num_records; r++)
+    {
+        order[first[session->record_files[r]]++] = r;
+    }
+
+    // Now first[f] is where the records of the file f + 1 begin
+    for (f = 0, r = 0; f < session->num_output_files; f++)
+    {
+        if (r == first[f])
+        {
+            continue;
+        }
+        fp = fopen(session->output_files[f], "a+");
+        if (fp == NULL)
+        {
+            fprintf(stderr, "[MyPapi] Error: couldn't open file '%s'\n",
+                    session->output_files[f]);
+            exit(EXIT_FAILURE);
+        }
+        for (; r < first[f]; r++)
+        {
+            my_write_record(fp, session,
+                            &session->records[order[r] * record_size]);
+        }
+        fclose(fp);
+    }
+    free(first);
+    free(order);
+    session->num_records = 0;
+    return EXIT_SUCCESS;
+}
+
+int my_session_destroy(my_session_t *session)
+{
+    my_check_session(session);
+    // Writes the pending records before releasing everything
+    my_session_flush(session);
+    my_free_records(session);
+    my_session_set_parallel(session, false);
+    my_free_config(session);
+    pthread_mutex_destroy(&session->threads_lock);
+    pthread_mutex_destroy(&session->live_lock);
+    pthread_mutex_destroy(&session->sampler_lock);
+    free(session);
+
+    // Stops the PAPI lib when no one else (neither the profiler) is using it
+    if (--num_sessions == 0 && prof_event_set == PAPI_NULL)
+    {
+        my_PAPI_shutdown();
+        multiplex_initialized = false;
+    }
+    return EXIT_SUCCESS;
+}
+
+int my_after_fork_child()
+{
+    // The event sets (and their descriptors) of the parent are shared with
+    // it, so neither they nor PAPI are touched: the sessions and the
+    // profiler are just forgotten and the next prepare creates new ones
+    num_sessions = 0;
+    default_session = NULL;
+    prof_event_set = PAPI_NULL;
+    return EXIT_SUCCESS;
+}
+
+long long *my_session_get_values(my_session_t *session)
+{
+    my_check_session(session);
+    return session->values;
+}
+
+int my_session_get_num_cpus(my_session_t *session)
+{
+    my_check_session(session);
+    return session->num_cpus;
+}
+
+int *my_session_get_cpus(my_session_t *session)
+{
+    my_check_session(session);
+    return session->cpus;
+}
+
+int my_session_get_num_events(my_session_t *session)
+{
+    my_check_session(session);
+    return session->num_events;
+}
+
+const char *my_session_get_event_name(my_session_t *session, int index)
+{
+    my_check_session(session);
+    if (index < 0 || index >= session->num_events)
+    {
+        fprintf(stderr, "[MyPapi] Error: wrong event index '%d'\n", index);
+        exit(EXIT_FAILURE);
+    }
+    return session->events[index];
+}
+
+// ----------------------------------------------------------------------------
+// Event catalog
+// ----------------------------------------------------------------------------
+// Appends the name of the event to the buffer (one per line). Returns the
+// length of the buffer with it, even if it doesn't fit
+static int my_catalog_append(int code, char *buffer, int length, int used)
+{
+    char name[PAPI_HUGE_STR_LEN];
+    int n;
+
+    if (PAPI_event_code_to_name(code, name) != PAPI_OK)
+    {
+        return used;
+    }
+    n = strlen(name);
+    if (used + n + 1 < length)
+    {
+        memcpy(&buffer[used], name, n);
+        buffer[used + n] = '\n';
+        buffer[used + n + 1] = '\0';
+    }
+    return used + n + 1;
+}
+
+int my_catalog_list_events(char *buffer, int length)
+{
+    int code, umask, used = 0;
+    const int cidx = 0;
+
+    my_PAPI_library_init(PAPI_VER_CURRENT);
+    if (length > 0)
+    {
+        buffer[0] = '\0';
+    }
+
+    // Presets available in this cpu
+    code = 0 | PAPI_PRESET_MASK;
+    if (PAPI_enum_cmp_event(&code, PAPI_ENUM_FIRST, cidx) == PAPI_OK)
+    {
+        do
+        {
+            used = my_catalog_append(code, buffer, length, used);
+        } while (PAPI_enum_cmp_event(&code, PAPI_PRESET_ENUM_AVAIL, cidx) ==
+                 PAPI_OK);
+    }
+
+    // Native events and their unit masks
+    code = 0 | PAPI_NATIVE_MASK;
+    if (PAPI_enum_cmp_event(&code, PAPI_ENUM_FIRST, cidx) == PAPI_OK)
+    {
+        do
+        {
+            used = my_catalog_append(code, buffer, length, used);
+            umask = code;
+            while (PAPI_enum_cmp_event(&umask, PAPI_NTV_ENUM_UMASKS, cidx) ==
+                   PAPI_OK)
+            {
+                used = my_catalog_append(umask, buffer, length, used);
+            }
+        } while (PAPI_enum_cmp_event(&code, PAPI_ENUM_EVENTS, cidx) ==
+                 PAPI_OK);
+    }
+    return used;
+}
+
+int my_catalog_check_events(char **events, int num_events, int *fits)
+{
+    int i, num_fits = 0, event_set = PAPI_NULL;
+
+    // The events are added in order to an event set of the calling thread,
+    // without exiting when one is unknown or doesn't fit
+    my_PAPI_library_init(PAPI_VER_CURRENT);
+    my_PAPI_create_eventset(&event_set);
+    my_PAPI_assign_eventset_component(event_set, 0);
+    for (i = 0; i < num_events; i++)
+    {
+        fits[i] = (PAPI_add_named_event(event_set, events[i]) == PAPI_OK);
+        num_fits += fits[i];
+    }
+    my_PAPI_cleanup_eventset(event_set);
+    my_PAPI_destroy_eventset(&event_set);
+    return num_fits;
+}
+
+int my_catalog_get_num_counters()
+{
+    my_PAPI_library_init(PAPI_VER_CURRENT);
+    return PAPI_num_cmp_hwctrs(0);
+}
+
+// ----------------------------------------------------------------------------
+// Profiler
+// ----------------------------------------------------------------------------
+// Called by PAPI (inside a signal handler) when an event overflows. It only
+// stores the instruction pointer and raises the signal for the caller
+static void my_profile_handler(int EventSet, void *address,
+                               long long overflow_vector, void *context)
+{
+    int k, n = prof_num_events;
+    size_t head, tail;
+
+    if (PAPI_get_overflow_event_index(EventSet, overflow_vector, prof_indices,
+                                      &n) != PAPI_OK)
+    {
+        return;
+    }
+    for (k = 0; k < n; k++)
+    {
+        head = atomic_load_explicit(&prof_head, memory_order_relaxed);
+        tail = atomic_load_explicit(&prof_tail, memory_order_acquire);
+        if (head - tail == PROFILE_MAX_SAMPLES)
+        {
+            atomic_fetch_add(&prof_dropped, 1);
+            continue;
+        }
+        prof_sample_events[head % PROFILE_MAX_SAMPLES] = prof_indices[k];
+        prof_sample_ips[head % PROFILE_MAX_SAMPLES] =
+            (unsigned long long)(uintptr_t)address;
+        atomic_store_explicit(&prof_head, head + 1, memory_order_release);
+    }
+    if (prof_signum > 0)
+    {
+        raise(prof_signum);
+    }
+}
+
+int my_profile_prepare(char *input_file_name)
+{
+    int i;
+    FILE *fp;
+
+    /* -------------------------- Checking PARAMS -------------------------- */
+    fp = fopen(input_file_name, "r");
+    if (fp == NULL)
+    {
+        fprintf(stderr, "[MyPapi] Error: couldn't open file '%s'\n",
+                input_file_name);
+        exit(EXIT_FAILURE);
+    }
+    /* ------------------------ END checking PARAMS ------------------------ */
+
+    my_profile_finalize();
+    prof_num_events = my_read_events(fp, &prof_events);
+    prof_codes = (int *)my_calloc(prof_num_events, sizeof(int));
+    prof_indices = (int *)my_calloc(prof_num_events, sizeof(int));
+
+    // The event set counts the calling thread (default granularity)
+    my_PAPI_library_init(PAPI_VER_CURRENT);
+    my_PAPI_create_eventset(&prof_event_set);
+    my_PAPI_assign_eventset_component(prof_event_set, 0);
+    for (i = 0; i < prof_num_events; i++)
+    {
+        my_PAPI_add_named_event(prof_event_set, prof_events[i]);
+        if ((retval = PAPI_event_name_to_code(prof_events[i],
+                                              &prof_codes[i])) != PAPI_OK)
+            ERROR_RETURN(retval);
+    }
+    return prof_num_events;
+}
+
+const char *my_profile_get_event_name(int index)
+{
+    if (index < 0 || index >= prof_num_events)
+    {
+        fprintf(stderr, "[MyPapi] Error: wrong event index '%d'\n", index);
+        exit(EXIT_FAILURE);
+    }
+    return prof_events[index];
+}
+
+int my_profile_start(int *thresholds, int signum)
+{
+    int i;
+    /* -------------------------- Checking PARAMS -------------------------- */
+    if (prof_event_set == PAPI_NULL)
+    {
+        fprintf(stderr, "[MyPapi] Error: the profiler isn't prepared.\n");
+        exit(EXIT_FAILURE);
+    }
+    /* ------------------------ END checking PARAMS ------------------------ */
+
+    prof_signum = signum;
+    atomic_store(&prof_head, 0);
+    atomic_store(&prof_tail, 0);
+    atomic_store(&prof_dropped, 0);
+    // Events with a threshold of 0 are just counted
+    for (i = 0; i < prof_num_events; i++)
+    {
+        if (thresholds[i] > 0)
+        {
+            my_PAPI_overflow(prof_event_set, prof_codes[i], thresholds[i], 0,
+                             my_profile_handler);
+        }
+    }
+    my_PAPI_start(prof_event_set);
+    return EXIT_SUCCESS;
+}
+
+int my_profile_stop(long long *totals, int *thresholds)
+{
+    int i;
+
+    /* -------------------------- Checking PARAMS -------------------------- */
+    if (prof_event_set == PAPI_NULL)
+    {
+        fprintf(stderr, "[MyPapi] Error: the profiler isn't prepared.\n");
+        exit(EXIT_FAILURE);
+    }
+    /* ------------------------ END checking PARAMS ------------------------ */
+
+    my_PAPI_stop(prof_event_set, totals);
+    for (i = 0; i < prof_num_events; i++)
+    {
+        if (thresholds[i] > 0)
+        {
+            my_PAPI_overflow(prof_event_set, prof_codes[i], 0, 0, NULL);
+        }
+    }
+    prof_signum = 0;
+    return EXIT_SUCCESS;
+}
+
+int my_profile_fetch(int *events, unsigned long long *ips, int max_samples)
+{
+    size_t head, tail, n, i;
+
+    head = atomic_load_explicit(&prof_head, memory_order_acquire);
+    tail = atomic_load_explicit(&prof_tail, memory_order_relaxed);
+    n = head - tail;
+    if (max_samples >= 0 && n > (size_t)max_samples)
+    {
+        n = max_samples;
+    }
+    for (i = 0; i < n; i++)
+    {
+        events[i] = prof_sample_events[(tail + i) % PROFILE_MAX_SAMPLES];
+        ips[i] = prof_sample_ips[(tail + i) % PROFILE_MAX_SAMPLES];
+    }
+    atomic_store_explicit(&prof_tail, tail + n, memory_order_release);
+    return (int)n;
+}
+
+long long my_profile_get_dropped()
+{
+    return atomic_load(&prof_dropped);
+}
+
+int my_profile_symbol(unsigned long long ip, char *name, int length)
+{
+    Dl_info info;
+    const char *lib;
+
+    // Function and library of the address, without the offset so that
+    // samples in the same function are aggregated
+    if (dladdr((void *)(uintptr_t)ip, &info) == 0)
+    {
+        return snprintf(name, length, "[unknown]");
+    }
+    lib = (info.dli_fname != NULL) ? strrchr(info.dli_fname, '/') : NULL;
+    lib = (lib != NULL) ? lib + 1 : info.dli_fname;
+    if (info.dli_sname != NULL)
+    {
+        return snprintf(name, length, "%s [%s]", info.dli_sname, lib);
+    }
+    return snprintf(name, length, "[%s]", lib);
+}
+
+int my_profile_finalize()
+{
+    int i;
+    if (prof_event_set != PAPI_NULL &&
+        my_PAPI_is_initialized() != PAPI_NOT_INITED)
+    {
+        my_PAPI_cleanup_eventset(prof_event_set);
+        my_PAPI_destroy_eventset(&prof_event_set);
+    }
+    prof_event_set = PAPI_NULL;
+    if (num_sessions == 0 && my_PAPI_is_initialized() != PAPI_NOT_INITED)
+    {
+        my_PAPI_shutdown();
+        multiplex_initialized = false;
+    }
+    for (i = 0; i < prof_num_events; i++)
+    {
+        free(prof_events[i]);
+    }
+    free(prof_events);
+    free(prof_codes);
+    free(prof_indices);
+    prof_events = NULL;
+    prof_codes = NULL;
+    prof_indices = NULL;
+    prof_num_events = 0;
+    return EXIT_SUCCESS;
+}
+
+// ----------------------------------------------------------------------------
+// For python
+// ----------------------------------------------------------------------------
+// Session used by the functions below, created on the first use
+static my_session_t *my_default_session()
+{
+    if (default_session == NULL)
+    {
+        default_session = my_session_create();
+    }
+    return default_session;
+}
+
+int my_prepare_measure(char *input_file_name, int num_cpus, int *cpus)
+{
+    return my_session_prepare(my_default_session(), input_file_name,
+                              num_cpus, cpus);
+}
+
+int my_prepare_threads_measure(char *input_file_name, int max_threads)
+{
+    return my_session_prepare_threads(my_default_session(), input_file_name,
+                                      max_threads);
+}
+
+int my_prepare_attach_measure(char *input_file_name, int pid)
+{
+    return my_session_prepare_attach(my_default_session(), input_file_name,
+                                     pid);
+}
+
+int my_register_thread()
+{
+    return my_session_register_thread(my_default_session());
+}
+
+int my_unregister_thread()
+{
+    return my_session_unregister_thread(my_default_session());
+}
+
+int my_start_measure()
+{
+    return my_session_start(my_default_session());
+}
+
+int my_stop_measure()
+{
+    return my_session_stop(my_default_session());
+}
+
+int my_next_region_measure(char *output_file_name, long long label)
+{
+    return my_session_next_region(my_default_session(), output_file_name,
+                                  label);
+}
+
+int my_stop_print_measure(char *output_file_name)
+{
+    return my_session_stop_print(my_default_session(), output_file_name);
+}
+
+int my_lap_measure()
+{
+    return my_session_lap(my_default_session());
+}
+
+int my_reset_measure()
+{
+    return my_session_reset(my_default_session());
+}
+
+int my_enter_region_measure(int region)
+{
+    return my_session_enter_region(my_default_session(), region);
+}
+
+int my_exit_region_measure()
+{
+    return my_session_exit_region(my_default_session());
+}
+
+long long *my_get_regions()
+{
+    return my_session_get_regions(my_default_session());
+}
+
+int my_get_num_regions()
+{
+    return my_session_get_num_regions(my_default_session());
+}
+
+int my_clear_regions_measure()
+{
+    return my_session_clear_regions(my_default_session());
+}
+
+int my_set_parallel_measure(int enable)
+{
+    return my_session_set_parallel(my_default_session(), enable);
+}
+
+int my_publish_measure(char *live_file_name)
+{
+    return my_session_publish(my_default_session(), live_file_name);
+}
+
+int my_set_overhead_measure(int kind, long long *overhead,
+                            long long *noise_floor)
+{
+    return my_session_set_overhead(my_default_session(), kind, overhead,
+                                   noise_floor);
+}
+
+int my_set_groups_measure(int *groups)
+{
+    return my_session_set_groups(my_default_session(), groups);
+}
+
+int my_set_multiplex_measure(int enable)
+{
+    return my_session_set_multiplex(my_default_session(), enable);
+}
+
+long long *my_get_multiplex_values()
+{
+    return my_session_get_multiplex_values(my_default_session());
+}
+
+long long *my_get_times()
+{
+    return my_session_get_times(my_default_session());
+}
+
+long long my_get_start_skew()
+{
+    return my_session_get_start_skew(my_default_session());
+}
+
+long long my_get_stop_skew()
+{
+    return my_session_get_stop_skew(my_default_session());
+}
+
+int my_print_measure(char *output_file_name)
+{
+    return my_session_print(my_default_session(), output_file_name);
+}
+
+int my_flush_measure()
+{
+    return my_session_flush(my_default_session());
+}
+
+int my_finalize_measure()
+{
+    if (default_session != NULL)
+    {
+        my_session_destroy(default_session);
+        default_session = NULL;
+    }
+    return EXIT_SUCCESS;
+}
+
+long long *my_get_values()
+{
+    return my_session_get_values(my_default_session());
+}
+
+int my_get_num_cpus()
+{
+    return my_session_get_num_cpus(my_default_session());
+}
+
+int *my_get_cpus()
+{
+    return my_session_get_cpus(my_default_session());
+}
+
+int my_get_num_events()
+{
+    return my_session_get_num_events(my_default_session());
+}
+
+const char *my_get_event_name(int index)
+{
+    return my_session_get_event_name(my_default_session(), index);
 }
 // ----------------------------------------------------------------------------
\ No newline at end of file
@@ -12,26 +12,83 @@
 // ----------------------------------------------------------------------------
 // Constants
 // ----------------------------------------------------------------------------
-#define MAX_CPUS 64
-#define MAX_EVENTS 10
 #define MAX_LENGTH_EVENT_NAME 150
+// Initial number of records reserved in the measurement buffer
+#define INITIAL_NUM_RECORDS 256
+// Size (in bytes) of the buffered records that forces a flush to disk
+#define FLUSH_THRESHOLD_BYTES (64 * 1024 * 1024)
+// Number of overflows that the profiler keeps until they are fetched
+#define PROFILE_MAX_SAMPLES 65536
+// First bytes of the live file with the values of a session
+#define LIVE_MAGIC "MYPAPI1"
+// Times (ns) recorded for each region
+enum region_time
+{
+    REAL_BEGIN,
+    REAL_END,
+    VIRT_BEGIN,
+    VIRT_END,
+    NUM_REGION_TIMES
+};
+// Values of each multiplexed event in a region: the count really made in a
+// counter and the time (ns) it was enabled and running in a counter
+enum multiplex_value
+{
+    MPX_RAW,
+    MPX_TIME_ENABLED,
+    MPX_TIME_RUNNING,
+    NUM_MPX_VALUES
+};
+// Overheads calibrated: of an empty region (start and stop), of a read
+// right after the start and of a lap right after the previous one
+enum overhead_kind
+{
+    OVERHEAD_STOP,
+    OVERHEAD_READ,
+    OVERHEAD_LAP,
+    NUM_OVERHEADS
+};
 //#define DEBUGGING
 
+// ----------------------------------------------------------------------------
+// Types
+// ----------------------------------------------------------------------------
+// Opaque handle with the event sets, results and buffers of a measure
+typedef struct my_session my_session_t;
+
 // ----------------------------------------------------------------------------
 // Low_level
 // ----------------------------------------------------------------------------
 // Add single PAPI preset or native hardware event to an event set
 int my_PAPI_add_event(int EventSet, int Event);
 
+// Add several PAPI presets or native hardware events to an event set
+int my_PAPI_add_events(int EventSet, int *EventCodes, int number);
+
 // Add an event by name to a PAPI event set
 int my_PAPI_add_named_event(int EventSet, const char *EventName);
 
 // Assign a component index to an existing but empty EventSet
 int my_PAPI_assign_eventset_component(int EventSet, int cidx);
 
+// Attach the event set to a thread (or process) id
+int my_PAPI_attach(int EventSet, unsigned long tid);
+
+// Empty and destroy an EventSet
+int my_PAPI_cleanup_eventset(int EventSet);
+
 // Create a new empty PAPI event set
 int my_PAPI_create_eventset(int *EventSet);
 
+// Empty and destroy an EventSet
+int my_PAPI_destroy_eventset(int *EventSet);
+
+// Initialize multiplex support in the PAPI library
+int my_PAPI_multiplex_init(void);
+
+// Convert a name to a numeric hardware event code
+int my_PAPI_event_name_to_code(const char *in, int *out);
+
 // Get information about the system hardware
 const PAPI_hw_info_t *my_PAPI_get_hardware_info(void);
 
@@ -47,9 +104,22 @@ int my_PAPI_library_init(int version);
 // List the events that are members of an event set
 int my_PAPI_list_events(int EventSet, int *Events, int *number);
 
+// Set up an event set to begin registering overflows
+int my_PAPI_overflow(int EventSet, int EventCode, int threshold, int flags,
+                     PAPI_overflow_handler_t handler);
+
+// Read hardware counters from an event set
+int my_PAPI_read(int EventSet, long long *values);
+
 // Inform PAPI of the existence of a new thread
 int my_PAPI_register_thread(void);
 
+// Reset the hardware event counts in an event set
+int my_PAPI_reset(int EventSet);
+
+// Convert a standard event set to a multiplexed event set
+int my_PAPI_set_multiplex(int EventSet);
+
 // Set PAPI library or event set options
 int my_PAPI_set_opt(int option, PAPI_option_t *ptr);
 
@@ -71,22 +141,327 @@ int my_PAPI_thread_init(unsigned long (*id_fn)(void));
 int my_get_total_cpus();
 
 // ----------------------------------------------------------------------------
-// For python
+// Sessions
+// ----------------------------------------------------------------------------
+// Create a new empty session
+my_session_t *my_session_create();
+
+// Prepare the env. of the session before starting the measurement
+int my_session_prepare(my_session_t *session, char *input_file_name,
+                       int num_cpus, int *cpus);
+
+// Prepare the session to count only the threads of this process, with one
+// row per thread (up to max_threads) instead of one per cpu. The rows are
+// identified by the id of the thread and the first one is the calling thread
+int my_session_prepare_threads(my_session_t *session, char *input_file_name,
+                               int max_threads);
+
+// Prepare the session to count another process, with one row per thread
+// running now. The threads created later are counted in the row of the
+// thread that creates them (inherit)
+int my_session_prepare_attach(my_session_t *session, char *input_file_name,
+                              int pid);
+
+// Start counting the calling thread in its own row until it unregisters. The
+// rows of the threads still registered are read by the stop (and the reads)
+// and reset by the start. Returns the row or -1 if there is no row left
+int my_session_register_thread(my_session_t *session);
+
+// Stop counting the calling thread. Its values are kept until the next start
+int my_session_unregister_thread(my_session_t *session);
+
+// Starts the measurement of the session
+int my_session_start(my_session_t *session);
+
+// Stop the measurement of the session. Like the read and the lap, it
+// returns the number of events within the noise floor (0 if not calibrated)
+int my_session_stop(my_session_t *session);
+
+// Read the totals since the start without stopping the counters
+int my_session_read(my_session_t *session);
+
+// Read the counters and store the deltas since the previous lap (or start)
+int my_session_lap(my_session_t *session);
+
+// Stop the current region (if any), print it as my_session_print and start
+// the next one, with the label passed (-1 for none), in a single call.
+// Returns the events within the noise floor of the region stopped
+int my_session_next_region(my_session_t *session, char *output_file_name,
+                           long long label);
+
+// Stop the current region and print it as my_session_print, in a single
+// call (e.g. the last region of my_session_next_region). Returns the events
+// within the noise floor
+int my_session_stop_print(my_session_t *session, char *output_file_name);
+
+// Reset the counters to zero while they keep counting
+int my_session_reset(my_session_t *session);
+
+// Enter a region (id >= 0) nested in the ones entered before, starting the
+// session if it isn't. The counters are read, never stopped
+int my_session_enter_region(my_session_t *session, int region);
+
+// Exit the last region entered and add its inclusive and exclusive (without
+// the nested regions) values to the totals of its id
+int my_session_exit_region(my_session_t *session);
+
+// Get the totals of the regions, one after another by id: the number of
+// exits, the real time (ns) inclusive and exclusive and the values
+// (num_cpus x num_events) inclusive and exclusive. It's valid until the next
+// exit of a new id, clear or prepare
+long long *my_session_get_regions(my_session_t *session);
+
+// Get the number of ids of the totals of the regions
+int my_session_get_num_regions(my_session_t *session);
+
+// Set the totals of the regions to zero
+int my_session_clear_regions(my_session_t *session);
+
+// Start and stop the event sets concurrently, one worker thread per cpu
+int my_session_set_parallel(my_session_t *session, int enable);
+
+// Publish the values of each stop, read, lap and sample in a file mapped in
+// memory, so other processes can read them while measuring. The layout is
+// in struct my_live and it's valid until the next prepare. NULL stops it
+int my_session_publish(my_session_t *session, char *live_file_name);
+
+// Subtract the overhead (num_cpus x num_events) of a kind of operation from
+// its values, e.g. the mean of empty regions for the stops, and mark the
+// events whose total (all the rows) is below noise_floor (num_events). NULL
+// stops subtracting it. It's valid until the next prepare
+int my_session_set_overhead(my_session_t *session, int kind,
+                            long long *overhead, long long *noise_floor);
+
+// Get whether each event of the last stop, read or lap is within the noise
+// floor (1) or not (0)
+int *my_session_get_noisy(my_session_t *session);
+
+// Add up the rows with the same group (e.g. the cpus of a core or socket)
+// in the output files, with the group as id. groups has one per row, NULL
+// writes each row again. It's valid until the next prepare
+int my_session_set_groups(my_session_t *session, int *groups);
+
+// Multiplex the events of the next prepared measure (0 disables it)
+int my_session_set_multiplex(my_session_t *session, int enable);
+
+// Get the matrix (cpus x events x NUM_MPX_VALUES) with the raw count and the
+// time enabled and running (ns) of each event in the last measure, indexed
+// by enum multiplex_value, or NULL if it isn't multiplexed. The values are
+// the estimates scaled with them: raw * enabled / running
+long long *my_session_get_multiplex_values(my_session_t *session);
+
+// Get the real and virtual time (ns) when the last region began and ended,
+// indexed by enum region_time
+long long *my_session_get_times(my_session_t *session);
+
+// Get the time (ns) between the first and the last event set started
+long long my_session_get_start_skew(my_session_t *session);
+
+// Get the time (ns) between the first and the last event set stopped
+long long my_session_get_stop_skew(my_session_t *session);
+
+// Start a thread that reads the counters every interval_ns nanoseconds and
+// keeps up to max_samples samples in a ring buffer (the session must be
+// started). The reads, laps, resets and regions of the session can be used
+// meanwhile (they wait for the read of the sampler) and the stop stops it
+int my_session_start_sampler(my_session_t *session, long long interval_ns,
+                             int max_samples);
+
+// Stop the sampler thread (the samples are kept until fetched)
+int my_session_stop_sampler(my_session_t *session);
+
+// Get the number of samples pending to be fetched
+int my_session_get_num_samples(my_session_t *session);
+
+// Get the number of samples discarded because the ring buffer was full
+long long my_session_get_dropped_samples(my_session_t *session);
+
+// Move up to max_samples (all if negative) samples to the buffer passed.
+// Each sample is the timestamp (ns) followed by the cpus x events values
+int my_session_fetch_samples(my_session_t *session, long long *samples,
+                             int max_samples);
+
+// Print the results (records are buffered when printing to a file)
+int my_session_print(my_session_t *session, char *output_file_name);
+
+// Write the buffered records to their output files
+int my_session_flush(my_session_t *session);
+
+// Destroy the session (PAPI is stopped after the last one)
+int my_session_destroy(my_session_t *session);
+
+// In a child process after fork, forget the sessions and the profiler
+// inherited from the parent without touching its event sets, so the child
+// can prepare its own sessions. The sessions inherited mustn't be used
+int my_after_fork_child();
+
+// Get the matrix (cpus x events) where the results are stored
+long long *my_session_get_values(my_session_t *session);
+
+// Get the number of cpus (or rows of threads) measured
+int my_session_get_num_cpus(my_session_t *session);
+
+// Get the cpus measured (or the ids of the threads, 0 if the row is free)
+int *my_session_get_cpus(my_session_t *session);
+
+// Get the number of events measured
+int my_session_get_num_events(my_session_t *session);
+
+// Get the name of the event in the position passed
+const char *my_session_get_event_name(my_session_t *session, int index);
+
+// ----------------------------------------------------------------------------
+// Event catalog
+// ----------------------------------------------------------------------------
+// Write the names of the presets and native events (with their unit masks)
+// of this cpu to the buffer, one per line. Returns the length needed, so the
+// list is incomplete if it is greater than or equal to the length passed
+int my_catalog_list_events(char *buffer, int length);
+
+// Check if the events fit together in the counters, adding them in order.
+// fits[i] is 0 if the event is unknown or doesn't fit with the previous
+// ones. Returns the number of events that fit
+int my_catalog_check_events(char **events, int num_events, int *fits);
+
+// Get the number of hardware counters of the cpu
+int my_catalog_get_num_counters();
+
+// ----------------------------------------------------------------------------
+// Profiler
+// ----------------------------------------------------------------------------
+// Prepare the events of the file to profile the calling thread. Returns the
+// number of events
+int my_profile_prepare(char *input_file_name);
+
+// Get the name of the event of the profiler in the position passed
+const char *my_profile_get_event_name(int index);
+
+// Start counting and store the instruction pointer each time an event reaches
+// its threshold (0 to just count it). If signum > 0, that signal is raised
+// after each overflow
+int my_profile_start(int *thresholds, int signum);
+
+// Stop the profiler and store the total of each event
+int my_profile_stop(long long *totals, int *thresholds);
+
+// Move up to max_samples (all if negative) overflows to the buffers passed:
+// index of the event and instruction pointer
+int my_profile_fetch(int *events, unsigned long long *ips, int max_samples);
+
+// Get the number of overflows discarded because the buffer was full
+long long my_profile_get_dropped();
+
+// Write the name of the function and library of the instruction pointer
+int my_profile_symbol(unsigned long long ip, char *name, int length);
+
+// Destroy the event set of the profiler
+int my_profile_finalize();
+
+// ----------------------------------------------------------------------------
+// For python (same as above, using a default session)
 // ----------------------------------------------------------------------------
 // Prepare the env. before starting the measurement
 int my_prepare_measure(char *input_file_name, int num_cpus, int *cpus);
 
+// Prepare the env. to count only the threads of this process
+int my_prepare_threads_measure(char *input_file_name, int max_threads);
+
+// Prepare the env. to count another process and the threads it creates
+int my_prepare_attach_measure(char *input_file_name, int pid);
+
+// Start counting the calling thread until it unregisters
+int my_register_thread();
+
+// Stop counting the calling thread
+int my_unregister_thread();
+
 // Starts the measurement
 int my_start_measure();
 
 // Stop the measurement
 int my_stop_measure();
 
-// Print the results
+// Stop the current region (if any), print it and start the next one
+int my_next_region_measure(char *output_file_name, long long label);
+
+// Stop the current region and print it
+int my_stop_print_measure(char *output_file_name);
+
+// Read the counters and store the deltas since the previous lap (or start)
+int my_lap_measure();
+
+// Reset the counters to zero while they keep counting
+int my_reset_measure();
+
+// Enter a region nested in the ones entered before
+int my_enter_region_measure(int region);
+
+// Exit the last region entered and add its values to the totals of its id
+int my_exit_region_measure();
+
+// Get the totals of the regions (see my_session_get_regions)
+long long *my_get_regions();
+
+// Get the number of ids of the totals of the regions
+int my_get_num_regions();
+
+// Set the totals of the regions to zero
+int my_clear_regions_measure();
+
+// Start and stop the event sets concurrently, one worker thread per cpu
+int my_set_parallel_measure(int enable);
+
+// Publish the values in a file mapped in memory (NULL stops it)
+int my_publish_measure(char *live_file_name);
+
+// Subtract the overhead of a kind of operation from its values (NULL stops
+// it)
+int my_set_overhead_measure(int kind, long long *overhead,
+                            long long *noise_floor);
+
+// Add up the rows with the same group in the output files (NULL stops it)
+int my_set_groups_measure(int *groups);
+
+// Multiplex the events of the next prepared measure (0 disables it)
+int my_set_multiplex_measure(int enable);
+
+// Get the matrix (cpus x events x NUM_MPX_VALUES) with the raw count and the
+// time enabled and running (ns) of each event in the last measure, or NULL
+// if it isn't multiplexed
+long long *my_get_multiplex_values();
+
+// Get the real and virtual time (ns) when the last region began and ended
+long long *my_get_times();
+
+// Get the time (ns) between the first and the last event set started
+long long my_get_start_skew();
+
+// Get the time (ns) between the first and the last event set stopped
+long long my_get_stop_skew();
+
+// Print the results (records are buffered when printing to a file)
 int my_print_measure(char *output_file_name);
 
+// Write the buffered records to their output files
+int my_flush_measure();
+
 // Ends the execution of the program
 int my_finalize_measure();
 
+// Get the matrix (cpus x events) where the results are stored
+long long *my_get_values();
+
+// Get the number of cpus measured
+int my_get_num_cpus();
+
+// Get the cpus measured
+int *my_get_cpus();
+
+// Get the number of events measured
+int my_get_num_events();
+
+// Get the name of the event in the position passed
+const char *my_get_event_name(int index);
+
 // ----------------------------------------------------------------------------
 #endif
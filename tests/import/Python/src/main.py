@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# --------------------------------------------------------------------------- #
+__author__ = "Juan Luis Padilla Salomé"
+__copyright__ = "Copyright 2021"
+__credits__ = ["University of Cantabria", "Pablo Abad", "Pablo Prieto"]
+__license__ = "GPL"
+__version__ = "1.0.0"
+__maintainer__ = "Juan Luis Padilla Salomé"
+__email__ = "juan-luis.padilla@alumnos.unican.es"
+__status__ = "Production"
+# --------------------------------------------------------------------------- #
+
+
+# --------------------------------------------------------------------------- #
+if __name__ == "__main__":
+    """Measures the time to import the core of MyPapi in a new interpreter,
+    as a short-lived script or worker does, and checks that the heavy
+    packages (TensorFlow, pandas) and the modules of the machinery used only
+    by some methods (the cache of the catalog, the signals of the profiler
+    and the workers) aren't loaded with it.
+    @param repetitions number of interpreters launched (default is 20).
+    @param max_time if passed, the program fails when the median time (ms) is
+        greater, so a regression of the import cost can be caught.
+    """
+
+    # standard library
+    import pathlib
+    import statistics
+    import subprocess
+    import sys
+
+    # 3rd party packages
+
+    # local source
+
+    # ----------------------------------------------------------------------- #
+
+    HEAVY_MODULES = ("tensorflow", "pandas", "MyPapi_keras")
+    # Imported by the methods that use them (re and platform are already
+    # loaded by numpy)
+    LAZY_MODULES = ("json", "signal", "tempfile", "multiprocessing")
+
+    # Reads the parameters and check the correctness
+    if len(sys.argv) > 3:
+        print("[ERROR] Wrong parameters.\n\tUsage: python3 main.py "
+              "[REPETITIONS] [MAX_TIME (ms)]")
+        sys.exit(-1)
+
+    repetitions = 20
+    if len(sys.argv) > 1:
+        repetitions = int(sys.argv[1])
+    max_time = None
+    if len(sys.argv) > 2:
+        max_time = float(sys.argv[2])
+
+    # From this file, the sources of my_papi are in TFG/my_papi/src
+    SRC_DIR = pathlib.Path(__file__).absolute().parents[4] / "my_papi" / "src"
+
+    # The interpreter alone is subtracted, so only the import is left
+    code = ("import sys, time\n"
+            "sys.path.insert(0, %r)\n"
+            "begin = time.perf_counter_ns()\n"
+            "%s\n"
+            "end = time.perf_counter_ns()\n"
+            "print(end - begin)\n"
+            "print(' '.join(m for m in %r if m in sys.modules))\n")
+
+    times = []
+    loaded = ""
+    for _ in range(repetitions):
+        out = subprocess.run([sys.executable, "-c",
+                              code % (str(SRC_DIR), "import MyPapi",
+                                      HEAVY_MODULES + LAZY_MODULES)],
+                             check=True, capture_output=True, text=True)
+        elapsed, loaded = (out.stdout.split("\n") + [""])[:2]
+        times.append(int(elapsed) / 1e6)
+
+    print("import MyPapi (%d runs): median = %.2f ms, min = %.2f ms, "
+          "max = %.2f ms" % (repetitions, statistics.median(times),
+                             min(times), max(times)))
+
+    if loaded:
+        print("[ERROR] The core of MyPapi loads: %s" % loaded)
+        sys.exit(-1)
+    if max_time is not None and statistics.median(times) > max_time:
+        print("[ERROR] The import takes more than %.2f ms" % max_time)
+        sys.exit(-1)
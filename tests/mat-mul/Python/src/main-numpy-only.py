@@ -104,10 +104,8 @@ if __name__ == "__main__":
     # Load a file with the events
     events_file = CFG_DIR / "events_matmul.cfg"
 
-    # Measures on all cpus
-    # cpus = None
-    # ! modify this to get the num of cpus automatic
-    cpus = list(range(2, 32))
+    # Measures on the cpus where the process can run (see taskset)
+    cpus = None
 
     # Output file with the measures
     csv_file = None
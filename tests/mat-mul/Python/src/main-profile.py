@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# --------------------------------------------------------------------------- #
+__author__ = "Juan Luis Padilla Salomé"
+__copyright__ = "Copyright 2021"
+__credits__ = ["University of Cantabria", "Pablo Abad", "Pablo Prieto"]
+__license__ = "GPL"
+__version__ = "1.0.0"
+__maintainer__ = "Juan Luis Padilla Salomé"
+__email__ = "juan-luis.padilla@alumnos.unican.es"
+__status__ = "Production"
+# --------------------------------------------------------------------------- #
+
+
+# --------------------------------------------------------------------------- #
+if __name__ == "__main__":
+    """Samples where the cycles and the instructions of the multiplication of
+    two matrices happen and writes them as collapsed stacks, one file per
+    event, to render flamegraphs (flamegraph.pl, speedscope).
+    @param option same as main.py, but the last one is the prefix of the
+        output files (default is "matmul").
+    """
+
+    # standard library
+    import sys
+
+    # 3rd party packages
+    from matrix import *
+
+    # local source
+
+    # ----------------------------------------------------------------------- #
+
+    MAX_MATRIX_SIZE = 100_000
+
+    # Reads the parameters and check the correctness
+    if len(sys.argv) < 4:
+        print("[ERROR] Wrong parameters.\n\tUsage: python3 main-profile.py "
+              "[MATRIX_TYPE] [MATRIX_SIZE] [MULTIPLICATION TYPE] [PREFIX]")
+        sys.exit(-1)
+
+    mat_type = sys.argv[1]
+    if mat_type != "RAND" and mat_type != "SEQ":
+        print("[ERROR] Wrong matrix type: %s.\n", mat_type)
+        sys.exit(-1)
+
+    dim_x_and_y = int(sys.argv[2])
+    if dim_x_and_y < 0 or dim_x_and_y > MAX_MATRIX_SIZE:
+        print("[ERROR] Matrix size out of bounds [0-%d].\n", MAX_MATRIX_SIZE)
+        sys.exit(-1)
+
+    mul_type = sys.argv[3]
+    if mul_type != "MULTITHREAD" and mul_type != "NORMAL" and mul_type != "TRANSPOSE":
+        print("[ERROR] Wrong multiplication type: %s.\n", mul_type)
+        sys.exit(-1)
+
+    # Create an object of the class matrix
+    m = matrix()
+
+    # Populate the matrices
+    if mat_type == "RAND":
+        M_a = m.init_rand(rows=dim_x_and_y, cols=dim_x_and_y)
+        M_b = m.init_rand(rows=dim_x_and_y, cols=dim_x_and_y)
+    elif mat_type == "SEQ":
+        M_a = m.init_seq(rows=dim_x_and_y, cols=dim_x_and_y)
+        M_b = m.init_seq(rows=dim_x_and_y, cols=dim_x_and_y)
+
+    # ----------------------------------------------------------------------- #
+    # Loads the my_papi library
+    # ----------------------------------------------------------------------- #
+    import pathlib
+
+    # Absolute path to this script
+    MY_PAPI_DIR = pathlib.Path(__file__).absolute()
+    # Now, we have to move to the root of this workspace ([prev. path]/TFG)
+    MY_PAPI_DIR = MY_PAPI_DIR.parent.parent.parent.parent.parent.absolute()
+    # From the root (TFG/) access to my_papi dir. and its content
+    MY_PAPI_DIR = MY_PAPI_DIR / "my_papi"
+    # Folder where the configuration files are located
+    CFG_DIR = MY_PAPI_DIR / "conf"
+    # Folder where the library is located
+    LIB_DIR = MY_PAPI_DIR / "lib"
+    # Folder where the source codes are located
+    SRC_DIR = MY_PAPI_DIR / "src"
+
+    # Add the source path and import the library
+    sys.path.insert(0, str(SRC_DIR))
+    from MyPapi import MyProfiler
+
+    # ----------------------------------------------------------------------- #
+    # Params for the profile
+    # ----------------------------------------------------------------------- #
+    # Path to the library, needed to create an object of class MyProfiler
+    libname = LIB_DIR / "libmy_papi.so"
+
+    # Load a file with the events
+    events_file = CFG_DIR / "events_matmul.cfg"
+
+    # Events sampled (the rest are just counted) and the occurrences between
+    # two samples
+    thresholds = {"cycles": 10_000_000, "instructions": 10_000_000}
+
+    # Prefix of the output files with the collapsed stacks
+    prefix = "matmul"
+    if len(sys.argv) == 5:
+        prefix = sys.argv[4]
+
+    # Now, we can create a object of MyProfiler and setup the config.
+    profiler = MyProfiler(str(libname))
+    profiler.prepare(str(events_file), thresholds)
+    # ----------------------------------------------------------------------- #
+
+    profiler.start()
+    # -------------------------- Region of Interest ------------------------- #
+    # Only the main thread is sampled, so MULTITHREAD just shows the wait
+    if mul_type == "MULTITHREAD":
+        M_c = m.mat_mul_multithread(M_a, M_b)
+    elif mul_type == "NORMAL":
+        M_c = m.mat_mul(M_a, M_b)
+    elif mul_type == "TRANSPOSE":
+        M_c = m.mat_mul_transpose(M_a, M_b)
+    # ------------------------ END Region of Interest ----------------------- #
+    profiler.stop()
+    for event in thresholds:
+        profiler.save("%s_%s.folded" % (prefix, event), event)
+    if profiler.dropped > 0:
+        print("[WARNING] %d samples dropped." % profiler.dropped)
+    profiler.finalize()
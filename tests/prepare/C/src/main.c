@@ -0,0 +1,167 @@
+/** 
+ * File:    main.c
+ * 
+ * Author:  Juan Luis Padilla Salome (juan-luis.padilla@alumnos.unican.es)
+ * Date:    Spring 2021
+ * 
+ * Summary of File:
+ * 
+ *   This file contains a benchmark of the time needed to prepare a measure
+ *   with my_papi as a function of the number of cpus and events. For each
+ *   combination, the first events of the file passed are written to a
+ *   temporary file (created with mkstemp, so several runs don't collide) and
+ *   the session is prepared several times.
+ */
+
+#include <ctype.h>
+#include <stdlib.h>
+#include <stdio.h>
+#include <string.h>
+#include <time.h>
+#include <unistd.h>
+#include "my_papi.h"
+
+#define NUM_REPETITIONS 10
+#define TMP_EVENTS_TEMPLATE "/tmp/my_papi_prepare_XXXXXX"
+
+/** 
+ * Returns the current time of a monotonic clock in nanoseconds.
+ */
+static long long now_ns()
+{
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return (long long)ts.tv_sec * 1000000000LL + ts.tv_nsec;
+}
+
+/** 
+ * Writes the first num_events lines with an event of events_file to
+ * tmp_file. Blank lines (also with '\r' or whitespace) and comments are
+ * skipped and the events are written without surrounding whitespace.
+ * Returns the number of events written.
+ */
+static int write_events(const char *events_file, const char *tmp_file,
+                        int num_events)
+{
+    int n = 0;
+    size_t length;
+    char line[MAX_LENGTH_EVENT_NAME], *event;
+    FILE *in = fopen(events_file, "r"), *out = fopen(tmp_file, "w");
+    if (in == NULL || out == NULL)
+    {
+        fprintf(stderr, "[ERROR] Couldn't open the events files.\n");
+        exit(EXIT_FAILURE);
+    }
+    while (n < num_events && fgets(line, sizeof(line), in) != NULL)
+    {
+        event = line;
+        while (isspace((unsigned char)*event))
+        {
+            event++;
+        }
+        length = strlen(event);
+        while (length > 0 && isspace((unsigned char)event[length - 1]))
+        {
+            event[--length] = '\0';
+        }
+        if (event[0] == '\0' || event[0] == '#')
+        {
+            continue;
+        }
+        fprintf(out, "%s\n", event);
+        n++;
+    }
+    fclose(in);
+    fclose(out);
+    return n;
+}
+
+/** 
+ * int main( int argc, char const *argv[] ) 
+ * 
+ * Summary of the main function:
+ * 
+ *    Prints a table with the mean time (us) of my_session_prepare for 1, 2,
+ *    4, ... cpus (up to all of them) and 1, 2, 4, ... events (up to all the
+ *    events of the file).
+ * 
+ * Usage:
+ *    ./main [EVENTS_FILE]
+ */
+int main(int argc, char const *argv[])
+{
+    int i, fd, cpus, events, num_events, prev_events, total_cpus;
+    char tmp_file[] = TMP_EVENTS_TEMPLATE;
+    long long begin;
+    double mean;
+    my_session_t *session;
+
+    // Reads the params passed by the user
+    if (argc < 2)
+    {
+        fprintf(stderr, "[ERROR] Wrong parameters.\nUsage: ./main "
+                        "[EVENTS_FILE]\n");
+        return EXIT_FAILURE;
+    }
+
+    // Temporary file with the events of each size
+    fd = mkstemp(tmp_file);
+    if (fd == -1)
+    {
+        fprintf(stderr, "[ERROR] Couldn't create the temporary file.\n");
+        return EXIT_FAILURE;
+    }
+    close(fd);
+
+    // The session is reused, so PAPI is initialized just once. The events are
+    // multiplexed so that any number of them fits in the counters
+    session = my_session_create();
+    my_session_set_multiplex(session, 1);
+    total_cpus = my_get_total_cpus();
+    int *cpus_list = (int *)malloc(sizeof(int) * total_cpus);
+    for (i = 0; i < total_cpus; i++)
+    {
+        cpus_list[i] = i;
+    }
+
+    printf("%8s %8s %16s\n", "cpus", "events", "prepare (us)");
+    prev_events = 0;
+    for (events = 1;; events *= 2)
+    {
+        // Stops when the file has no more events than the last size (e.g.,
+        // when their number is a power of two)
+        num_events = write_events(argv[1], tmp_file, events);
+        if (num_events == prev_events)
+        {
+            break;
+        }
+        prev_events = num_events;
+        for (cpus = 1;; cpus *= 2)
+        {
+            if (cpus > total_cpus)
+            {
+                cpus = total_cpus;
+            }
+            begin = now_ns();
+            for (i = 0; i < NUM_REPETITIONS; i++)
+            {
+                my_session_prepare(session, tmp_file, cpus, cpus_list);
+            }
+            mean = (double)(now_ns() - begin) / NUM_REPETITIONS / 1000.0;
+            printf("%8d %8d %16.1f\n", cpus, num_events, mean);
+            if (cpus == total_cpus)
+            {
+                break;
+            }
+        }
+        if (num_events < events)
+        {
+            break;
+        }
+    }
+
+    my_session_destroy(session);
+    free(cpus_list);
+    remove(tmp_file);
+    return EXIT_SUCCESS;
+}